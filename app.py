@@ -1,12 +1,31 @@
 import os
+import posixpath
 import sys
 import logging
-from flask import Flask, request, render_template, send_file, redirect, url_for, flash, jsonify, send_from_directory
-from PIL import Image, ImageDraw, ImageFont
+from flask import Flask, request, render_template, send_file, redirect, url_for, flash, jsonify, send_from_directory, Response
+from PIL import Image, ImageDraw, ImageFont, features
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
 from io import BytesIO
-import base64
+import functools
+import hashlib
+import itertools
+import csv
+import json
+import multiprocessing
+import queue
+import re
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+import weakref
+import zipfile
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import ExitStack, closing, contextmanager
+from werkzeug.utils import safe_join
 from subprocess import check_output
 
 # Configure logging to output to the console
@@ -20,6 +39,167 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 app.secret_key = 'your_secret_key'  # Replace with your own secure secret key
 
+# --- Metrics ---
+# Kept in-process and exposed in the Prometheus text format on /metrics
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Pipeline stages in the order a row goes through them
+STAGES = ('sheets_fetch', 'decode', 'font_load', 'wrap', 'layout', 'draw', 'composite', 'encode', 'write', 'preview')
+
+class Counter:
+    """A Prometheus counter, optionally with labels."""
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        """(name, ((label, value), ...), value) for every label combination seen so far."""
+        with self._lock:
+            return [(self.name, tuple(zip(self.labelnames, key)), value) for key, value in sorted(self._values.items())]
+
+class Histogram(Counter):
+    """A Prometheus histogram with cumulative buckets, optionally with labels."""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=STAGE_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = buckets
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * len(self.buckets) + [0, 0.0]  # Buckets, count, sum
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += 1
+            counts[-1] += value
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            items = sorted((key, list(counts)) for key, counts in self._values.items())
+        for key, counts in items:
+            labels = tuple(zip(self.labelnames, key))
+            for bound, count in zip(self.buckets + (float('inf'),), counts[:-2] + [counts[-2]]):
+                samples.append((self.name + '_bucket', labels + (('le', _format_metric_value(bound)),), count))
+            samples.append((self.name + '_count', labels, counts[-2]))
+            samples.append((self.name + '_sum', labels, counts[-1]))
+        return samples
+
+STAGE_SECONDS = Histogram('imgtool_stage_seconds', "Seconds spent in each pipeline stage, per row "
+                          "(per batch for sheets_fetch and decode).", ('stage',))
+ROWS = Counter('imgtool_rows_total', "Rows of batches by outcome.", ('status',))
+RENDER_CACHE_LOOKUPS = Counter('imgtool_render_cache_lookups_total', "Render cache lookups by result.", ('result',))
+BATCHES = Counter('imgtool_batches_total', "Batches rendered.")
+BATCH_SECONDS = Histogram('imgtool_batch_seconds', "Wall time of whole batches.",
+                          buckets=(1.0, 5.0, 15.0, 60.0, 300.0, 900.0, 3600.0))
+PREVIEWS = Counter('imgtool_previews_total', "Preview requests by outcome.", ('result',))
+PREVIEW_SECONDS = Histogram('imgtool_preview_seconds', "Time to render and encode previews.")
+METRICS = [STAGE_SECONDS, ROWS, RENDER_CACHE_LOOKUPS, BATCHES, BATCH_SECONDS, PREVIEWS, PREVIEW_SECONDS]
+
+def _format_metric_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+_stage_local = threading.local()
+
+@contextmanager
+def timed(stage):
+    """
+    Time a pipeline stage. The time goes to the stage collection of this thread if
+    collect_stages is active, and straight into the stage histogram otherwise.
+    Stages timed inside another one are left out of its time, so every second is
+    counted once. Can also be used as a decorator.
+    """
+    outer = getattr(_stage_local, 'nested', None)
+    _stage_local.nested = 0.0  # Seconds taken by stages timed inside this one
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        nested, _stage_local.nested = _stage_local.nested, outer
+        if outer is not None:
+            _stage_local.nested = outer + elapsed
+        elapsed -= nested
+        timings = getattr(_stage_local, 'timings', None)
+        if timings is None:
+            STAGE_SECONDS.observe(elapsed, stage=stage)
+        else:
+            timings[stage] = timings.get(stage, 0.0) + elapsed
+
+@contextmanager
+def collect_stages(timings=None):
+    """
+    Collect the stages timed in this thread into a dict of seconds by stage (a new
+    one unless given), for example to hand a row's timings back from a worker
+    process. Collections nest; the enclosing one does not see the inner stages.
+    """
+    previous = getattr(_stage_local, 'timings', None)
+    _stage_local.timings = timings = {} if timings is None else timings
+    try:
+        yield timings
+    finally:
+        _stage_local.timings = previous
+
+def add_stages(totals, timings):
+    for stage, seconds in timings.items():
+        totals[stage] = totals.get(stage, 0.0) + seconds
+    return totals
+
+def observe_stages(timings):
+    """Record collected stage timings in the stage histogram."""
+    for stage, seconds in timings.items():
+        STAGE_SECONDS.observe(seconds, stage=stage)
+
+def record_stages(timings):
+    """Hand stages timed in another thread to this thread's collection, or observe them if there is none."""
+    collected = getattr(_stage_local, 'timings', None)
+    if collected is None:
+        observe_stages(timings)
+    else:
+        add_stages(collected, timings)
+
+def render_metrics():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+
+    def family(name, kind, documentation, samples):
+        lines.append(f"# HELP {name} {documentation}")
+        lines.append(f"# TYPE {name} {kind}")
+        for sample_name, labels, value in samples:
+            if labels:
+                rendered = ','.join('%s="%s"' % (label, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                                    for label, v in labels)
+                sample_name += '{' + rendered + '}'
+            lines.append(f"{sample_name} {_format_metric_value(value)}")
+
+    for metric in METRICS:
+        family(metric.name, metric.kind, metric.documentation, metric.samples())
+    # The in-memory caches keep their own counters
+    caches = {'font': font_cache_stats(), 'measure': measure_cache_stats(), 'layout': layout_cache_stats(),
+              'emoji': emoji_cache_stats(), 'sheets': sheets_cache_stats()}
+    for counter in ('hits', 'misses'):
+        family(f'imgtool_cache_{counter}_total', 'counter', f"Lookups of the in-memory caches that were {counter}.",
+               [(f'imgtool_cache_{counter}_total', (('cache', name),), stats[counter])
+                for name, stats in caches.items()])
+    family('imgtool_cache_entries', 'gauge', "Entries held by the in-memory caches.",
+           [('imgtool_cache_entries', (('cache', name),), stats['size']) for name, stats in caches.items()])
+    return '\n'.join(lines) + '\n'
+
 # --- Google Sheets API Configuration ---
 SCOPE = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
 CREDENTIALS_FILE = 'access.json'  # Ensure this file is in the same directory as app.py
@@ -27,29 +207,298 @@ CREDENTIALS_FILE = 'access.json'  # Ensure this file is in the same directory as
 SPREADSHEET_KEY = '1XEt1-TN_0_-_qZZT5_0vG4MBbOUC57YqPGR1HuhLbvY'
 SHEET_NAME = 'Sheet1'  # Update if your sheet tab is named differently
 
+# --- Font Configuration ---
+FONTS_DIR = os.environ.get('FONTS_DIR', 'fonts')  # Font names in forms and styles are files in here
+FALLBACK_FONT_PATH = '/System/Library/Fonts/Helvetica.ttc'
+EMOJI_FONT_PATHS = [
+    '/System/Library/Fonts/Apple Color Emoji.ttc',
+    '/System/Library/Fonts/Apple Color Emoji.ttf',
+    '/Library/Fonts/Apple Color Emoji.ttf',
+    # Noto Color Emoji as packaged by Debian/Ubuntu, Arch and Fedora
+    '/usr/share/fonts/truetype/noto/NotoColorEmoji.ttf',
+    '/usr/share/fonts/noto/NotoColorEmoji.ttf',
+    '/usr/share/fonts/google-noto-emoji/NotoColorEmoji.ttf',
+]
+# Bitmap strikes to try, largest first since emoji are scaled down from them.
+# Colour emoji fonts only load at their strike sizes (Noto Color Emoji has just 109).
+EMOJI_FONT_SIZES = [160, 128, 109, 96, 64, 32]
+FONT_CACHE_SIZE = 64  # Max number of (path, size, layout engine) fonts kept loaded
+FONT_BUFFER_BYTES = int(os.environ.get('FONT_BUFFER_BYTES', 64 * 1024 * 1024))  # Font files kept in memory
+# Larger font files (such as Apple Color Emoji) are handed to FreeType by path instead
+MAX_FONT_BUFFER_SIZE = 16 * 1024 * 1024
+
+class LRUCache:
+    """
+    A small thread-safe LRU mapping with hit/miss counters.
+    A maxsize of 0 disables caching (every lookup is a miss). With weigh, entries
+    are also evicted while the total weight of the values (e.g. their size in
+    bytes) is over maxweight.
+    """
+    def __init__(self, maxsize, maxweight=None, weigh=None):
+        self.maxsize = maxsize
+        self.maxweight = maxweight
+        self.weigh = weigh
+        self.weight = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            if key in self._data:
+                self._discard(key)
+            self._data[key] = value
+            if self.weigh:
+                self.weight += self.weigh(value)
+            while len(self._data) > self.maxsize or (self.weigh and self.weight > self.maxweight and len(self._data) > 1):
+                self._discard(next(iter(self._data)))
+
+    def _discard(self, key):
+        value = self._data.pop(key)
+        if self.weigh:
+            self.weight -= self.weigh(value)
+        return value
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            return self._discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.weight = 0
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        stats = {'hits': self.hits, 'misses': self.misses, 'size': len(self._data), 'maxsize': self.maxsize}
+        if self.weigh:
+            stats.update(weight=self.weight, maxweight=self.maxweight)
+        return stats
+
+# Raw font file contents, read once per process and shared by every size of that font
+_font_buffers = LRUCache(FONT_CACHE_SIZE, FONT_BUFFER_BYTES, weigh=len)
+_font_cache = LRUCache(FONT_CACHE_SIZE)
+_FONT_LOAD_FAILED = object()
+
+def _open_font_file(path):
+    """
+    Return the font file at path as something ImageFont.truetype loads: its contents,
+    read from disk only the first time, or the path itself for very large files.
+    Raises OSError for anything but a regular file.
+    """
+    if not os.path.isfile(path):
+        raise OSError(f"not a font file: {path}")
+    data = _font_buffers.get(path)
+    if data is None:
+        if os.path.getsize(path) > MAX_FONT_BUFFER_SIZE:
+            return path
+        with open(path, 'rb') as f:
+            data = f.read(MAX_FONT_BUFFER_SIZE + 1)
+        if len(data) > MAX_FONT_BUFFER_SIZE:
+            return path
+        _font_buffers.put(path, data)
+    return BytesIO(data)
+
+def get_font(path, size, layout_engine=None):
+    """
+    Return a FreeType font for (path, size, layout_engine) from the process-wide registry.
+    Fonts are built from a shared in-memory copy of the file; failed loads are remembered
+    too, so a missing font is only probed once. Raises OSError if the font cannot be loaded.
+    """
+    key = (path, size, layout_engine)
+    font = _font_cache.get(key)
+    if font is None:
+        try:
+            with timed('font_load'):
+                font = ImageFont.truetype(_open_font_file(path), size, layout_engine=layout_engine)
+        except OSError as e:
+            logger.debug("Could not load font %s at size %s: %s", path, size, e)
+            _font_buffers.pop(path)
+            font = _FONT_LOAD_FAILED
+        _font_cache.put(key, font)
+    if font is _FONT_LOAD_FAILED:
+        raise OSError(f"cannot load font {path} at size {size}")
+    return font
+
+@functools.lru_cache(maxsize=None)
+def _resolve_emoji_font():
+    """Find the first emoji font path and size that loads. Probed once per process."""
+    for path in EMOJI_FONT_PATHS:
+        if os.path.exists(path):
+            for size in EMOJI_FONT_SIZES:
+                try:
+                    get_font(path, size)
+                    logger.debug("Using emoji font %s at size %s", path, size)
+                    return (path, size)
+                except OSError:
+                    continue
+    logger.debug("No emoji font available")
+    return None
+
+def get_emoji_font():
+    """Return the colour emoji font, or None if no emoji font is installed."""
+    spec = _resolve_emoji_font()
+    if spec is None:
+        return None
+    return get_font(*spec)
+
+@functools.lru_cache(maxsize=1)
+def _default_font():
+    return ImageFont.load_default()
+
+def load_regular_font(font_name, font_size):
+    """
+    Load the font selected in the form, falling back to Helvetica and then
+    to Pillow's built-in default font.
+    """
+    try:
+        # Font names come from the form, so only files under FONTS_DIR are loaded
+        path = safe_join(FONTS_DIR, font_name)
+        if path is None:
+            raise OSError(f"font outside {FONTS_DIR}: {font_name}")
+        return get_font(path, font_size)
+    except OSError:
+        try:
+            return get_font(FALLBACK_FONT_PATH, font_size)
+        except OSError:
+            logger.error("Failed to load fonts, using default")
+            return _default_font()
+
+def font_cache_stats():
+    """Hit/miss counters of the font registry."""
+    return _font_cache.stats()
+
+# Code points that are drawn as emoji on their own: pictographs, and the BMP
+# symbols that default to emoji presentation
+_EMOJI_PRESENTATION = (
+    '\U0001F000-\U0001FAFF'
+    '\u231A\u231B\u23E9-\u23EC\u23F0\u23F3\u25FD\u25FE\u2614\u2615\u2648-\u2653\u267F\u2693'
+    '\u26A1\u26AA\u26AB\u26BD\u26BE\u26C4\u26C5\u26CE\u26D4\u26EA\u26F2\u26F3\u26F5\u26FA'
+    '\u26FD\u2705\u270A\u270B\u2728\u274C\u274E\u2753-\u2755\u2757\u2795-\u2797\u27B0\u27BF'
+    '\u2B1B\u2B1C\u2B50\u2B55'
+)
+# Symbols that are text by default and only emoji when followed by U+FE0F, as in ❤️
+_EMOJI_TEXT_DEFAULT = (
+    '\u00A9\u00AE\u203C\u2049\u2122\u2139\u2194-\u2199\u21A9\u21AA\u2328\u23CF\u23ED-\u23EF'
+    '\u23F1\u23F2\u23F8-\u23FA\u24C2\u25AA\u25AB\u25B6\u25C0\u25FB\u25FC\u2600-\u27BF'
+    '\u2934\u2935\u2B05-\u2B07\u3030\u303D\u3297\u3299'
+)
+_SKIN_TONE = '[\\U0001F3FB-\\U0001F3FF]'
+_EMOJI_TAGS = '(?:[\\U000E0020-\\U000E007E]+\\U000E007F)?'  # Tag sequences, as in the flags of England and Scotland
+_EMOJI_ZWJ = f'(?:\\u200D[{_EMOJI_PRESENTATION}{_EMOJI_TEXT_DEFAULT}]\\uFE0F?{_SKIN_TONE}?)*'
+# One emoji grapheme cluster: a flag, a keycap, or an emoji with its presentation
+# selector, skin tone, tags and any ZWJ-joined emoji. Every cluster starts with a
+# character from one class and the alternatives check it by looking behind, so
+# searches skip plain text in a single C-level scan for that class.
+_EMOJI_CLUSTER = (
+    f'[0-9#*{_EMOJI_PRESENTATION}{_EMOJI_TEXT_DEFAULT}]'
+    '(?:(?<=[\\U0001F1E6-\\U0001F1FF])[\\U0001F1E6-\\U0001F1FF]'
+    '|(?<=[0-9#*])\\uFE0F?\\u20E3'
+    f'|(?<=[{_EMOJI_PRESENTATION}])\\uFE0F?{_SKIN_TONE}?{_EMOJI_TAGS}{_EMOJI_ZWJ}'
+    f'|(?<=[{_EMOJI_TEXT_DEFAULT}])\\uFE0F{_SKIN_TONE}?{_EMOJI_TAGS}{_EMOJI_ZWJ})'
+)
+# Adjacent clusters form one run, drawn together like any other segment
+_EMOJI_RUN_RE = re.compile(f'{_EMOJI_CLUSTER}(?:{_EMOJI_CLUSTER})*')
+
+def emoji_spans(text):
+    """
+    Yield (start, end, is_emoji) spans that cover text, alternating between plain
+    text and runs of emoji. Emoji grapheme clusters are never split, so ZWJ
+    sequences, skin tones, flags and keycaps stay whole.
+    """
+    position = 0
+    for match in _EMOJI_RUN_RE.finditer(text):
+        start, end = match.span()
+        if start > position:
+            yield position, start, False
+        yield start, end, True
+        position = end
+    if position < len(text):
+        yield position, len(text), False
+
 def has_emoji(text):
     """Check if text contains any emoji characters."""
-    return any(ord(char) > 0xFFFF for char in text)
+    return _EMOJI_RUN_RE.search(text) is not None
+
+# --- Text Measurement Cache ---
+MEASURE_CACHE_SIZE = 50000  # Max number of (font, string) measurements kept
+_measure_cache = LRUCache(MEASURE_CACHE_SIZE)
+# Every font object gets a process-unique token, so measurements never outlive or
+# get confused with the font they were taken with
+_font_ids = weakref.WeakKeyDictionary()
+_font_ids_lock = threading.Lock()
+_font_id_counter = itertools.count()
+
+def _font_identity(font):
+    if font is None:
+        return None
+    with _font_ids_lock:
+        ident = _font_ids.get(font)
+        if ident is None:
+            ident = _font_ids[font] = next(_font_id_counter)
+    return ident
+
+def text_bbox(text, font, draw):
+    """
+    Return the (left, top, right, bottom) box covered by text drawn at the origin.
+    Memoized per (font, size, string); raises if the text cannot be measured.
+    """
+    key = (_font_identity(font), getattr(font, 'size', None), draw.fontmode, text)
+    bbox = _measure_cache.get(key)
+    if bbox is None:
+        bbox = tuple(draw.textbbox((0, 0), text, font=font))
+        _measure_cache.put(key, bbox)
+    return bbox
 
 def measure_text(text, font, draw):
     """
     Measure the width and height of the given text using the provided font and draw object.
     Uses textbbox for more accurate measurements, especially with emoji fonts.
+    Results are memoized per (font, size, string).
     Returns a tuple (width, height).
     """
     try:
-        bbox = draw.textbbox((0, 0), text, font=font)
-        return (bbox[2] - bbox[0], bbox[3] - bbox[1])
+        bbox = text_bbox(text, font, draw)
     except Exception as e:
         logger.error("textbbox failed: %s", e)
         # Fallback to a rough estimate if all else fails
         return (len(text) * (font.size // 2), font.size)
+    return (bbox[2] - bbox[0], bbox[3] - bbox[1])
+
+def measure_cache_stats():
+    """Hit/miss counters of the text measurement cache."""
+    return _measure_cache.stats()
 
 def wrap_text(text, font, max_width, draw, measure_func=None):
     """
     Wrap the text into multiple lines so that each line does not exceed max_width.
     Returns a list of lines.
     
+    Each word and the space advance are measured once and line widths are estimated
+    by summing them; only the candidate lines around each break are measured in full
+    (which accounts for kerning and side bearings), so the result matches a greedy
+    wrap that measures every growing line, in linear rather than quadratic time.
+    
     Args:
         text: The text to wrap
         font: The default font to use
@@ -63,33 +512,153 @@ def wrap_text(text, font, max_width, draw, measure_func=None):
     words = text.split()
     if not words:
         return []
+    word_widths = [measure_func(word, draw)[0] for word in words]
+    space_width = max(0, measure_func("x x", draw)[0] - measure_func("xx", draw)[0])
+    
+    def fits(start, end):
+        return measure_func(" ".join(words[start:end]), draw)[0] <= max_width
+    
     lines = []
-    current_line = words[0]
-    for word in words[1:]:
-        test_line = current_line + " " + word
-        w, _ = measure_func(test_line, draw)
-        if w <= max_width:
-            current_line = test_line
-        else:
-            lines.append(current_line)
-            current_line = word
-    lines.append(current_line)
+    start = 0
+    while start < len(words):
+        # Estimate how many words fit from the accumulated widths
+        end = start + 1
+        width = word_widths[start]
+        while end < len(words) and width + space_width + word_widths[end] <= max_width:
+            width += space_width + word_widths[end]
+            end += 1
+        # Correct the estimate with exact measurements of the lines around the break
+        grew = False
+        while end < len(words) and fits(start, end + 1):
+            end += 1
+            grew = True
+        if not grew:
+            while end - start > 1 and not fits(start, end):
+                end -= 1
+        lines.append(" ".join(words[start:end]))
+        start = end
     return lines
 
+# --- Google Sheets Client ---
+SHEETS_CACHE_TTL = int(os.environ.get('SHEETS_CACHE_TTL', 60))  # Seconds worksheet lists and columns are reused
+SHEET_PAGE_SIZE = int(os.environ.get('SHEET_PAGE_SIZE', 1000))  # Rows per range request when streaming a sheet
+
+class TTLCache:
+    """
+    Values that expire ttl seconds after they were loaded, with hit/miss counters.
+    Concurrent loads of the same key are coalesced into a single loader call
+    whose result (or exception) every waiting caller receives.
+    """
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = {}
+        self._inflight = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get_or_load(self, key, loader):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.hits += 1
+                return entry[1]
+            future = self._inflight.get(key)
+            if future is not None:
+                # Someone is already loading this key; wait for their result
+                self.hits += 1
+                loading = False
+            else:
+                self.misses += 1
+                future = self._inflight[key] = Future()
+                generation = self._generation
+                loading = True
+        if not loading:
+            return future.result()
+        
+        try:
+            value = loader()
+        except BaseException as e:
+            with self._lock:
+                self._inflight.pop(key, None)
+            future.set_exception(e)
+            raise
+        with self._lock:
+            self._inflight.pop(key, None)
+            # Results loaded before an invalidation are handed out once but not kept
+            if generation == self._generation:
+                self._data[key] = (time.monotonic() + self.ttl, value)
+        future.set_result(value)
+        return value
+
+    def invalidate(self):
+        with self._lock:
+            self._data.clear()
+            self._generation += 1
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._data), 'ttl': self.ttl}
+
+_sheets_client = None
+_sheets_client_lock = threading.Lock()
+_sheets_cache = TTLCache(SHEETS_CACHE_TTL)
+
+def get_sheets_client():
+    """
+    Return the process-wide authorized gspread client. Credentials are read once;
+    the client refreshes its access token itself when it expires.
+    """
+    global _sheets_client
+    with _sheets_client_lock:
+        if _sheets_client is None:
+            logger.debug("Loading credentials from %s", CREDENTIALS_FILE)
+            credentials = ServiceAccountCredentials.from_json_keyfile_name(CREDENTIALS_FILE, SCOPE)
+            _sheets_client = gspread.authorize(credentials)
+            logger.debug("Authorized with Google Sheets")
+    return _sheets_client
+
+def _fetch(call, *args, **kwargs):
+    """Make one Sheets API request. Only requests are timed, not the cache loaders around them."""
+    with timed('sheets_fetch'):
+        return call(*args, **kwargs)
+
+def _open_spreadsheet():
+    def load():
+        sh = _fetch(get_sheets_client().open_by_key, SPREADSHEET_KEY)
+        logger.debug("Opened spreadsheet with key: %s", SPREADSHEET_KEY)
+        return sh
+    return _sheets_cache.get_or_load('spreadsheet', load)
+
+def _get_worksheets():
+    return _sheets_cache.get_or_load('worksheets', lambda: _fetch(_open_spreadsheet().worksheets))
+
+def _get_worksheet(sheet_name):
+    for worksheet in _get_worksheets():
+        if worksheet.title == sheet_name:
+            return worksheet
+    raise gspread.WorksheetNotFound(sheet_name)
+
+def invalidate_sheets_cache():
+    """Drop cached worksheet lists and columns so the next request reads the spreadsheet again."""
+    _sheets_cache.invalidate()
+    logger.info("Google Sheets cache invalidated")
+
+def sheets_cache_stats():
+    """Hit/miss counters of the Google Sheets cache."""
+    return _sheets_cache.stats()
+
 def get_all_sheets():
     """
     Get a list of all available sheets in the spreadsheet.
     """
-    logger.debug("Loading credentials from %s", CREDENTIALS_FILE)
-    credentials = ServiceAccountCredentials.from_json_keyfile_name(CREDENTIALS_FILE, SCOPE)
-    gc = gspread.authorize(credentials)
-    logger.debug("Authorized with Google Sheets")
-    
-    sh = gc.open_by_key(SPREADSHEET_KEY)
-    logger.debug("Opened spreadsheet with key: %s", SPREADSHEET_KEY)
-    
-    worksheets = sh.worksheets()
-    return [ws.title for ws in worksheets]
+    return [ws.title for ws in _get_worksheets()]
+
+def _strip_header(texts):
+    # Skip the header row if the first cell is "text"
+    if texts and texts[0].lower() == 'text':
+        return texts[1:]
+    return texts
 
 def get_texts_from_sheet(sheet_name=None):
     """
@@ -98,38 +667,502 @@ def get_texts_from_sheet(sheet_name=None):
     Args:
         sheet_name: Name of the sheet to fetch texts from. If None, uses default SHEET_NAME.
     """
-    logger.debug("Loading credentials from %s", CREDENTIALS_FILE)
-    credentials = ServiceAccountCredentials.from_json_keyfile_name(CREDENTIALS_FILE, SCOPE)
-    gc = gspread.authorize(credentials)
-    logger.debug("Authorized with Google Sheets")
+    sheet_name = sheet_name or SHEET_NAME
+    texts = _strip_header(_sheets_cache.get_or_load(
+        ('col_values', sheet_name), lambda: _fetch(_get_worksheet(sheet_name).col_values, 1)))
+    logger.debug("Fetched %d texts from sheet '%s'", len(texts), sheet_name)
+    return list(texts)
+
+def iter_texts_from_sheet(sheet_name=None, page_size=None):
+    """
+    Yield the texts in the first column of a Google Sheet, fetching SHEET_PAGE_SIZE
+    rows per request. The next page is fetched while the current one is consumed,
+    so rendering starts after the first page and memory stays bounded however long
+    the sheet is. Yields the same texts as get_texts_from_sheet.
+    """
+    sheet_name = sheet_name or SHEET_NAME
+    page_size = page_size or SHEET_PAGE_SIZE
+    worksheet = _get_worksheet(sheet_name)
+    row_count = worksheet.row_count
     
-    sh = gc.open_by_key(SPREADSHEET_KEY)
-    logger.debug("Opened spreadsheet with key: %s", SPREADSHEET_KEY)
+    def fetch(first):
+        last = min(first + page_size - 1, row_count)
+        return worksheet.get(f"A{first}:A{last}"), last - first + 1
     
-    worksheet = sh.worksheet(sheet_name or SHEET_NAME)
-    texts = worksheet.col_values(1)
-    # Optionally, skip the header row if the first cell is "text"
-    if texts and texts[0].lower() == 'text':
-        texts = texts[1:]
-    logger.debug("Fetched texts: %s", texts)
+    count = 0
+    blanks = 0  # Empty cells are only yielded once a later cell has a value, like col_values
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix='sheet-pages') as fetcher:
+        page = fetcher.submit(fetch, 1) if row_count else None
+        for first in range(1, row_count + 1, page_size):
+            # Timed as the wait for the page, which is what fetching costs the batch
+            with timed('sheets_fetch'):
+                rows, size = page.result()
+            if first + page_size <= row_count:
+                page = fetcher.submit(fetch, first + page_size)
+            for i, row in enumerate(rows):
+                text = row[0] if row else ''
+                if first == 1 and i == 0 and text.lower() == 'text':
+                    continue
+                if not text:
+                    blanks += 1
+                    continue
+                for _ in range(blanks):
+                    yield ''
+                blanks = 0
+                count += 1
+                yield text
+            # Trailing empty rows of a range are left out of the response
+            blanks += size - len(rows)
+    logger.debug("Streamed %d texts from sheet '%s'", count, sheet_name)
+
+def get_texts_from_sheets(sheet_names=None):
+    """
+    Fetch the first columns of several worksheets, or of every worksheet when
+    sheet_names is None, with a single batched values request. Returns a dict
+    of texts by sheet name in the order asked for.
+    """
+    known = get_all_sheets()
+    sheet_names = list(sheet_names) if sheet_names else known
+    for sheet_name in sheet_names:
+        if sheet_name not in known:
+            raise gspread.WorksheetNotFound(sheet_name)
+    ranges = ["'%s'!A:A" % name.replace("'", "''") for name in sheet_names]
+    response = _sheets_cache.get_or_load(
+        ('values_batch_get', tuple(sheet_names)),
+        lambda: _fetch(_open_spreadsheet().values_batch_get, ranges, params={'majorDimension': 'COLUMNS'}))
+    texts = {}
+    for sheet_name, value_range in zip(sheet_names, response.get('valueRanges', [])):
+        columns = value_range.get('values') or [[]]
+        texts[sheet_name] = _strip_header(list(columns[0]))
+    logger.debug("Fetched %d texts from %d sheets", sum(map(len, texts.values())), len(texts))
     return texts
 
+def get_sample_text_from_sheet(sheet_name=None):
+    """Return the first text of a Google Sheet, reading only its first two cells."""
+    sheet_name = sheet_name or SHEET_NAME
+    rows = _sheets_cache.get_or_load(('sample', sheet_name),
+                                     lambda: _fetch(_get_worksheet(sheet_name).get, 'A1:A2'))
+    texts = _strip_header([row[0] if row else '' for row in rows])
+    return texts[0] if texts else None
+
+# --- Text Sources ---
+# Where batch texts come from unless a request names another source: 'gsheets',
+# or a local file such as 'csv:exports/campaign.csv' (see get_text_source)
+TEXT_SOURCE = os.environ.get('TEXT_SOURCE', 'gsheets')
+# Local sources named in requests must live under this directory
+TEXT_SOURCES_DIR = os.environ.get('TEXT_SOURCES_DIR', 'sources')
+
+class TextSource:
+    """A collection of named sheets, each holding a column of texts to render."""
+    def list_sheets(self):
+        raise NotImplementedError
+
+    def iter_texts(self, sheet_name=None):
+        """Yield the texts of a sheet in order without loading them all at once."""
+        raise NotImplementedError
+
+    def get_texts(self, sheet_name=None):
+        return list(self.iter_texts(sheet_name))
+
+    def get_sample_text(self, sheet_name=None):
+        with closing(self.iter_texts(sheet_name)) as texts:
+            return next(texts, None)
+
+    def iter_sheets(self, sheet_names=None):
+        """Yield (sheet_name, texts) for the named sheets, or for every sheet when None."""
+        for sheet_name in sheet_names or self.list_sheets():
+            yield sheet_name, self.iter_texts(sheet_name)
+
+class GoogleSheetsSource(TextSource):
+    """The first column of each worksheet of SPREADSHEET_KEY."""
+    def list_sheets(self):
+        return get_all_sheets()
+
+    def iter_texts(self, sheet_name=None):
+        return iter_texts_from_sheet(sheet_name)
+
+    def get_texts(self, sheet_name=None):
+        return get_texts_from_sheet(sheet_name)
+
+    def get_sample_text(self, sheet_name=None):
+        return get_sample_text_from_sheet(sheet_name)
+
+    def iter_sheets(self, sheet_names=None):
+        # One batched request for all of them instead of a round trip per sheet
+        return iter(get_texts_from_sheets(sheet_names).items())
+
+class _FileSource(TextSource):
+    """
+    A local export: a single file is one sheet named after the file, and a
+    directory holds one sheet per file with the source's extension.
+    """
+    extensions = ()
+
+    def __init__(self, path):
+        self.path = path
+
+    def _sheet_paths(self):
+        if os.path.isdir(self.path):
+            return {os.path.splitext(name)[0]: os.path.join(self.path, name)
+                    for name in sorted(os.listdir(self.path)) if name.lower().endswith(self.extensions)}
+        return {os.path.splitext(os.path.basename(self.path))[0]: self.path}
+
+    def list_sheets(self):
+        return list(self._sheet_paths())
+
+    def iter_texts(self, sheet_name=None):
+        paths = self._sheet_paths()
+        if sheet_name is None and paths:
+            sheet_name = next(iter(paths))
+        if sheet_name not in paths:
+            raise LookupError(f"Unknown sheet '{sheet_name}' in {self.path}")
+        return self._iter_file(paths[sheet_name])
+
+    def _iter_file(self, path):
+        raise NotImplementedError
+
+class CSVSource(_FileSource):
+    """CSV exports; texts are the first column."""
+    extensions = ('.csv',)
+
+    def _iter_file(self, path):
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            for i, row in enumerate(csv.reader(f)):
+                text = row[0] if row else ''
+                # Skip the header row if the first cell is "text"
+                if i == 0 and text.lower() == 'text':
+                    continue
+                yield text
+
+class JSONLSource(_FileSource):
+    """JSON Lines exports; each line is a string or an object with a "text" field."""
+    extensions = ('.jsonl',)
+
+    def _iter_file(self, path):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                value = json.loads(line)
+                yield value.get('text', '') if isinstance(value, dict) else str(value)
+
+class SQLiteSource(TextSource):
+    """A SQLite database; every table is a sheet and texts are its first column in row order."""
+    def __init__(self, path):
+        self.path = path
+
+    def _connect(self):
+        # Read-only, so a mistyped path fails instead of creating an empty database
+        return sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+
+    def list_sheets(self):
+        with closing(self._connect()) as conn:
+            rows = conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' "
+                                "AND name NOT LIKE 'sqlite_%' ORDER BY name").fetchall()
+        return [row[0] for row in rows]
+
+    def iter_texts(self, sheet_name=None):
+        sheets = self.list_sheets()
+        if sheet_name is None and sheets:
+            sheet_name = sheets[0]
+        if sheet_name not in sheets:
+            raise LookupError(f"Unknown table '{sheet_name}' in {self.path}")
+        return self._iter_table(sheet_name.replace('"', '""'))
+
+    def _iter_table(self, table):
+        with closing(self._connect()) as conn:
+            try:
+                rows = conn.execute(f'SELECT * FROM "{table}" ORDER BY rowid')
+            except sqlite3.OperationalError:
+                # WITHOUT ROWID tables
+                rows = conn.execute(f'SELECT * FROM "{table}"')
+            for row in rows:
+                yield '' if row[0] is None else str(row[0])
+
+TEXT_SOURCE_KINDS = {
+    'csv': CSVSource,
+    'jsonl': JSONLSource,
+    'sqlite': SQLiteSource,
+}
+_SOURCE_EXTENSIONS = {'.csv': 'csv', '.jsonl': 'jsonl', '.db': 'sqlite', '.sqlite': 'sqlite', '.sqlite3': 'sqlite'}
+
+def get_text_source(spec=None, trusted=False):
+    """
+    Build the text source described by spec: 'gsheets', or '<kind>:<path>' with kind
+    one of csv, jsonl or sqlite. The kind may be left out for files with a known
+    extension. Without a spec the configured TEXT_SOURCE is used. Untrusted specs
+    (from requests) may only name paths inside TEXT_SOURCES_DIR.
+    """
+    if not spec:
+        spec, trusted = app.config.get('TEXT_SOURCE', TEXT_SOURCE), True
+    if spec == 'gsheets':
+        return GoogleSheetsSource()
+    
+    kind, sep, path = spec.partition(':')
+    if not sep or kind not in TEXT_SOURCE_KINDS:
+        kind, path = _SOURCE_EXTENSIONS.get(os.path.splitext(spec)[1].lower()), spec
+    if kind is None:
+        raise ValueError(f"Unknown text source '{spec}'")
+    if not trusted:
+        path = safe_join(TEXT_SOURCES_DIR, path)
+        if path is None:
+            raise ValueError(f"Text source '{spec}' is outside {TEXT_SOURCES_DIR}")
+    if not os.path.exists(path):
+        raise ValueError(f"Text source '{spec}' does not exist")
+    return TEXT_SOURCE_KINDS[kind](path)
+
+def request_text_source():
+    """The text source named by the request's 'source' parameter, or the configured default."""
+    return get_text_source(request.values.get('source'))
+
+def requested_sheet_names(form, source):
+    """
+    The sheets a batch form asks to render together: every sheet of the source when
+    all_sheets is on, else any sheet_names fields. None means a single-sheet batch.
+    """
+    if form.get('all_sheets') == 'on':
+        return source.list_sheets()
+    return form.getlist('sheet_names') or None
+
+# --- Uploads ---
+# Uploaded base images are stored once per content, as <sha256><ext>, whatever
+# they were called. The digest is the upload's ID. Images over MAX_UPLOAD_PIXELS
+# are downscaled when they arrive, so batches never decode more than that.
+UPLOADS_DIR = os.environ.get('UPLOADS_DIR', 'uploads')
+MAX_UPLOAD_PIXELS = int(os.environ.get('MAX_UPLOAD_PIXELS', 40_000_000))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+UPLOAD_ID_RE = re.compile(r'[0-9a-f]{64}')
+
+class ImageTooLarge(ValueError):
+    """An upload with more pixels than Pillow will decode (twice Image.MAX_IMAGE_PIXELS)."""
+
+def ingest_upload(stream, uploads_dir=None):
+    """
+    Store an uploaded image read from a file-like stream and return its upload info
+    (see get_upload). The stream is copied to disk in chunks while it is hashed;
+    bytes that were uploaded before are not stored or decoded again. Raises
+    ValueError if the upload is not an image, and ImageTooLarge if it has too many
+    pixels to decode safely.
+    """
+    uploads_dir = uploads_dir or UPLOADS_DIR
+    os.makedirs(uploads_dir, exist_ok=True)
+    digest = hashlib.sha256()
+    tmp_path = os.path.join(uploads_dir, f".{uuid.uuid4().hex}.tmp")
+    try:
+        with open(tmp_path, 'wb') as f:
+            for chunk in iter(lambda: stream.read(UPLOAD_CHUNK_SIZE), b''):
+                digest.update(chunk)
+                f.write(chunk)
+        upload_id = digest.hexdigest()
+        info = get_upload(upload_id, uploads_dir)
+        if info is None:
+            info = _store_upload(tmp_path, upload_id, uploads_dir)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return info
+
+def _store_upload(tmp_path, upload_id, uploads_dir):
+    try:
+        with Image.open(tmp_path) as im:
+            original_size = size = im.size
+            if im.width * im.height <= MAX_UPLOAD_PIXELS:
+                # Only the header was read; the bytes are kept as they are
+                filename = upload_id + UPLOAD_EXTENSIONS.get(im.format, '.png')
+                os.replace(tmp_path, os.path.join(uploads_dir, filename))
+            else:
+                filename = upload_id + _downscale_upload(im, os.path.join(uploads_dir, upload_id))
+                with Image.open(os.path.join(uploads_dir, filename)) as stored:
+                    size = stored.size
+    except Image.DecompressionBombError:
+        raise ImageTooLarge(f"Image too large: at most {2 * Image.MAX_IMAGE_PIXELS / 1e6:.0f} megapixels are supported")
+    except OSError as e:
+        raise ValueError(f"Not a supported image: {e}")
+    # Written last and atomically, so an upload is only found once it is complete
+    meta_path = os.path.join(uploads_dir, upload_id + '.json')
+    with open(meta_path + '.tmp', 'w') as f:
+        json.dump({'filename': filename, 'size': size, 'original_size': original_size}, f)
+    os.replace(meta_path + '.tmp', meta_path)
+    return get_upload(upload_id, uploads_dir)
+
+# Extensions of stored uploads by Pillow format; other formats are stored as they
+# came, as PNG when downscaled
+UPLOAD_EXTENSIONS = {'JPEG': '.jpg', 'PNG': '.png', 'WEBP': '.webp', 'GIF': '.gif', 'BMP': '.bmp', 'TIFF': '.tiff'}
+
+def _downscale_upload(im, path):
+    """Save im scaled to fit MAX_UPLOAD_PIXELS at path plus an extension, and return the extension."""
+    factor = (MAX_UPLOAD_PIXELS / (im.width * im.height)) ** 0.5
+    size = (max(1, int(im.width * factor)), max(1, int(im.height * factor)))
+    icc_profile = im.info.get('icc_profile')
+    image_format = im.format
+    if im.mode == 'P':
+        im = im.convert('RGBA')
+    # thumbnail decodes JPEGs at a reduced scale (draft) and reduces by whole factors
+    # before resampling, so the full-size image is never held in memory
+    im.thumbnail(size, Image.Resampling.LANCZOS, reducing_gap=2.0)
+    if image_format == 'JPEG':
+        im.save(path + '.jpg', 'JPEG', quality=95, icc_profile=icc_profile)
+        return '.jpg'
+    im.save(path + '.png', 'PNG', icc_profile=icc_profile)
+    return '.png'
+
+def get_upload(upload_id, uploads_dir=None):
+    """
+    Return the info of a stored upload, or None if there is none with this ID:
+    
+        {'id': sha256 of the uploaded bytes, 'path': the stored image,
+         'size': (width, height) as stored, 'original_size': (width, height) as uploaded,
+         'scale': stored width / uploaded width}
+    """
+    if not UPLOAD_ID_RE.fullmatch(upload_id or ''):
+        return None
+    uploads_dir = uploads_dir or UPLOADS_DIR
+    try:
+        with open(os.path.join(uploads_dir, upload_id + '.json')) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    path = os.path.join(uploads_dir, meta['filename'])
+    if not os.path.exists(path):
+        return None
+    size, original_size = tuple(meta['size']), tuple(meta['original_size'])
+    return {'id': upload_id, 'path': path, 'size': size, 'original_size': original_size,
+            'scale': size[0] / original_size[0]}
+
+# --- Previews ---
+# Single texts rendered while a style is being edited, onto the upload decoded once
+# at a reduced size and kept, and sent back as a small JPEG or WebP
+PREVIEW_MAX_SIDE = int(os.environ.get('PREVIEW_MAX_SIDE', 1024))
+PREVIEW_QUALITY = 80
+PREVIEW_IMAGE_FORMATS = {'jpeg': ('JPEG', 'image/jpeg'), 'webp': ('WEBP', 'image/webp')}
+PREVIEW_BASES_SIZE = 16  # Decoded uploads kept for previews
+MAX_PREVIEW_SESSIONS = 1000
+_preview_bases = LRUCache(PREVIEW_BASES_SIZE)
+_preview_decodes = {}  # (upload ID, size) -> Future of a decode in progress
+_preview_decodes_lock = threading.Lock()
+# Uploads are decoded for previews as soon as they arrive, before the first preview is asked for
+_preview_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='preview-decode')
+# Newest preview sequence number of each editing session, oldest session first
+_preview_sessions = OrderedDict()
+_preview_sessions_lock = threading.Lock()
+
+def preview_base(upload, max_side=None):
+    """
+    Return (image, scale): the upload decoded to fit max_side as RGBA, and its scale
+    relative to the image as uploaded. JPEGs are decoded at a reduced scale. Images
+    are cached per upload and size and must not be modified; concurrent callers
+    wait for the same decode.
+    """
+    max_side = max_side or PREVIEW_MAX_SIDE
+    key = (upload['id'], max_side)
+    entry = _preview_bases.get(key)
+    if entry is not None:
+        return entry
+    with _preview_decodes_lock:
+        decoding = _preview_decodes.get(key)
+        if decoding is None:
+            future = _preview_decodes[key] = Future()
+    if decoding is not None:
+        return decoding.result()
+    try:
+        with timed('decode'), Image.open(upload['path']) as im:
+            if im.mode == 'P':
+                im = im.convert('RGBA')
+            im.thumbnail((max_side, max_side), Image.Resampling.LANCZOS, reducing_gap=2.0)
+            image = im.convert('RGBA')
+        entry = image, image.width / upload['original_size'][0]
+        _preview_bases.put(key, entry)
+        future.set_result(entry)
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _preview_decodes_lock:
+            del _preview_decodes[key]
+    return entry
+
+def _warm_preview(upload):
+    # Not part of any batch, so kept out of the stage metrics
+    with collect_stages():
+        try:
+            preview_base(upload)
+        except Exception as e:
+            logger.error(f"Error decoding upload {upload['id']} for previews: {str(e)}")
+
+def claim_preview(session, seq):
+    """
+    Record seq as the newest preview request of an editing session. Returns False if
+    a newer one has already arrived, so a request overtaken while it was queued is
+    not rendered. Requests without a session are never overtaken.
+    """
+    if not session:
+        return True
+    with _preview_sessions_lock:
+        if seq < _preview_sessions.get(session, seq):
+            return False
+        _preview_sessions[session] = seq
+        _preview_sessions.move_to_end(session)
+        while len(_preview_sessions) > MAX_PREVIEW_SESSIONS:
+            _preview_sessions.popitem(last=False)
+    return True
+
+def preview_superseded(session, seq):
+    """Whether a newer preview request of the session has arrived since seq was claimed."""
+    with _preview_sessions_lock:
+        return bool(session) and _preview_sessions.get(session, seq) > seq
+
+# --- Base Image Cache ---
+# Decoded RGBA base images keyed by the sha256 of the uploaded bytes, with the
+# number of batches currently using each one
+_base_images = {}
+_base_images_lock = threading.Lock()
+
+# Digests of files by (path, size, mtime), so a base image is hashed once rather than per batch
+_digest_cache = LRUCache(256)
+
+def file_digest(path, chunk_size=1024 * 1024):
+    """Return the sha256 hex digest of a file's contents."""
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    cached = _digest_cache.get(key)
+    if cached is not None:
+        return cached
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    _digest_cache.put(key, digest.hexdigest())
+    return digest.hexdigest()
+
+@contextmanager
+def base_image(upload_path):
+    """
+    Decode and convert the uploaded image to RGBA once for the duration of a batch.
+    Concurrent batches over the same bytes share the decoded image, which is
+    released when the last of them finishes. Callers must not modify it.
+    """
+    digest = file_digest(upload_path)
+    with _base_images_lock:
+        entry = _base_images.get(digest)
+        if entry is not None:
+            entry[1] += 1
+    if entry is None:
+        with timed('decode'), Image.open(upload_path) as im:
+            image = im.convert("RGBA")
+        with _base_images_lock:
+            entry = _base_images.setdefault(digest, [image, 0])
+            entry[1] += 1
+    try:
+        yield entry[0]
+    finally:
+        with _base_images_lock:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del _base_images[digest]
+
 def split_text_and_emojis(text):
-    segments = []
-    current_segment = ""
-    is_emoji = False
-    
-    for char in text:
-        char_is_emoji = ord(char) > 0xFFFF
-        if char_is_emoji != is_emoji and current_segment:
-            segments.append((current_segment, is_emoji))
-            current_segment = ""
-        current_segment += char
-        is_emoji = char_is_emoji
-    
-    if current_segment:
-        segments.append((current_segment, is_emoji))
-    return segments
+    """Split text into (segment, is_emoji) runs; see emoji_spans."""
+    return [(text[start:end], is_emoji) for start, end, is_emoji in emoji_spans(text)]
 
 def draw_rounded_rectangle(draw, coords, color, radius):
     """Draw a rounded rectangle"""
@@ -145,6 +1178,1232 @@ def draw_rounded_rectangle(draw, coords, color, radius):
     draw.pieslice([x1, y2 - radius * 2, x1 + radius * 2, y2], 90, 180, fill=color)
     draw.pieslice([x2 - radius * 2, y2 - radius * 2, x2, y2], 0, 90, fill=color)
 
+def parse_style(form):
+    """
+    Read the text style of a batch from the submitted form (or any mapping with the same keys).
+    """
+    return {
+        'font_name': form.get('font_name', 'ProximaNova-Bold.ttf'),
+        'font_size': int(form.get('font_size', 24)),
+        'font_color': form.get('font_color', '#ffffff'),
+        'alignment': form.get('alignment', 'center').lower(),
+        'text_background': form.get('text_background') == 'on',
+        'text_background_color': form.get('text_background_color', '#000000'),
+        'bg_vertical_padding': int(form.get('bg_vertical_padding', 10)),
+        'bg_horizontal_padding': int(form.get('bg_horizontal_padding', 20)),
+        'bg_corner_radius': int(form.get('bg_corner_radius', 5)),
+        # Text position and dimensions
+        'text_x': int(form.get('text_x', 0)),
+        'text_y': int(form.get('text_y', 0)),
+        'text_width': int(form.get('text_width', 0)),
+        'text_height': int(form.get('text_height', 0)),
+    }
+
+TEXT_BOX_FIELDS = ('text_x', 'text_y', 'text_width', 'text_height')
+# Fields measured in pixels of the base image
+STYLE_PIXEL_FIELDS = TEXT_BOX_FIELDS + ('font_size', 'bg_vertical_padding', 'bg_horizontal_padding', 'bg_corner_radius')
+
+def scale_style(style, scale):
+    """The style for the base image scaled by scale, such as an upload downscaled when it arrived."""
+    if scale == 1:
+        return style
+    scaled = dict(style, **{field: round(style[field] * scale) for field in STYLE_PIXEL_FIELDS})
+    scaled['font_size'] = max(1, scaled['font_size'])
+    return scaled
+
+def template_styles(form, style, count):
+    """
+    The style of each of count base images of a batch: the form's style, with the
+    image's own text box where the text_boxes field gives one. text_boxes is a JSON
+    list with an entry per image, each null or an object with any of text_x,
+    text_y, text_width and text_height. Raises ValueError if it is malformed.
+    """
+    boxes = json.loads(form.get('text_boxes') or 'null') or []
+    if not isinstance(boxes, list) or len(boxes) > count:
+        raise ValueError("text_boxes must be a list with at most one text box per image")
+    styles = []
+    for box in boxes + [None] * (count - len(boxes)):
+        if box is not None and (not isinstance(box, dict) or set(box) - set(TEXT_BOX_FIELDS)):
+            raise ValueError(f"A text box has the fields {', '.join(TEXT_BOX_FIELDS)}, got {box!r}")
+        try:
+            styles.append(dict(style, **{field: int(value) for field, value in (box or {}).items()}))
+        except (TypeError, ValueError):
+            raise ValueError(f"Text box coordinates must be whole numbers, got {box!r}")
+    return styles
+
+# --- Text Layout ---
+# Plans depend only on the text and the style's geometry, so batches that share
+# texts or only change colours or position reuse them
+LAYOUT_CACHE_SIZE = 10000
+_layout_cache = LRUCache(LAYOUT_CACHE_SIZE)
+_layout_draw = ImageDraw.Draw(Image.new("RGBA", (1, 1)))  # Only used for measuring
+
+# Emoji are rasterized once at the emoji font's bitmap strike and scaled to the
+# text size, instead of being drawn at whatever size the font loaded at
+EMOJI_CACHE_SIZE = 4096  # Max number of (sequence, size) bitmaps kept
+EMOJI_CACHE_BYTES = int(os.environ.get('EMOJI_CACHE_BYTES', 32 * 1024 * 1024))
+_emoji_cache = LRUCache(EMOJI_CACHE_SIZE, EMOJI_CACHE_BYTES,
+                        weigh=lambda entry: entry[0].width * entry[0].height * 4)
+
+def emoji_bitmap(sequence, font_size):
+    """
+    Return (bitmap, (left, top)) for an emoji sequence drawn at font_size: an RGBA
+    image and its offset from the text origin. Bitmaps are scaled from the emoji
+    font's strike so emoji match the height of the text around them; without an
+    emoji font the default font is drawn unscaled. Bitmaps are cached and must not
+    be modified.
+    """
+    key = (sequence, font_size)
+    entry = _emoji_cache.get(key)
+    if entry is None:
+        entry = _rasterize_emoji(sequence, font_size)
+        _emoji_cache.put(key, entry)
+    return entry
+
+def _rasterize_emoji(sequence, font_size):
+    spec = _resolve_emoji_font()
+    if spec is None:
+        font, scale = _default_font(), 1
+    else:
+        font, scale = get_font(*spec), font_size / spec[1]
+    left, top, right, bottom = _layout_draw.textbbox((0, 0), sequence, font=font, embedded_color=True)
+    bitmap = Image.new("RGBA", (max(1, right - left), max(1, bottom - top)), (0, 0, 0, 0))
+    ImageDraw.Draw(bitmap).text((-left, -top), sequence, font=font, embedded_color=True)
+    if scale != 1:
+        size = (max(1, round(bitmap.width * scale)), max(1, round(bitmap.height * scale)))
+        bitmap = bitmap.resize(size, Image.Resampling.LANCZOS)
+    return bitmap, (round(left * scale), round(top * scale))
+
+def emoji_cache_stats():
+    """Hit/miss counters and memory use of the emoji bitmap cache."""
+    return _emoji_cache.stats()
+
+def _blit(layer, bitmap, x, y):
+    """Composite bitmap onto layer with its top-left corner at (x, y), clipped to the layer."""
+    left, top = max(0, -x), max(0, -y)
+    right, bottom = min(bitmap.width, layer.width - x), min(bitmap.height, layer.height - y)
+    if left < right and top < bottom:
+        layer.alpha_composite(bitmap, (x + left, y + top), (left, top, right, bottom))
+
+def layout_key(text, style):
+    """The parts of a (text, style) pair that decide where things go."""
+    return (text, style['font_name'], style['font_size'], style['alignment'], style['text_width'])
+
+def layout_text(text, style):
+    """
+    Lay out one text in the style's box and return its render plan:
+    
+        {'font': (font_name, font_size),
+         'lines': ((x, y, width, height, ((segment, is_emoji, x), ...)), ...),
+         'backgrounds': ((left, top, right, bottom), ...),
+         'text_bbox': (left, top, right, bottom),
+         'bbox': (left, top, right, bottom)}
+    
+    Coordinates are relative to the top-left corner of the text box. text_bbox is
+    the area the glyphs cover and bbox also includes the backgrounds; both are
+    exclusive of right and bottom, and None when there is nothing to draw. Fonts are
+    named rather than embedded, so plans can be pickled or stored as JSON; colours,
+    position and whether backgrounds are drawn are left to rasterize_plan. Plans
+    are cached and must not be modified.
+    """
+    key = layout_key(text, style)
+    plan = _layout_cache.get(key)
+    if plan is None:
+        plan = _build_plan(text, style)
+        _layout_cache.put(key, plan)
+    return plan
+
+def _build_plan(text, style):
+    font_size = style['font_size']
+    text_width = style['text_width']
+    alignment = style['alignment']
+    regular_font = load_regular_font(style['font_name'], font_size)
+    draw = _layout_draw
+    
+    # Split text into lines based on width
+    with timed('wrap'):
+        lines = wrap_text(text, regular_font, text_width, draw)
+    # Measure, align and place each line
+    with timed('layout'):
+        padding_x = int(font_size * 0.8)  # Horizontal padding
+        padding_y = int(font_size * 0.4)  # Vertical padding
+        line_height = int(font_size * 1.5)  # Line spacing
+
+        planned = []
+        backgrounds = []
+        ink = []  # Boxes the glyphs themselves cover
+        y = 0
+        for line in lines:
+            # Split line into segments (text and emojis) and measure each of them once
+            segments = []
+            for start, end, is_emoji in emoji_spans(line):
+                segment = line[start:end]
+                if is_emoji:
+                    bitmap, (left, top) = emoji_bitmap(segment, font_size)
+                    box = (left, top, left + bitmap.width, top + bitmap.height)
+                else:
+                    try:
+                        box = text_bbox(segment, regular_font, draw)
+                    except Exception as e:
+                        logger.error("textbbox failed: %s", e)
+                        box = (0, 0) + measure_text(segment, regular_font, draw)
+                segments.append((segment, is_emoji, (box[2] - box[0], box[3] - box[1]), box))
+            line_width = sum(size[0] for _, _, size, _ in segments)
+
+            # Calculate x position based on alignment
+            if alignment == 'center':
+                x = (text_width - line_width) // 2
+            elif alignment == 'right':
+                x = text_width - line_width
+            else:  # left alignment
+                x = 0
+
+            # Line height including any emoji
+            max_height = max([font_size] + [size[1] for _, _, size, _ in segments])
+
+            positioned = []
+            segment_x = x
+            for segment, is_emoji, size, box in segments:
+                positioned.append((segment, is_emoji, segment_x))
+                ink.append((segment_x + box[0], y + box[1], segment_x + box[2], y + box[3]))
+                segment_x += size[0]
+            planned.append((x, y, line_width, max_height, tuple(positioned)))
+            # Background with padding, aligned with the text
+            backgrounds.append((x - padding_x, y - padding_y, x + line_width + padding_x, y + max_height + padding_y))
+            y += line_height
+
+        return {
+            'font': (style['font_name'], font_size),
+            'lines': tuple(planned),
+            'backgrounds': tuple(backgrounds),
+            'text_bbox': _union(ink),
+            # Rectangles are drawn including their right and bottom edges
+            'bbox': _union(ink + [(l, t, r + 1, b + 1) for l, t, r, b in backgrounds]),
+        }
+
+def _union(boxes):
+    if not boxes:
+        return None
+    return (min(b[0] for b in boxes), min(b[1] for b in boxes),
+            max(b[2] for b in boxes), max(b[3] for b in boxes))
+
+def layout_cache_stats():
+    """Hit/miss counters of the render plan cache."""
+    return _layout_cache.stats()
+
+def rasterize_plan(base, plan, style):
+    """
+    Draw a render plan onto the base image at the style's position, in its colours,
+    and return the result. The base image is not modified.
+    
+    Only the part of the image the plan covers is drawn and composited, so the
+    cost follows the size of the text rather than the size of the image.
+    """
+    text_x = style['text_x']
+    text_y = style['text_y']
+    
+    # Fonts and emoji bitmaps are cached per process, so this is cheap after the first row
+    font_size = plan['font'][1]
+    regular_font = load_regular_font(*plan['font'])
+    
+    bg_color = style['text_background_color']
+    # Convert hex color to RGBA with full opacity
+    if bg_color.startswith('#'):
+        r = int(bg_color[1:3], 16)
+        g = int(bg_color[3:5], 16)
+        b = int(bg_color[5:7], 16)
+        bg_color = (r, g, b, 255)  # Full opacity
+    
+    with timed('composite'):
+        image = base.copy()
+    bbox = plan['bbox'] if style['text_background'] else plan['text_bbox']
+    if bbox is None:
+        return image
+    # The region of the image the text covers, clipped to the image
+    left = max(0, text_x + bbox[0])
+    top = max(0, text_y + bbox[1])
+    right = min(base.width, text_x + bbox[2])
+    bottom = min(base.height, text_y + bbox[3])
+    if left >= right or top >= bottom:
+        return image
+    
+    # Draw in region coordinates; everything outside the region is off-image anyway
+    origin_x = text_x - left
+    origin_y = text_y - top
+    with timed('draw'):
+        txt_layer = Image.new("RGBA", (right - left, bottom - top), (255, 255, 255, 0))
+        draw = ImageDraw.Draw(txt_layer)
+        for (_, y, _, _, segments), (bg_left, bg_top, bg_right, bg_bottom) in zip(plan['lines'], plan['backgrounds']):
+            # Draw background for this line if enabled
+            if style['text_background']:
+                draw_rounded_rectangle(draw, (origin_x + bg_left, origin_y + bg_top, origin_x + bg_right, origin_y + bg_bottom),
+                                       bg_color, style['bg_corner_radius'])
+
+            # Draw each segment
+            for segment, is_emoji, x in segments:
+                if is_emoji:
+                    bitmap, (offset_x, offset_y) = emoji_bitmap(segment, font_size)
+                    _blit(txt_layer, bitmap, origin_x + x + offset_x, origin_y + y + offset_y)
+                else:
+                    draw.text((origin_x + x, origin_y + y), segment, font=regular_font, fill=style['font_color'])
+
+    # Composite text layer onto its region of the image
+    with timed('composite'):
+        image.alpha_composite(txt_layer, (left, top))
+    return image
+
+def render_text_image(base, text, style):
+    """
+    Render one text onto the base image using the given style and return the result.
+    The base image is not modified.
+    """
+    return rasterize_plan(base, layout_text(text, style), style)
+
+# --- Batch Rendering ---
+# Number of processes rendering the rows of a batch; 1 renders in the request thread
+RENDER_WORKERS = int(os.environ.get('RENDER_WORKERS', 1))
+# Most processes a form may ask for; each one decodes the base images
+MAX_RENDER_WORKERS = int(os.environ.get('MAX_RENDER_WORKERS', max(RENDER_WORKERS, os.cpu_count() or 1)))
+# Batches rendered in-process run as a pipeline: a thread reads rows ahead, then
+# pools of threads draw, encode and write them. Encoding and writing release the
+# GIL, so they overlap with drawing the next rows. depth bounds the rows between
+# reading and committing, which keeps memory flat however long the sheet is.
+PIPELINE = {
+    'fetch_ahead': int(os.environ.get('PIPELINE_FETCH_AHEAD', 64)),
+    'draw': int(os.environ.get('PIPELINE_DRAW_THREADS', 1)),
+    'encode': int(os.environ.get('PIPELINE_ENCODE_THREADS', 2)),
+    'write': int(os.environ.get('PIPELINE_WRITE_THREADS', 1)),
+    'depth': int(os.environ.get('PIPELINE_DEPTH', 8)),
+}
+OUTPUTS_DIR = 'outputs'
+PREVIEW_LIMIT = 5  # Number of results that get a preview thumbnail
+PREVIEWS_DIR = '.previews'  # Inside OUTPUTS_DIR
+PREVIEW_SIZE = (640, 640)  # Thumbnails fit in this box
+PREVIEW_MAX_AGE = 7 * 24 * 3600  # Previews are named per batch and never change
+# Extension and Pillow format of preview thumbnails
+PREVIEW_FORMAT = ('.webp', 'WEBP') if features.check('webp') else ('.jpg', 'JPEG')
+BATCH_ID_RE = re.compile(r'[0-9a-f]{32}')
+
+# --- Output Formats ---
+# extension, Pillow format and MIME type of each format a batch can be saved in
+OUTPUT_FORMATS = {
+    'png': ('.png', 'PNG', 'image/png'),
+    'png8': ('.png', 'PNG', 'image/png'),  # Palette-quantized to 256 colours
+    'webp': ('.webp', 'WEBP', 'image/webp'),
+    'jpeg': ('.jpg', 'JPEG', 'image/jpeg'),
+}
+
+def parse_output_format(form):
+    """
+    Read how a batch's images are encoded from the submitted form. The defaults
+    match Pillow's, so batches that do not ask for anything still get plain PNGs.
+    """
+    output = {
+        'format': form.get('output_format', 'png').lower(),
+        'compress_level': int(form.get('png_compress_level', 6)),  # PNG and PNG-8, 0-9
+        'quality': int(form.get('output_quality', 90)),  # JPEG and lossy WebP, 1-100
+        'lossless': form.get('webp_lossless') == 'on',
+    }
+    if output['format'] not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format '{output['format']}'")
+    if not 0 <= output['compress_level'] <= 9:
+        raise ValueError("PNG compress level must be between 0 and 9")
+    if not 1 <= output['quality'] <= 100:
+        raise ValueError("Output quality must be between 1 and 100")
+    return output
+
+DEFAULT_OUTPUT = parse_output_format({})
+
+def parse_workers(form):
+    """
+    Read the number of render processes a batch form asks for, RENDER_WORKERS if
+    it does not say. Raises ValueError unless it is between 1 and MAX_RENDER_WORKERS.
+    """
+    try:
+        workers = int(form.get('workers') or RENDER_WORKERS)
+    except ValueError:
+        raise ValueError("Workers must be a whole number")
+    if not 1 <= workers <= MAX_RENDER_WORKERS:
+        raise ValueError(f"Workers must be between 1 and {MAX_RENDER_WORKERS}")
+    return workers
+
+def save_output(image, path, output=None):
+    """
+    Encode a rendered image in the batch's output format and write it to path.
+    Returns (seconds spent encoding, bytes).
+    """
+    buffer, seconds = encode_output(image, output)
+    return seconds, write_output(buffer, path)
+
+def encode_output(image, output=None):
+    """Encode a rendered image in memory in the batch's output format. Returns (buffer, seconds)."""
+    output = output or DEFAULT_OUTPUT
+    name = output['format']
+    buffer = BytesIO()
+    start = time.perf_counter()
+    with timed('encode'):
+        if name == 'png':
+            image.save(buffer, 'PNG', compress_level=output['compress_level'])
+        elif name == 'png8':
+            image.quantize(256, method=Image.Quantize.FASTOCTREE).save(buffer, 'PNG', compress_level=output['compress_level'])
+        elif name == 'webp':
+            image.save(buffer, 'WEBP', lossless=output['lossless'], quality=output['quality'])
+        else:
+            # JPEG has no alpha channel
+            image.convert('RGB').save(buffer, OUTPUT_FORMATS[name][1], quality=output['quality'])
+    return buffer, time.perf_counter() - start
+
+def write_output(buffer, path):
+    """Write an encoded image to path and return its size in bytes."""
+    with timed('write'), open(path, 'wb') as f:
+        return f.write(buffer.getbuffer())
+
+@timed('preview')
+def save_preview(image, path):
+    """
+    Save a small thumbnail of a rendered image for the results page. The image is
+    shrunk in place, so call this after the image itself has been saved.
+    """
+    image.thumbnail(PREVIEW_SIZE, reducing_gap=2.0)
+    if PREVIEW_FORMAT[1] == 'JPEG':
+        image = image.convert('RGB')
+    image.save(path, PREVIEW_FORMAT[1], quality=80)
+
+# --- Render Cache ---
+# Outputs already rendered, keyed by what went into them. Defaults to .render-cache
+# inside the batch's output directory.
+RENDER_CACHE_DIR = os.environ.get('RENDER_CACHE_DIR')
+RENDER_CACHE_BYTES = int(os.environ.get('RENDER_CACHE_BYTES', 1024 ** 3))  # 0 disables the cache
+RENDER_VERSION = 3  # Bump when a rendering change alters output pixels, to retire old entries
+
+def render_key(base_digest, text, style, output=None):
+    """Hash of everything that decides the bytes of a rendered row."""
+    normalized = dict(style, font_color=style['font_color'].lower(),
+                      text_background_color=style['text_background_color'].lower())
+    payload = json.dumps([RENDER_VERSION, base_digest, text, normalized, output or DEFAULT_OUTPUT], sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def link_or_copy(src, dest):
+    """Hardlink src to dest, copying it instead where hardlinks are not possible."""
+    try:
+        os.link(src, dest)
+    except FileNotFoundError:
+        raise
+    except OSError:
+        # Different filesystems, or one that has no hardlinks
+        shutil.copyfile(src, dest)
+
+class RenderCache:
+    """
+    Rendered outputs on disk, keyed by render_key. Files are hardlinked (or copied)
+    in and out, and never modified in place. Once the cache holds more than
+    max_bytes the least recently used entries are evicted; recency is the file's
+    mtime, so it survives restarts.
+    """
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._size = None  # Bytes on disk, counted on first store
+        self._lock = threading.Lock()
+
+    def _path(self, key, extension):
+        return os.path.join(self.directory, key[:2], key + extension)
+
+    def fetch(self, key, extension, dest):
+        """Put the output cached under key at dest and return its size, or None on a miss."""
+        path = self._path(key, extension)
+        try:
+            link_or_copy(path, dest)
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return os.path.getsize(dest)
+
+    def store(self, key, extension, src):
+        """Add the output at src under key, evicting old entries if the cache is full."""
+        path = self._path(key, extension)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        link_or_copy(src, tmp_path)
+        os.replace(tmp_path, path)
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._entries())
+            else:
+                self._size += os.path.getsize(path)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _entries(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                # Temp files belong to stores still in flight
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield st.st_mtime, st.st_size, path
+
+    def _evict(self):
+        # Down to 90% of the cap, so a full cache does not rescan on every store
+        entries = sorted(self._entries())
+        size = sum(entry[1] for entry in entries)
+        evicted = 0
+        for _, entry_size, path in entries:
+            if size <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= entry_size
+            evicted += 1
+        self._size = size
+        logger.info("Render cache: evicted %d entries, %d bytes left", evicted, size)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {'directory': self.directory, 'max_bytes': self.max_bytes, 'bytes': self._size,
+                    'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / total if total else 0.0}
+
+_render_caches = {}
+_render_caches_lock = threading.Lock()
+
+def get_render_cache(output_dir=None):
+    """The render cache for batches written to output_dir, or None if caching is disabled."""
+    if RENDER_CACHE_BYTES <= 0:
+        return None
+    directory = RENDER_CACHE_DIR or os.path.join(output_dir or OUTPUTS_DIR, '.render-cache')
+    with _render_caches_lock:
+        if directory not in _render_caches:
+            _render_caches[directory] = RenderCache(directory, RENDER_CACHE_BYTES)
+        return _render_caches[directory]
+
+def render_cache_stats():
+    """Hit/miss counters and size of every render cache used by this process."""
+    with _render_caches_lock:
+        caches = list(_render_caches.values())
+    return [cache.stats() for cache in caches]
+
+# Decoded base image and style of each template of the batch a pool worker process was started for
+_worker_templates = []
+_worker_stages = {}  # Stages timed while the worker started, handed back with its first row
+
+def _init_render_worker(templates):
+    """Process pool initializer: decode the base images and load the fonts once per worker."""
+    bases = {}  # Templates may share an image
+    with collect_stages(_worker_stages):
+        for upload_path, style in templates:
+            if upload_path not in bases:
+                with timed('decode'), Image.open(upload_path) as im:
+                    bases[upload_path] = im.convert("RGBA")
+            _worker_templates.append((bases[upload_path], style))
+            load_regular_font(style['font_name'], style['font_size'])
+        get_emoji_font()
+
+def _render_and_save(base, text, style, tmp_path, preview_path, output):
+    image = render_text_image(base, text, style)
+    encoded = save_output(image, tmp_path, output)
+    if preview_path:
+        save_preview(image, preview_path)
+    return encoded
+
+def _render_row(text, template, tmp_path, preview_path=None, output=None):
+    """
+    Render and encode one row onto a template in a pool worker. Returns (error, encode_seconds, bytes,
+    stage timings); errors are returned, not raised, so one bad row cannot fail the batch.
+    """
+    with collect_stages(add_stages({}, _worker_stages)) as timings:
+        _worker_stages.clear()
+        try:
+            base, style = _worker_templates[template]
+            result = (None,) + _render_and_save(base, text, style, tmp_path, preview_path, output)
+        except Exception as e:
+            result = str(e), 0.0, 0
+    return result + (timings,)
+
+# Templates are (upload_path, style) and rows are (text, template index, tmp_path,
+# preview_path, cached_bytes); rows with cached_bytes are already at tmp_path and
+# are passed through without rendering. Both renderers yield (text, error,
+# encode_seconds, bytes, stage timings).
+
+def _render_rows_pipelined(templates, rows, output, pipeline):
+    with ExitStack() as stack:
+        bases = [stack.enter_context(base_image(upload_path)) for upload_path, _ in templates]
+        # Entered downstream first, so each pool shuts down before the one it feeds
+        writers, encoders, drawers = [
+            stack.enter_context(ThreadPoolExecutor(max_workers=pipeline[stage], thread_name_prefix=f'batch-{stage}'))
+            for stage in ('write', 'encode', 'draw')]
+        
+        def draw(text, template, timings):
+            with collect_stages(timings):
+                return render_text_image(bases[template], text, templates[template][1])
+        
+        def encode(preview_path, timings, image):
+            with collect_stages(timings):
+                encoded = encode_output(image, output)
+                if preview_path:
+                    save_preview(image, preview_path)
+            return encoded
+        
+        def write(tmp_path, timings, encoded):
+            buffer, seconds = encoded
+            with collect_stages(timings):
+                return None, seconds, write_output(buffer, tmp_path)
+        
+        pending = deque()
+        for text, template, tmp_path, preview_path, cached_bytes in rows:
+            timings = {}
+            if cached_bytes is not None:
+                future = Future()
+                future.set_result((None, 0.0, cached_bytes))
+            else:
+                future = drawers.submit(draw, text, template, timings)
+                future = _then(future, encoders, functools.partial(encode, preview_path, timings))
+                future = _then(future, writers, functools.partial(write, tmp_path, timings))
+            pending.append((text, future, timings))
+            # Backpressure: wait for the oldest row once depth rows are on their way
+            if len(pending) >= pipeline['depth']:
+                yield _pipelined_row(*pending.popleft())
+        while pending:
+            yield _pipelined_row(*pending.popleft())
+
+def _then(future, executor, func):
+    """Run func(result of future) in executor once future is done, and return a future of its result."""
+    chained = Future()
+    
+    def forward(done):
+        if done.exception() is not None:
+            chained.set_exception(done.exception())
+        else:
+            try:
+                executor.submit(func, done.result()).add_done_callback(forward_result)
+            except RuntimeError as e:  # The pool was shut down; the batch is being abandoned
+                chained.set_exception(e)
+    
+    def forward_result(done):
+        if done.exception() is not None:
+            chained.set_exception(done.exception())
+        else:
+            chained.set_result(done.result())
+    
+    future.add_done_callback(forward)
+    return chained
+
+def _pipelined_row(text, future, timings):
+    try:
+        result = future.result()
+    except Exception as e:
+        result = str(e), 0.0, 0
+    return (text,) + result + (timings,)
+
+def _prefetch(iterable, ahead):
+    """
+    Yield the items of iterable as read by a background thread, up to ahead items
+    in advance. Errors are raised in the consumer, and closing the generator stops
+    the reader, which closes the iterable in its own thread (as SQLite requires).
+    Stages timed by the reader are handed to the consumer's collection.
+    """
+    items = queue.Queue(maxsize=max(1, ahead))
+    stop = threading.Event()
+    timings = {}
+    
+    def put(entry):
+        while not stop.is_set():
+            try:
+                items.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def read():
+        iterator = iter(iterable)
+        with collect_stages(timings):
+            try:
+                for item in iterator:
+                    if not put(('item', item)):
+                        break
+                else:
+                    put(('done', None))
+            except BaseException as e:
+                put(('error', e))
+            finally:
+                if hasattr(iterator, 'close'):
+                    iterator.close()
+    
+    reader = threading.Thread(target=read, name='batch-fetch', daemon=True)
+    reader.start()
+    try:
+        while True:
+            kind, value = items.get()
+            if kind == 'done':
+                break
+            if kind == 'error':
+                raise value
+            yield value
+    finally:
+        stop.set()
+        reader.join()
+        record_stages(timings)
+
+# Render workers are not forked from the server: another thread (the sheet reader,
+# a job or a preview) may hold a lock the child would inherit and never see released.
+# The fork server imports this module once, so workers start without importing it again.
+if 'forkserver' in multiprocessing.get_all_start_methods():
+    _render_mp_context = multiprocessing.get_context('forkserver')
+    _render_mp_context.set_forkserver_preload([__name__])
+else:
+    _render_mp_context = multiprocessing.get_context('spawn')
+
+def _render_rows_parallel(templates, rows, workers, output=None):
+    # Fail fast on uploads that are not images instead of breaking every worker
+    for upload_path, _ in templates:
+        with Image.open(upload_path):
+            pass
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers, mp_context=_render_mp_context,
+                             initializer=_init_render_worker, initargs=(templates,)) as executor:
+        for text, template, tmp_path, preview_path, cached_bytes in rows:
+            if cached_bytes is not None:
+                future = Future()
+                future.set_result((None, 0.0, cached_bytes, {}))
+            else:
+                future = executor.submit(_render_row, text, template, tmp_path, preview_path, output)
+            pending.append((text, future))
+            # Keep a bounded number of rows in flight and hand them back in sheet order
+            if len(pending) >= workers * 4:
+                text, future = pending.popleft()
+                yield (text,) + future.result()
+        while pending:
+            text, future = pending.popleft()
+            yield (text,) + future.result()
+
+def _manifest_path(batch_id, output_dir=None):
+    return os.path.join(output_dir or OUTPUTS_DIR, '.batches', f'{batch_id}.json')
+
+def write_batch_manifest(batch_id, filenames, output_dir=None, folders=None):
+    """
+    Record which output files belong to a batch, so it can be downloaded as one archive.
+    folders optionally maps filenames to the archive folder they belong in.
+    """
+    path = _manifest_path(batch_id, output_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump({'batch_id': batch_id, 'files': filenames, 'folders': folders or {}}, f)
+
+def read_batch_manifest(batch_id, output_dir=None):
+    """Return the (arcname, filename) pairs of a batch's archive, or None if the batch is unknown."""
+    if not BATCH_ID_RE.fullmatch(batch_id):
+        return None
+    try:
+        with open(_manifest_path(batch_id, output_dir)) as f:
+            manifest = json.load(f)
+        folders = manifest.get('folders', {})
+        # Files of batches with their own folder are named with it
+        entries = []
+        for name in manifest['files']:
+            arcname = posixpath.basename(name)
+            entries.append((f"{folders[name]}/{arcname}" if name in folders else arcname, name))
+        return entries
+    except (OSError, ValueError, KeyError):
+        return None
+
+def _row_event(stats, start, **fields):
+    elapsed = time.perf_counter() - start
+    return dict(fields, row=stats['rows'], rendered=stats['rendered'], failed=stats['failed'],
+                images_per_second=stats['rendered'] / elapsed if elapsed else 0.0)
+
+def sheet_slug(sheet_name):
+    """A filename-safe form of a sheet name."""
+    return re.sub(r'[^\w.-]+', '_', sheet_name).strip('._') or 'sheet'
+
+def _unique_names(names, taken=()):
+    """Return names with the later of any repeated ones (or ones already taken) suffixed -2, -3..."""
+    taken = set(taken)
+    unique = []
+    for name in names:
+        candidate = name
+        for n in itertools.count(2):
+            if candidate not in taken:
+                break
+            candidate = f"{name}-{n}"
+        taken.add(candidate)
+        unique.append(candidate)
+    return unique
+
+def _sum_counts(items):
+    """Add up (name, row counts) pairs by name."""
+    totals = {}
+    for name, counts in items:
+        total = totals.setdefault(name, dict.fromkeys(counts, 0))
+        for key, value in counts.items():
+            total[key] += value
+    return totals
+
+def render_batch(upload_path, texts, style, base_filename, workers=1, output_dir=None,
+                 batch_id=None, progress=None, output=None, use_cache=True, numbering='rendered',
+                 skip_existing=False, pipeline=None):
+    """
+    Render every text onto the uploaded image and save them as <base_filename>_HD-NN.png,
+    or with the extension of the output format (see parse_output_format) if given.
+    texts may be any iterable, such as a streaming TextSource.iter_texts.
+    
+    With workers > 1 rows are rendered by a process pool. Rows are committed in sheet
+    order either way, so numbering is deterministic and failed rows are skipped
+    without using up a number. If given, progress is called with a dict describing
+    each committed row.
+    
+    Rows whose image, text, style and output format were rendered before are
+    linked from the render cache instead of rendered again, unless use_cache is off.
+    
+    With numbering='row' files are numbered by their row instead, so failed rows
+    leave gaps and a row always gets the same name. skip_existing then keeps the
+    files a previous run already wrote instead of rendering those rows again,
+    which resumes an interrupted batch.
+    
+    With one worker, rows are drawn, encoded and written by the stages of a pipeline
+    (see PIPELINE); pipeline overrides the threads and queue depths of its stages.
+    
+    Returns (results, stats): the saved files, with preview thumbnails for the first
+    few, and row counts, throughput, encode time, bytes and cache hits for the batch.
+    """
+    return _render_groups([(base_filename, upload_path, style)], [(None, texts)], workers, output_dir, batch_id,
+                          progress, output, use_cache, numbering, skip_existing, pipeline)
+
+def render_sheets(upload_path, sheets, style, base_filename, workers=1, output_dir=None,
+                  batch_id=None, progress=None, output=None, use_cache=True, numbering='rendered',
+                  skip_existing=False, pipeline=None):
+    """
+    Render several sheets as one batch. sheets is an iterable of (sheet_name, texts),
+    such as TextSource.iter_sheets. The base image is decoded once for all of them,
+    each sheet is numbered on its own as <base_filename>_<sheet>_HD-NN.png and gets
+    its own folder in the batch archive. Results carry their sheet and stats hold
+    row counts per sheet; otherwise this works like render_batch.
+    """
+    return _render_groups([(base_filename, upload_path, style)], sheets, workers, output_dir, batch_id,
+                          progress, output, use_cache, numbering, skip_existing, pipeline)
+
+def render_templates(templates, sheets, workers=1, output_dir=None, batch_id=None, progress=None, output=None,
+                     use_cache=True, numbering='rendered', skip_existing=False, pipeline=None, batch_folder=False,
+                     results_page=True):
+    """
+    Render every text onto each of several base images as one batch. templates is
+    a list of (name, upload_path, style), so each image can have its own text box;
+    sheets is an iterable of (sheet_name, texts) as for render_sheets, or
+    [(None, texts)] for a single list of texts.
+    
+    Each text is rendered onto every template before the next one is read, so the
+    texts are fetched once, each image is decoded once, and templates with the same
+    font and box width share the wrapped layout of every text. Outputs are named
+    <name>_HD-NN.png (<name>_<sheet>_HD-NN.png for sheets) and each template gets
+    its own folder in the batch archive. Results carry their template and stats hold
+    row counts per template; otherwise this works like render_batch.
+    
+    With batch_folder the outputs are written to a folder named after the batch ID,
+    so batches running at the same time never overwrite each other's files, and
+    result filenames start with that folder. With results_page off no preview
+    thumbnails or batch manifest are written, which only serve the web results page
+    and the batch archive.
+    """
+    return _render_groups(templates, sheets, workers, output_dir, batch_id, progress, output,
+                          use_cache, numbering, skip_existing, pipeline, batch_folder, results_page)
+
+def _render_groups(templates, groups, workers, output_dir, batch_id, progress, output,
+                   use_cache, numbering, skip_existing, pipeline, batch_folder=False, results_page=True):
+    if numbering not in ('rendered', 'row'):
+        raise ValueError(f"Unknown numbering '{numbering}'")
+    if skip_existing and numbering != 'row':
+        raise ValueError("skip_existing needs numbering='row'")
+    pipeline = dict(PIPELINE, **(pipeline or {}))
+    for stage, value in pipeline.items():
+        if stage not in PIPELINE:
+            raise ValueError(f"Unknown pipeline stage '{stage}'")
+        if value < 1:
+            raise ValueError(f"Pipeline {stage} must be at least 1")
+    templates = list(templates)
+    if not templates:
+        raise ValueError("A batch needs at least one image")
+    output = output or DEFAULT_OUTPUT
+    extension = OUTPUT_FORMATS[output['format']][0]
+    workers = max(1, workers)
+    output_dir = output_dir or OUTPUTS_DIR
+    batch_id = batch_id or uuid.uuid4().hex
+    # Filenames are relative to output_dir, so with batch_folder they start with the folder
+    folder_prefix = ''
+    if batch_folder:
+        folder_prefix = f"{batch_id}/"
+        os.makedirs(os.path.join(output_dir, batch_id), exist_ok=True)
+    cache = get_render_cache(output_dir) if use_cache else None
+    digests = {}  # Upload path -> digest, for render keys
+    if cache:
+        for _, upload_path, _ in templates:
+            if upload_path not in digests:
+                digests[upload_path] = file_digest(upload_path)
+    # With several templates each one is named after its image and gets its own folder
+    names = _unique_names(name for name, _, _ in templates)
+    template_folders = names if len(templates) > 1 else [None] * len(templates)
+    total = '?'
+    # (group, cache key, cache hit, filename, resumed, duplicate) of every row handed to the renderer,
+    # oldest first. Rows come back in the order they were taken, so each committed row pops its own.
+    row_info = deque()
+    # Rows are read ahead of the ones being committed, so a text repeated within the batch
+    # misses the cache; it is rendered once and later rows link its output when committed
+    keys_taken = set()
+    # Cache key -> batch-private link to the first row's output. The output itself may be
+    # replaced by another batch using the same names before a later row links it.
+    committed = {}
+    failed_keys = {}  # Cache key -> error of the first row with it
+    sheet_folders = {}  # Sheet name -> folder
+    sheets = {}  # (sheet name, template) -> [filename prefix, folder, row counts]
+    
+    def add_group(sheet, template):
+        folder = None
+        if sheet is not None:
+            if sheet not in sheet_folders:
+                # Keep sheets whose names only differ in punctuation apart
+                sheet_folders[sheet] = _unique_names([sheet_slug(sheet)], taken=sheet_folders.values())[0]
+            folder = sheet_folders[sheet]
+        prefix = f"{names[template]}_{folder}" if folder else names[template]
+        if template_folders[template]:
+            folder = f"{template_folders[template]}/{folder}" if folder else template_folders[template]
+        sheets[sheet, template] = [prefix, folder, {'rows': 0, 'rendered': 0, 'failed': 0}]
+        return prefix
+    
+    def all_rows():
+        nonlocal total
+        i = 0
+        for sheet, texts in groups:
+            if sheet is None and hasattr(texts, '__len__'):
+                total = len(texts) * len(templates)
+            # Each text is rendered onto every template before the next one is read,
+            # so texts are fetched once and templates with the same box share its layout
+            for number, text in enumerate(texts, 1):
+                for template, (_, upload_path, style) in enumerate(templates):
+                    # Sheets are only given a prefix and folder once they have a row
+                    group = sheet, template
+                    prefix = sheets[group][0] if group in sheets else add_group(*group)
+                    filename = f"{folder_prefix}{prefix}_HD-{number:02d}{extension}" if numbering == 'row' else None
+                    if skip_existing and os.path.exists(os.path.join(output_dir, filename)):
+                        # Committed by an earlier run; files only appear once they are complete
+                        path = os.path.join(output_dir, filename)
+                        row_info.append((group, None, False, filename, True, False))
+                        yield text, template, path, None, os.path.getsize(path)
+                        i += 1
+                        continue
+                    # Where the row is written before it is committed, and where the first rows' previews go
+                    tmp_path = os.path.join(output_dir, f".{batch_id}-{i}{extension}")
+                    preview_path = os.path.join(output_dir, f".{batch_id}-{i}.preview{PREVIEW_FORMAT[0]}") if results_page and i < PREVIEW_LIMIT else None
+                    key = cached_bytes = None
+                    duplicate = False
+                    if cache:
+                        key = render_key(digests[upload_path], text, style, output)
+                        duplicate = key in keys_taken
+                        if duplicate:
+                            cached_bytes = 0  # Nothing to render; linked when committed
+                        else:
+                            keys_taken.add(key)
+                            cached_bytes = cache.fetch(key, extension, tmp_path)
+                        if cached_bytes and preview_path:
+                            with Image.open(tmp_path) as im:
+                                save_preview(im.convert("RGBA"), preview_path)
+                    row_info.append((group, key, cached_bytes is not None, filename, False, duplicate))
+                    yield text, template, tmp_path, preview_path, cached_bytes
+                    i += 1
+    
+    # Texts are fetched by their own thread, ahead of the renderer
+    fetched = _prefetch(all_rows(), pipeline['fetch_ahead'])
+    sources = [(upload_path, style) for _, upload_path, style in templates]
+    if workers > 1:
+        rows = _render_rows_parallel(sources, fetched, workers, output)
+    else:
+        rows = _render_rows_pipelined(sources, fetched, output, pipeline)
+    
+    results = []
+    folders = {}  # Output filename -> archive folder, for sheets
+    stats = {'batch_id': batch_id, 'workers': workers, 'rows': 0, 'rendered': 0, 'resumed': 0, 'failed': 0,
+             'format': output['format'], 'encode_seconds': 0.0, 'bytes': 0, 'cache_hits': 0, 'cache_misses': 0}
+    start = time.perf_counter()
+    stage_totals = {}  # Seconds by stage, summed over the rows
+    # Stages timed outside the rows, such as fetching texts and decoding the base image
+    with collect_stages() as batch_stages, ExitStack() as cleanup:
+        @cleanup.callback
+        def remove_first_links():
+            for path in committed.values():
+                if os.path.exists(path):
+                    os.remove(path)
+        
+        for i, (text, error, encode_seconds, size, timings) in enumerate(rows):
+            (sheet, template), key, cache_hit, filename, resumed, duplicate = row_info.popleft()
+            prefix, folder, counts = sheets[sheet, template]
+            if duplicate and key in failed_keys:
+                error = failed_keys[key]  # Same image, text and style: it fails the same way
+            stats['rows'] += 1
+            counts['rows'] += 1
+            logger.info(f"Processing image {stats['rows']} of {total}")
+            fields = {'sheet': sheet} if sheet is not None else {}
+            if len(templates) > 1:
+                fields['template'] = names[template]
+            tmp_path = os.path.join(output_dir, f".{batch_id}-{i}{extension}")
+            preview_tmp_path = os.path.join(output_dir, f".{batch_id}-{i}.preview{PREVIEW_FORMAT[0]}")
+            if error is not None:
+                logger.error(f"Error processing text '{text}': {error}")
+                stats['failed'] += 1
+                counts['failed'] += 1
+                for path in (tmp_path, preview_tmp_path):
+                    if os.path.exists(path):
+                        os.remove(path)
+                observe_stages(timings)
+                add_stages(stage_totals, timings)
+                if progress:
+                    progress(_row_event(stats, start, status='failed', error=error, text=text, **fields))
+                if key and not duplicate:
+                    failed_keys[key] = error
+                continue
+        
+            output_filename = filename or f"{folder_prefix}{prefix}_HD-{counts['rendered']+1:02d}{extension}"
+            output_path = os.path.join(output_dir, output_filename)
+            if resumed:
+                stats['resumed'] += 1
+            elif duplicate:
+                with collect_stages(timings), timed('write'):
+                    link_or_copy(committed[key], tmp_path)
+                    os.replace(tmp_path, output_path)
+                    size = os.path.getsize(output_path)
+                if results_page and i < PREVIEW_LIMIT:
+                    with Image.open(output_path) as im:
+                        save_preview(im.convert("RGBA"), preview_tmp_path)
+            else:
+                with collect_stages(timings), timed('write'):
+                    if key:
+                        committed[key] = os.path.join(output_dir, f".{batch_id}-{i}.first{extension}")
+                        link_or_copy(tmp_path, committed[key])
+                    os.replace(tmp_path, output_path)
+                    if cache and not cache_hit:
+                        cache.store(key, extension, output_path)
+            observe_stages(timings)
+            add_stages(stage_totals, timings)
+            stats['rendered'] += 1
+            counts['rendered'] += 1
+            if cache and not resumed:
+                if cache_hit:
+                    stats['cache_hits'] += 1
+                else:
+                    stats['cache_misses'] += 1
+            stats['encode_seconds'] += encode_seconds
+            stats['bytes'] += size
+            if folder:
+                folders[output_filename] = folder
+        
+            # The first few rows come with a thumbnail, made from the rendered image in memory
+            preview = None
+            if os.path.exists(preview_tmp_path):
+                preview = f"{batch_id}-{i}{PREVIEW_FORMAT[0]}"
+                os.makedirs(os.path.join(output_dir, PREVIEWS_DIR), exist_ok=True)
+                os.replace(preview_tmp_path, os.path.join(output_dir, PREVIEWS_DIR, preview))
+            results.append(dict(fields, filename=output_filename, preview=preview, bytes=size))
+            if progress:
+                progress(_row_event(stats, start, status='rendered', filename=output_filename,
+                                    encode_ms=encode_seconds * 1000, bytes=size, **fields))
+    
+    stats['seconds'] = time.perf_counter() - start
+    stats['images_per_second'] = stats['rendered'] / stats['seconds'] if stats['seconds'] else 0.0
+    stats['encode_ms_per_image'] = stats['encode_seconds'] * 1000 / stats['rendered'] if stats['rendered'] else 0.0
+    stats['bytes_per_image'] = stats['bytes'] / stats['rendered'] if stats['rendered'] else 0.0
+    stats['cache_hit_rate'] = stats['cache_hits'] / stats['rendered'] if stats['rendered'] else 0.0
+    if sheet_folders:
+        stats['sheets'] = _sum_counts((sheet, counts) for (sheet, _), (_, _, counts) in sheets.items())
+    if len(templates) > 1:
+        stats['templates'] = _sum_counts((names[template], counts) for (_, template), (_, _, counts) in sheets.items())
+    observe_stages(batch_stages)
+    add_stages(stage_totals, batch_stages)
+    stats['stages'] = {stage: stage_totals[stage] for stage in STAGES if stage in stage_totals}
+    BATCHES.inc()
+    BATCH_SECONDS.observe(stats['seconds'])
+    ROWS.inc(stats['rendered'], status='rendered')
+    ROWS.inc(stats['failed'], status='failed')
+    RENDER_CACHE_LOOKUPS.inc(stats['cache_hits'], result='hit')
+    RENDER_CACHE_LOOKUPS.inc(stats['cache_misses'], result='miss')
+    if results_page:
+        write_batch_manifest(batch_id, [r['filename'] for r in results], output_dir, folders)
+    logger.info("Batch %s: rendered %d of %d rows with %d worker(s) in %.2fs (%.1f images/s, "
+                "%s encode %.1f ms and %d bytes per image, %d%% from the render cache)",
+                batch_id, stats['rendered'], stats['rows'], workers, stats['seconds'], stats['images_per_second'],
+                stats['format'], stats['encode_ms_per_image'], stats['bytes_per_image'], stats['cache_hit_rate'] * 100)
+    return results, stats
+
+# --- Batch Jobs ---
+# Batches submitted to /jobs run in background threads; each one may still use a process pool
+JOB_THREADS = int(os.environ.get('JOB_THREADS', 2))
+MAX_JOBS = 100  # Finished jobs kept in memory for status and result pages
+JOB_EVENTS_KEPT = 1000  # Most recent events of a running job kept for event-stream clients
+SSE_KEEPALIVE_SECONDS = 15
+
+class BatchJob:
+    """
+    A batch rendering in the background. Progress is recorded as a list of events
+    so that any number of event-stream clients can follow it, including late ones.
+    Only the last JOB_EVENTS_KEPT events are kept, and once the job has finished and
+    no client is following it, just its final event; events are numbered from the
+    first one all the same.
+    """
+    def __init__(self, job_id, sheet_name, source, sheet_names=None, templates=None):
+        self.job_id = job_id
+        self.sheet_name = sheet_name
+        self.sheet_names = sheet_names
+        self.source = source
+        self.templates = templates or []  # Names of the base images
+        self.status = 'queued'
+        self.total = None
+        self.results = []
+        self.stats = {}
+        self.error = None
+        self.events = deque(maxlen=JOB_EVENTS_KEPT)
+        self.dropped = 0  # Events that are no longer kept, so the number of the first one kept
+        self.last_row = {}
+        self._followers = 0
+        self._cond = threading.Condition()
+
+    @property
+    def finished(self):
+        return self.status in ('done', 'failed')
+
+    @property
+    def event_count(self):
+        return self.dropped + len(self.events)
+
+    def publish(self, event, **data):
+        with self._cond:
+            if len(self.events) == self.events.maxlen:
+                self.dropped += 1
+            self.events.append((event, data))
+            self._trim()
+            self._cond.notify_all()
+
+    def _trim(self):
+        # The final event has the row counts, and the rows themselves are in the results
+        if self.finished and not self._followers and len(self.events) > 1:
+            self.dropped += len(self.events) - 1
+            final = self.events.pop()
+            self.events.clear()
+            self.events.append(final)
+
+    def follow(self):
+        """Count an event-stream client, which keeps the row events until it calls unfollow."""
+        with self._cond:
+            self._followers += 1
+
+    def unfollow(self):
+        with self._cond:
+            self._followers -= 1
+            self._trim()
+
+    def start(self, total):
+        self.status = 'running'
+        self.total = total
+        self.publish('start', total=total)
+
+    def row_done(self, row):
+        self.last_row = row
+        self.publish('row', **row)
+
+    def finish(self, results, stats):
+        self.results = results
+        self.stats = stats
+        self.total = stats['rows']
+        self.status = 'done'
+        self.publish('done', **self.to_dict())
+
+    def fail(self, error):
+        self.error = error
+        self.status = 'failed'
+        self.publish('failed', **self.to_dict())
+
+    def wait_for_events(self, since, timeout):
+        """
+        Return (index, events): the events from index since on, waiting up to timeout
+        seconds for new ones. Clients that fell behind resume from the oldest event
+        kept, which index then tells; row events carry the batch's counts so far.
+        """
+        with self._cond:
+            if self.event_count <= since and not self.finished:
+                self._cond.wait(timeout)
+            since = max(since, self.dropped)
+            return since, list(itertools.islice(self.events, since - self.dropped, None))
+
+    def to_dict(self):
+        data = {
+            'job_id': self.job_id,
+            'sheet_name': self.sheet_name,
+            'sheet_names': self.sheet_names,
+            'templates': self.templates,
+            'status': self.status,
+            'total': self.total,
+            'rows': self.last_row.get('row', 0),
+            'rendered': self.last_row.get('rendered', 0),
+            'failed': self.last_row.get('failed', 0),
+            'images_per_second': self.stats.get('images_per_second', self.last_row.get('images_per_second', 0.0)),
+            'encode_ms_per_image': self.stats.get('encode_ms_per_image'),
+            'bytes_per_image': self.stats.get('bytes_per_image'),
+            'cache_hit_rate': self.stats.get('cache_hit_rate'),
+            'stages': self.stats.get('stages'),
+            'error': self.error,
+        }
+        return data
+
+_jobs = OrderedDict()
+_jobs_lock = threading.Lock()
+_job_executor = ThreadPoolExecutor(max_workers=JOB_THREADS, thread_name_prefix='batch-job')
+
+def _register_job(job):
+    with _jobs_lock:
+        _jobs[job.job_id] = job
+        # Forget the oldest finished jobs once there are too many
+        for job_id in [j for j, old in _jobs.items() if old.finished][:max(0, len(_jobs) - MAX_JOBS)]:
+            del _jobs[job_id]
+
+def get_job(job_id):
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+def _run_batch_job(job, templates, workers, output):
+    try:
+        # Streamed, so the number of rows is only known once the batch is done
+        job.start(None)
+        if job.sheet_names:
+            groups = job.source.iter_sheets(job.sheet_names)
+        else:
+            groups = [(None, job.source.iter_texts(job.sheet_name))]
+        results, stats = render_templates(templates, groups, workers=workers, batch_id=job.job_id,
+                                          progress=job.row_done, output=output, batch_folder=True)
+        job.finish(results, stats)
+    except Exception as e:
+        logger.error(f"Batch job {job.job_id} failed: {str(e)}")
+        job.fail(str(e))
+
+def submit_batch_job(templates, sheet_name, workers=1, source=None, sheet_names=None, output=None):
+    """
+    Start rendering a batch in the background and return its BatchJob at once.
+    templates are (name, upload_path, style) as for render_templates. With
+    sheet_names the job renders all of those sheets instead of sheet_name.
+    """
+    templates = list(templates)
+    job = BatchJob(uuid.uuid4().hex, sheet_name, source or get_text_source(), sheet_names,
+                   [name for name, _, _ in templates])
+    _register_job(job)
+    _job_executor.submit(_run_batch_job, job, templates, workers, output)
+    return job
+
 def get_system_fonts():
     try:
         # Get fonts from system locations on macOS
@@ -178,30 +2437,52 @@ def get_fonts():
 @app.route('/sheets')
 def get_sheets():
     try:
-        sheets = get_all_sheets()
+        sheets = request_text_source().list_sheets()
         return jsonify(sheets)
     except Exception as e:
         logger.error(f"Error fetching sheets: {str(e)}")
         return jsonify([SHEET_NAME])
 
+@app.route('/sheets/refresh', methods=['POST'])
+def refresh_sheets():
+    """Invalidate the Sheets cache, e.g. after editing the spreadsheet, and return the fresh sheet list."""
+    invalidate_sheets_cache()
+    return get_sheets()
+
+def upload_templates(files, styles):
+    """
+    Store the uploaded base images and return them as (name, upload_path, style)
+    templates, with the styles scaled to images that were downscaled on arrival.
+    """
+    templates = []
+    for file, style in zip(files, styles):
+        upload = ingest_upload(file.stream)
+        templates.append((os.path.splitext(os.path.basename(file.filename))[0], upload['path'],
+                          scale_style(style, upload['scale'])))
+    return templates
+
 @app.route('/', methods=['GET', 'POST'])
 def index():
     # Get available sheets
     try:
-        sheets = get_all_sheets()
+        source = request_text_source()
+        sheets = source.list_sheets()
         sheet_name = request.args.get('sheet') or sheets[0]  # Use first sheet if none selected
     except Exception as e:
         logger.error(f"Error fetching sheets: {str(e)}")
+        source = None
         sheets = [SHEET_NAME]
         sheet_name = SHEET_NAME
 
-    # Get sample text from Google Sheet
-    try:
-        texts = get_texts_from_sheet(sheet_name)
-        sample_text = texts[0].strip('"') if texts else "Sample text will appear here"
-    except Exception as e:
-        logger.error(f"Error fetching sample text: {str(e)}")
-        sample_text = "Sample text will appear here"
+    # Get sample text from the text source
+    sample_text = "Sample text will appear here"
+    if source is not None:
+        try:
+            text = source.get_sample_text(sheet_name)
+            if text is not None:
+                sample_text = text.strip('"')
+        except Exception as e:
+            logger.error(f"Error fetching sample text: {str(e)}")
 
     fonts = get_system_fonts()
 
@@ -212,180 +2493,40 @@ def index():
             logger.error("No file part in the request")
             return redirect(request.url)
             
-        file = request.files['image_file']
-        if file.filename == '':
+        # Several images render every text onto each of them
+        files = [file for file in request.files.getlist('image_file') if file.filename != '']
+        if not files:
             flash('No selected file.')
             logger.error("No file selected")
             return redirect(request.url)
         
         # Get form parameters
-        sheet_name = request.form.get('sheet_name', SHEET_NAME)
-        font_name = request.form.get('font_name', 'ProximaNova-Bold.ttf')
-        font_size = int(request.form.get('font_size', 24))
-        font_color = request.form.get('font_color', '#ffffff')
-        alignment = request.form.get('alignment', 'center').lower()
-        text_background = request.form.get('text_background') == 'on'
-        text_background_color = request.form.get('text_background_color', '#000000')
-        bg_vertical_padding = int(request.form.get('bg_vertical_padding', 10))
-        bg_horizontal_padding = int(request.form.get('bg_horizontal_padding', 20))
-        bg_corner_radius = int(request.form.get('bg_corner_radius', 5))
-        
-        # Get text position and dimensions
-        text_x = int(request.form.get('text_x', 0))
-        text_y = int(request.form.get('text_y', 0))
-        text_width = int(request.form.get('text_width', 0))
-        text_height = int(request.form.get('text_height', 0))
-        
-        # Save uploaded file
-        upload_path = os.path.join('uploads', file.filename)
-        file.save(upload_path)
+        sheet_name = request.form.get('sheet_name') or None  # None picks the source's default sheet
+        style = parse_style(request.form)
         
         try:
-            # Get texts from the selected sheet
-            texts = get_texts_from_sheet(sheet_name)
-            logger.info(f"Starting to process {len(texts)} texts from sheet '{sheet_name}'")
-            
-            # Process each text
-            results = []
-            processed_count = 0
-            for text in texts:
-                try:
-                    processed_count += 1
-                    logger.info(f"Processing image {processed_count} of {len(texts)}")
-                    
-                    # Open the base image
-                    image = Image.open(upload_path).convert("RGBA")
-                    txt_layer = Image.new("RGBA", image.size, (255, 255, 255, 0))
-                    draw = ImageDraw.Draw(txt_layer)
-                    
-                    # Load fonts
-                    emoji_font = None
-                    regular_font = None
-                    
-                    # Try to load emoji font with different sizes
-                    emoji_font_paths = [
-                        '/System/Library/Fonts/Apple Color Emoji.ttc',
-                        '/System/Library/Fonts/Apple Color Emoji.ttf',
-                        '/Library/Fonts/Apple Color Emoji.ttf'
-                    ]
-                    emoji_sizes = [32, 64, 128, 160]
-                    
-                    for path in emoji_font_paths:
-                        if os.path.exists(path):
-                            for size in emoji_sizes:
-                                try:
-                                    emoji_font = ImageFont.truetype(path, size)
-                                    break
-                                except Exception as e:
-                                    continue
-                        if emoji_font:
-                            break
-                    
-                    # Load regular font
-                    try:
-                        regular_font = ImageFont.truetype(os.path.join('fonts', font_name), font_size)
-                    except OSError:
-                        try:
-                            regular_font = ImageFont.truetype('/System/Library/Fonts/Helvetica.ttc', font_size)
-                        except OSError:
-                            regular_font = ImageFont.load_default()
-                            logger.error("Failed to load fonts, using default")
-                    
-                    # Split text into lines based on width
-                    lines = wrap_text(text, regular_font, text_width, draw)
-                    current_y = text_y
-                    padding_x = int(font_size * 0.8)  # Horizontal padding
-                    padding_y = int(font_size * 0.4)  # Vertical padding
-                    line_height = int(font_size * 1.5)  # Line spacing
-                    
-                    for line in lines:
-                        # Split line into segments (text and emojis)
-                        segments = split_text_and_emojis(line)
-                        
-                        # Calculate total line width including all segments
-                        line_width = 0
-                        for segment, is_emoji in segments:
-                            font = emoji_font if is_emoji else regular_font
-                            bbox = draw.textbbox((0, 0), segment, font=font)
-                            segment_width = bbox[2] - bbox[0]
-                            line_width += segment_width
-                        
-                        # Calculate x position based on alignment
-                        if alignment == 'center':
-                            x = text_x + (text_width - line_width) // 2
-                        elif alignment == 'right':
-                            x = text_x + text_width - line_width
-                        else:  # left alignment
-                            x = text_x
-                        
-                        # Draw background for this line if enabled
-                        if text_background:
-                            bg_color = text_background_color
-                            # Convert hex color to RGBA with full opacity
-                            if bg_color.startswith('#'):
-                                r = int(bg_color[1:3], 16)
-                                g = int(bg_color[3:5], 16)
-                                b = int(bg_color[5:7], 16)
-                                bg_color = (r, g, b, 255)  # Full opacity
-                            
-                            # Get line height including any emoji
-                            max_height = font_size
-                            for segment, is_emoji in segments:
-                                font = emoji_font if is_emoji else regular_font
-                                bbox = draw.textbbox((0, 0), segment, font=font)
-                                height = bbox[3] - bbox[1]
-                                max_height = max(max_height, height)
-                            
-                            # Draw background with padding, ensuring it aligns with text
-                            bg_left = x - padding_x
-                            bg_right = x + line_width + padding_x
-                            bg_top = current_y - padding_y
-                            bg_bottom = current_y + max_height + padding_y
-                            
-                            draw_rounded_rectangle(draw, (bg_left, bg_top, bg_right, bg_bottom), bg_color, bg_corner_radius)
-                        
-                        # Draw each segment
-                        segment_x = x
-                        for segment, is_emoji in segments:
-                            if is_emoji:
-                                draw.text((segment_x, current_y), segment, font=emoji_font, embedded_color=True)
-                                bbox = draw.textbbox((segment_x, current_y), segment, font=emoji_font)
-                            else:
-                                draw.text((segment_x, current_y), segment, font=regular_font, fill=font_color)
-                                bbox = draw.textbbox((segment_x, current_y), segment, font=regular_font)
-                            segment_x += bbox[2] - bbox[0]
-                        
-                        current_y += line_height
-                    
-                    # Composite text layer onto base image
-                    result = Image.alpha_composite(image, txt_layer)
-                    
-                    # Save result
-                    base_filename = os.path.splitext(file.filename)[0]  # Get filename without extension
-                    output_filename = f"{base_filename}_HD-{len(results)+1:02d}.png"
-                    output_path = os.path.join('outputs', output_filename)
-                    result.save(output_path)
-                    
-                    # Only store base64 preview for first 5 images
-                    if len(results) < 5:
-                        img_io = BytesIO()
-                        result.save(img_io, 'PNG')
-                        img_io.seek(0)
-                        image_data = base64.b64encode(img_io.getvalue()).decode()
-                        results.append({'filename': output_filename, 'image_data': image_data})
-                    else:
-                        results.append({'filename': output_filename, 'image_data': None})
-                
-                except Exception as e:
-                    logger.error(f"Error processing text '{text}': {str(e)}")
-                    continue
+            workers = parse_workers(request.form)
+            # Save uploaded files; file names without extension name the outputs
+            templates = upload_templates(files, template_styles(request.form, style, len(files)))
+            output = parse_output_format(request.form)
+            source = request_text_source()
+            sheet_names = requested_sheet_names(request.form, source)
+            if sheet_names:
+                logger.info(f"Starting to process texts from sheets {sheet_names}")
+                groups = source.iter_sheets(sheet_names)
+            else:
+                # Stream texts from the selected sheet
+                logger.info(f"Starting to process texts from sheet '{sheet_name}'")
+                groups = [(None, source.iter_texts(sheet_name))]
+            results, stats = render_templates(templates, groups, workers=workers, output=output, batch_folder=True)
             
             if not results:
                 flash("Failed to generate any images")
                 return redirect(request.url)
             
-            logger.info(f"Successfully processed {processed_count} images out of {len(texts)} texts")
-            return render_template('index.html', results=results, fonts=fonts, sheets=sheets, total_processed=processed_count)
+            logger.info(f"Successfully processed {stats['rendered']} images out of {stats['rows']} texts")
+            return render_template('index.html', results=results, fonts=fonts, sheets=sheets,
+                                   total_processed=stats['rows'], batch_stats=stats)
             
         except Exception as e:
             flash(f"Error processing image: {str(e)}")
@@ -394,9 +2535,249 @@ def index():
     
     return render_template('index.html', sample_text=sample_text, fonts=fonts, sheets=sheets)
 
-@app.route('/download/<filename>')
+@app.route('/uploads', methods=['POST'])
+def create_upload():
+    """Store an image once, for /preview to refer to by ID, and return its ID and size."""
+    file = request.files.get('image_file')
+    if file is None or file.filename == '':
+        return jsonify({'error': 'No selected file.'}), 400
+    try:
+        upload = ingest_upload(file.stream)
+    except ImageTooLarge as e:
+        logger.error(f"Upload too large: {str(e)}")
+        return jsonify({'error': str(e)}), 413
+    except ValueError as e:
+        logger.error(f"Invalid upload: {str(e)}")
+        return jsonify({'error': str(e)}), 400
+    _preview_executor.submit(_warm_preview, upload)
+    return jsonify({'upload_id': upload['id'], 'size': upload['size'], 'original_size': upload['original_size'],
+                    'preview_url': url_for('preview', upload_id=upload['id'])}), 201
+
+@app.route('/preview', methods=['GET', 'POST'])
+def preview():
+    """
+    Render one text onto an uploaded image at reduced resolution and return it as a
+    small image. Takes upload_id (from /uploads), text, the style fields of the
+    batch form in the uploaded image's pixels, format (jpeg or webp) and max_side.
+    
+    Editors that send a preview on every change pass a session and an increasing
+    seq: requests overtaken by a newer one of the same session get 204 instead of
+    an image, whether they were still waiting or already rendering. Clients should
+    also abort the requests they no longer want.
+    """
+    start = time.perf_counter()
+    values = request.values
+    upload = get_upload(values.get('upload_id'))
+    if upload is None:
+        return jsonify({'error': 'Unknown upload'}), 404
+    try:
+        style = parse_style(values)
+        image_format, mimetype = PREVIEW_IMAGE_FORMATS[values.get('format', 'jpeg')]
+        max_side = min(int(values.get('max_side') or PREVIEW_MAX_SIDE), PREVIEW_MAX_SIDE)
+        seq = int(values.get('seq', 0))
+    except (KeyError, ValueError) as e:
+        return jsonify({'error': f"Invalid preview options: {e}"}), 400
+    session = values.get('session')
+    if not claim_preview(session, seq):
+        PREVIEWS.inc(result='superseded')
+        return '', 204
+    
+    # Timed for the Server-Timing header rather than the batch stage metrics
+    with collect_stages() as timings:
+        base, scale = preview_base(upload, max(1, max_side))
+        image = render_text_image(base, values.get('text', ''), scale_style(style, scale))
+        if preview_superseded(session, seq):
+            PREVIEWS.inc(result='superseded')
+            return '', 204
+        with timed('encode'):
+            buffer = BytesIO()
+            image.convert('RGB').save(buffer, image_format, quality=PREVIEW_QUALITY)
+    seconds = time.perf_counter() - start
+    PREVIEWS.inc(result='rendered')
+    PREVIEW_SECONDS.observe(seconds)
+    response = Response(buffer.getvalue(), mimetype=mimetype)
+    response.headers['Cache-Control'] = 'no-store'
+    response.headers['Server-Timing'] = ', '.join(
+        [f"{stage};dur={timings[stage] * 1000:.1f}" for stage in STAGES if stage in timings]
+        + [f"total;dur={seconds * 1000:.1f}"])
+    return response
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    """Start a batch from the same form as / and return its job ID without waiting for it."""
+    files = [file for file in request.files.getlist('image_file') if file.filename != '']
+    if not files:
+        logger.error("No file selected for batch job")
+        return jsonify({'error': 'No selected file.'}), 400
+    
+    sheet_name = request.form.get('sheet_name') or None
+    try:
+        style = parse_style(request.form)
+        source = request_text_source()
+        output = parse_output_format(request.form)
+        sheet_names = requested_sheet_names(request.form, source)
+        workers = parse_workers(request.form)
+        templates = upload_templates(files, template_styles(request.form, style, len(files)))
+    except ImageTooLarge as e:
+        logger.error(f"Batch image too large: {str(e)}")
+        return jsonify({'error': str(e)}), 413
+    except ValueError as e:
+        logger.error(f"Invalid batch options: {str(e)}")
+        return jsonify({'error': str(e)}), 400
+    
+    job = submit_batch_job(templates, sheet_name, workers, source, sheet_names, output)
+    logger.info(f"Submitted batch job {job.job_id} for sheet(s) {sheet_names or [sheet_name]}")
+    return jsonify(_job_urls(job, job.to_dict())), 202
+
+def _job_urls(job, data):
+    data.update(
+        status_url=url_for('job_status', job_id=job.job_id),
+        events_url=url_for('job_events', job_id=job.job_id),
+        results_url=url_for('job_results', job_id=job.job_id),
+    )
+    return data
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(_job_urls(job, job.to_dict()))
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """Server-sent events stream of a job: start, one row event per row, then done or failed."""
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    # Reconnecting EventSource clients resume after the last event they saw
+    try:
+        since = int(request.headers.get('Last-Event-ID', -1)) + 1
+    except ValueError:
+        since = 0
+    results_url = url_for('job_results', job_id=job_id)
+    
+    def stream():
+        index = since
+        while True:
+            index, events = job.wait_for_events(index, SSE_KEEPALIVE_SECONDS)
+            if not events:
+                if job.finished:
+                    return
+                yield ": keep-alive\n\n"
+                continue
+            for event, data in events:
+                if event == 'done':
+                    data = dict(data, results_url=results_url)
+                yield f"id: {index}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+                index += 1
+            if job.finished and index >= job.event_count:
+                return
+    
+    # Followed from now on, so rows published before the stream starts are still sent
+    job.follow()
+    response = Response(stream(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    response.call_on_close(job.unfollow)
+    return response
+
+@app.route('/jobs/<job_id>/results')
+def job_results(job_id):
+    job = get_job(job_id)
+    if job is None:
+        flash('Unknown batch.')
+        return redirect(url_for('index'))
+    if not job.finished:
+        flash('The batch is still rendering.')
+        return redirect(url_for('index'))
+    if not job.results:
+        flash(f"Failed to generate any images{': ' + job.error if job.error else ''}")
+        return redirect(url_for('index'))
+    
+    try:
+        sheets = job.source.list_sheets()
+    except Exception as e:
+        logger.error(f"Error fetching sheets: {str(e)}")
+        sheets = [SHEET_NAME]
+    return render_template('index.html', results=job.results, fonts=get_system_fonts(), sheets=sheets,
+                           total_processed=job.stats['rows'], batch_stats=job.stats)
+
+# --- Batch Archives ---
+# Already-compressed formats are stored as-is; deflating them again only costs CPU
+STORED_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+ZIP_CHUNK_SIZE = 64 * 1024
+
+class _ZipStream:
+    """Write-only file object that hands what zipfile writes back out as chunks."""
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def drain(self):
+        chunks, self._chunks = self._chunks, []
+        return chunks
+
+def iter_zip(files):
+    """
+    Yield a ZIP archive of the given (arcname, path) pairs chunk by chunk.
+    Files are read and written in fixed-size pieces, so memory use does not
+    grow with file or archive size.
+    """
+    stream = _ZipStream()
+    with zipfile.ZipFile(stream, 'w') as archive:
+        for arcname, path in files:
+            info = zipfile.ZipInfo.from_file(path, arcname)
+            if path.lower().endswith(STORED_EXTENSIONS):
+                info.compress_type = zipfile.ZIP_STORED
+            else:
+                info.compress_type = zipfile.ZIP_DEFLATED
+            with open(path, 'rb') as src, archive.open(info, 'w') as dest:
+                for chunk in iter(lambda: src.read(ZIP_CHUNK_SIZE), b''):
+                    dest.write(chunk)
+                    yield from stream.drain()
+            yield from stream.drain()
+    yield from stream.drain()
+
+@app.route('/download/batch/<batch_id>.zip')
+def download_batch(batch_id):
+    entries = read_batch_manifest(batch_id)
+    if entries is None:
+        return jsonify({'error': 'Unknown batch'}), 404
+    
+    files = []
+    for arcname, filename in entries:
+        path = os.path.join(OUTPUTS_DIR, filename)
+        if os.path.exists(path):
+            files.append((arcname, path))
+        else:
+            logger.warning("File %s of batch %s no longer exists", filename, batch_id)
+    logger.debug("Streaming %d files of batch %s", len(files), batch_id)
+    return Response(iter_zip(files), mimetype='application/zip',
+                    headers={'Content-Disposition': f'attachment; filename={batch_id}.zip'})
+
+@app.route('/previews/<filename>')
+def preview_image(filename):
+    response = send_from_directory(os.path.abspath(os.path.join(OUTPUTS_DIR, PREVIEWS_DIR)), filename,
+                                   max_age=PREVIEW_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+@app.route('/download/<path:filename>')
 def download_file(filename):
-    file_path = os.path.join('outputs', filename)
+    # Outputs of web batches are in a folder named after the batch
+    file_path = safe_join(OUTPUTS_DIR, filename)
+    if file_path is None or not os.path.isfile(file_path):
+        return jsonify({'error': 'Unknown file'}), 404
     logger.debug("Downloading file: %s", file_path)
     return send_file(file_path, as_attachment=True)
 
@@ -416,19 +2797,24 @@ def generated_images():
 @app.route('/sample_text/<sheet_name>')
 def get_sample_text(sheet_name):
     try:
-        texts = get_texts_from_sheet(sheet_name)
-        sample_text = texts[0].strip('"') if texts else "Sample text will appear here"
+        text = request_text_source().get_sample_text(sheet_name)
+        sample_text = text.strip('"') if text is not None else "Sample text will appear here"
         return jsonify({'sample_text': sample_text})
     except Exception as e:
         logger.error(f"Error fetching sample text: {str(e)}")
         return jsonify({'sample_text': "Sample text will appear here"}), 500
 
+@app.route('/metrics')
+def metrics():
+    """Stage timings, row and cache counters in the Prometheus text format."""
+    return Response(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/favicon.ico')
 def favicon():
     return send_from_directory('static', 'favicon.ico', mimetype='image/x-icon')
 
 if __name__ == '__main__':
     # Ensure required directories exist
-    os.makedirs('uploads', exist_ok=True)
+    os.makedirs(UPLOADS_DIR, exist_ok=True)
     os.makedirs('outputs', exist_ok=True)
     app.run(debug=True, port=5005)
\ No newline at end of file
@@ -0,0 +1,495 @@
+"""
+Benchmarks for the rendering hot paths in app.py and for whole batches.
+
+Runs offline with the bundled ProximaNova-Bold.ttf.
+
+Usage:
+    python bench.py                          # run every benchmark
+    python bench.py measure                  # run only the named benchmarks
+    python bench.py hotpaths batch --save base.json
+    python bench.py hotpaths batch --compare base.json   # exit 1 on regressions
+    python bench.py --load new.json --compare base.json  # compare two saved runs
+    python bench.py batch --rows 100 --sizes 800x600     # a quicker batch run
+"""
+import argparse
+import datetime
+import itertools
+import json
+import logging
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from multiprocessing import get_context
+
+from PIL import Image, ImageDraw
+
+# Styles name the bundled font, which lives next to this file
+os.environ.setdefault('FONTS_DIR', os.path.dirname(os.path.abspath(__file__)))
+
+import app
+
+BUNDLED_FONT = os.path.join(app.FONTS_DIR, 'ProximaNova-Bold.ttf')
+
+SAMPLE_TEXTS = [
+    "Summer sale starts today, don't miss out",
+    "New arrivals every week 👋 come and see what's in store",
+    "Free shipping on all orders over $50",
+    "Limited edition colours ❤️ available while stocks last",
+    "Tag us in your photos to be featured on our page 🌍",
+]
+
+BENCHMARKS = {}
+
+def benchmark(name):
+    """Register a benchmark function under the given name."""
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+    return register
+
+def bench_style(**overrides):
+    """The default form style, using the bundled font so the numbers mean something on Linux."""
+    style = app.parse_style({
+        'font_name': 'ProximaNova-Bold.ttf',
+        'font_size': '32',
+        'text_x': '100',
+        'text_y': '100',
+        'text_width': '600',
+        'text_height': '300',
+        'text_background': 'on',
+    })
+    style.update(overrides)
+    return style
+
+@contextmanager
+def count_textbbox_calls():
+    """Count calls to ImageDraw.textbbox made inside the block."""
+    counter = {'calls': 0}
+    original = ImageDraw.ImageDraw.textbbox
+
+    def counting_textbbox(self, *args, **kwargs):
+        counter['calls'] += 1
+        return original(self, *args, **kwargs)
+
+    ImageDraw.ImageDraw.textbbox = counting_textbbox
+    try:
+        yield counter
+    finally:
+        ImageDraw.ImageDraw.textbbox = original
+
+@contextmanager
+def measure_cache_size(maxsize):
+    """Temporarily replace the measurement cache; a size of 0 disables it."""
+    original = app._measure_cache
+    app._measure_cache = app.LRUCache(maxsize)
+    try:
+        yield app._measure_cache
+    finally:
+        app._measure_cache = original
+
+@benchmark('measure')
+def bench_measure_cache(rows=200):
+    """textbbox calls and time per rendered image with and without the measurement cache."""
+    base = Image.new('RGBA', (800, 600), (128, 0, 128, 255))
+    style = bench_style()
+    texts = [f"{SAMPLE_TEXTS[i % len(SAMPLE_TEXTS)]} #{i}" for i in range(rows)]
+    results = {}
+    for label, maxsize in (('uncached', 0), ('cached', app.MEASURE_CACHE_SIZE)):
+        # Layout plans would skip measuring altogether, so every pass starts without them
+        app._layout_cache.clear()
+        with measure_cache_size(maxsize), count_textbbox_calls() as counter:
+            start = time.perf_counter()
+            for text in texts:
+                app.render_text_image(base, text, style)
+            elapsed = time.perf_counter() - start
+        results[label] = {
+            'textbbox_calls_per_image': counter['calls'] / rows,
+            'ms_per_image': elapsed * 1000 / rows,
+        }
+    return results
+
+def legacy_wrap_text(text, font, max_width, draw, measure_func=None):
+    """The original wrap_text, which re-measures the whole growing line for every word."""
+    if measure_func is None:
+        measure_func = lambda t, d: app.measure_text(t, font, d)
+    words = text.split()
+    if not words:
+        return []
+    lines = []
+    current_line = words[0]
+    for word in words[1:]:
+        test_line = current_line + " " + word
+        w, _ = measure_func(test_line, draw)
+        if w <= max_width:
+            current_line = test_line
+        else:
+            lines.append(current_line)
+            current_line = word
+    lines.append(current_line)
+    return lines
+
+def sample_words(count):
+    words = " ".join(SAMPLE_TEXTS).split()
+    return " ".join(words[i % len(words)] for i in range(count))
+
+@benchmark('wrap')
+def bench_wrap(word_counts=(50, 100, 200, 500), max_widths=(600, 2400), repeat=5):
+    """wrap_text against the original implementation, with the measurement cache disabled."""
+    font = app.get_font(BUNDLED_FONT, 32)
+    draw = ImageDraw.Draw(Image.new('RGBA', (1, 1)))
+    results = {}
+    for count, max_width in itertools.product(word_counts, max_widths):
+        text = sample_words(count)
+        row = {}
+        lines = {}
+        for label, func in (('legacy', legacy_wrap_text), ('linear', app.wrap_text)):
+            with measure_cache_size(0), count_textbbox_calls() as counter:
+                start = time.perf_counter()
+                for _ in range(repeat):
+                    lines[label] = func(text, font, max_width, draw)
+                elapsed = time.perf_counter() - start
+            row[f'{label}_ms'] = elapsed * 1000 / repeat
+            row[f'{label}_textbbox_calls'] = counter['calls'] / repeat
+        assert lines['legacy'] == lines['linear'], f"line breaks differ for {count} words"
+        results[f'{count} words @{max_width}px'] = row
+    return results
+
+def legacy_rasterize_plan(base, plan, style):
+    """rasterize_plan as it was: a transparent layer the size of the image, composited in full."""
+    regular_font = app.load_regular_font(*plan['font'])
+    bg_color = style['text_background_color']
+    if bg_color.startswith('#'):
+        bg_color = tuple(int(bg_color[i:i + 2], 16) for i in (1, 3, 5)) + (255,)
+    txt_layer = Image.new("RGBA", base.size, (255, 255, 255, 0))
+    draw = ImageDraw.Draw(txt_layer)
+    text_x, text_y = style['text_x'], style['text_y']
+    for (_, y, _, _, segments), (left, top, right, bottom) in zip(plan['lines'], plan['backgrounds']):
+        if style['text_background']:
+            app.draw_rounded_rectangle(draw, (text_x + left, text_y + top, text_x + right, text_y + bottom),
+                                       bg_color, style['bg_corner_radius'])
+        for segment, is_emoji, x in segments:
+            if is_emoji:
+                bitmap, (left, top) = app.emoji_bitmap(segment, plan['font'][1])
+                app._blit(txt_layer, bitmap, text_x + x + left, text_y + y + top)
+            else:
+                draw.text((text_x + x, text_y + y), segment, font=regular_font, fill=style['font_color'])
+    return Image.alpha_composite(base, txt_layer)
+
+def _composite_run(mode, size, rows):
+    # Runs in a fresh process, so peak RSS only reflects this configuration
+    logging.getLogger().setLevel(logging.WARNING)
+    base = Image.new('RGBA', size, (128, 0, 128, 255))
+    style = bench_style()
+    plans = [app.layout_text(text, style) for text in SAMPLE_TEXTS]
+    rasterize = app.rasterize_plan if mode == 'region' else legacy_rasterize_plan
+    rasterize(base, plans[0], style)  # Load fonts outside the timed loop
+    start = time.perf_counter()
+    for i in range(rows):
+        rasterize(base, plans[i % len(plans)], style)
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is in kilobytes on Linux
+    return elapsed * 1000 / rows, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+@benchmark('composite')
+def bench_composite(sizes=((800, 600), (1920, 1080), (3000, 2000), (6000, 4000)), rows=20):
+    """
+    Time per image and process peak RSS for region-limited compositing against
+    full-frame compositing. Peak RSS includes the interpreter and the base image.
+    """
+    results = {}
+    for size in sizes:
+        row = {}
+        for mode in ('full_frame', 'region'):
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+                ms, peak_mb = executor.submit(_composite_run, mode, size, rows).result()
+            row[f'{mode}_ms'] = ms
+            row[f'{mode}_peak_mb'] = peak_mb
+        results[f'{size[0]}x{size[1]}'] = row
+    return results
+
+EMOJI_TEXTS = [
+    "🎉🎉 Party time 🥳 with friends 👯‍♀️ and cake 🎂🍰",
+    "Weather: ☀️ 🌤️ ⛅ 🌧️ ⛈️ 🌈 all in one week 😅",
+    "Team 👨‍👩‍👧‍👦 trip ✈️🏖️ flags 🇫🇷 🇯🇵 🇧🇷 thumbs 👍🏽👍🏿",
+]
+
+@contextmanager
+def emoji_cache_size(maxsize):
+    """Temporarily replace the emoji bitmap cache; a size of 0 disables it."""
+    original = app._emoji_cache
+    app._emoji_cache = app.LRUCache(maxsize, original.maxweight, original.weigh)
+    try:
+        yield app._emoji_cache
+    finally:
+        app._emoji_cache = original
+
+@benchmark('emoji')
+def bench_emoji(font_sizes=(24, 48, 96), rows=60):
+    """
+    Time per image for emoji-heavy rows with emoji bitmaps rasterized for every
+    draw and cached. Without an emoji font this measures the default font's tofu.
+    """
+    base = Image.new('RGBA', (1200, 800), (40, 40, 40, 255))
+    results = {}
+    for font_size in font_sizes:
+        style = bench_style(font_size=font_size, text_width=1000)
+        plans = [app.layout_text(text, style) for text in EMOJI_TEXTS]
+        row = {}
+        for label, maxsize in (('uncached', 0), ('cached', app.EMOJI_CACHE_SIZE)):
+            with emoji_cache_size(maxsize) as cache:
+                app.rasterize_plan(base, plans[0], style)  # Load fonts outside the timed loop
+                start = time.perf_counter()
+                for i in range(rows):
+                    app.rasterize_plan(base, plans[i % len(plans)], style)
+                elapsed = time.perf_counter() - start
+                row[f'{label}_ms'] = elapsed * 1000 / rows
+                row[f'{label}_cache_kb'] = cache.weight / 1024
+        results[f'{font_size}px'] = row
+    return results
+
+def legacy_split_text_and_emojis(text):
+    """The original segmenter: grows each segment by one character and treats any astral code point as emoji."""
+    segments = []
+    current_segment = ""
+    is_emoji = False
+    for char in text:
+        char_is_emoji = ord(char) > 0xFFFF
+        if char_is_emoji != is_emoji and current_segment:
+            segments.append((current_segment, is_emoji))
+            current_segment = ""
+        current_segment += char
+        is_emoji = char_is_emoji
+    if current_segment:
+        segments.append((current_segment, is_emoji))
+    return segments
+
+@benchmark('segment')
+def bench_segment(lengths=(100, 1000, 10000), repeat=20):
+    """Segmenter throughput in characters per microsecond on plain and emoji-heavy rows."""
+    results = {}
+    for kind, texts in (('plain', [SAMPLE_TEXTS[0], SAMPLE_TEXTS[2]]), ('emoji', EMOJI_TEXTS)):
+        sample = " ".join(texts)
+        for length in lengths:
+            text = (sample * (length // len(sample) + 1))[:length]
+            row = {}
+            for label, func in (('legacy', legacy_split_text_and_emojis),
+                                ('spans', lambda t: list(app.emoji_spans(t))),
+                                ('has_emoji', app.has_emoji)):
+                start = time.perf_counter()
+                for _ in range(repeat):
+                    func(text)
+                elapsed = time.perf_counter() - start
+                row[f'{label}_chars_per_us'] = length * repeat / (elapsed * 1e6)
+            results[f'{kind} {length} chars'] = row
+    return results
+
+ENCODE_OPTIONS = {
+    'png-1': {'output_format': 'png', 'png_compress_level': '1'},
+    'png-6': {'output_format': 'png'},
+    'png-9': {'output_format': 'png', 'png_compress_level': '9'},
+    'png8': {'output_format': 'png8'},
+    'webp-lossless': {'output_format': 'webp', 'webp_lossless': 'on'},
+    'webp-90': {'output_format': 'webp'},
+    'jpeg-90': {'output_format': 'jpeg'},
+}
+
+def photo_like(size):
+    """A noisy gradient, which compresses roughly like a photo rather than like a flat colour."""
+    noise = Image.effect_noise(size, 40).convert('RGB')
+    gradient = Image.linear_gradient('L').resize(size).convert('RGB')
+    return Image.blend(noise, gradient, 0.6).convert('RGBA')
+
+@benchmark('encode')
+def bench_encode(sizes=((1920, 1080), (3000, 2000)), repeat=1):
+    """Encode time and size per image for each output format option."""
+    results = {}
+    style = bench_style()
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            image = app.render_text_image(photo_like(size), SAMPLE_TEXTS[1], style)
+            for label, form in ENCODE_OPTIONS.items():
+                output = app.parse_output_format(form)
+                path = os.path.join(tmp, 'out' + app.OUTPUT_FORMATS[output['format']][0])
+                timings = [app.save_output(image, path, output) for _ in range(repeat)]
+                results[f'{size[0]}x{size[1]} {label}'] = {
+                    'encode_ms': min(seconds for seconds, _ in timings) * 1000,
+                    'kb': timings[0][1] / 1024,
+                }
+    return results
+
+def per_call_us(func, number, repeat=3):
+    """Best of repeat runs of calling func number times, in microseconds per call."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1e6 / number
+
+@benchmark('hotpaths')
+def bench_hotpaths():
+    """Microseconds per call of the functions every row goes through."""
+    font = app.get_font(BUNDLED_FONT, 32)
+    draw = ImageDraw.Draw(Image.new('RGBA', (1, 1)))
+    canvas = ImageDraw.Draw(Image.new('RGBA', (800, 200)))
+    base = Image.new('RGBA', (1920, 1080), (128, 0, 128, 255))
+    style = bench_style()
+    paragraph = sample_words(100)
+
+    def render_cold():
+        app._layout_cache.clear()
+        app.render_text_image(base, SAMPLE_TEXTS[1], style)
+
+    calls = {}
+    with measure_cache_size(0):
+        calls['measure_text uncached'] = per_call_us(lambda: app.measure_text(SAMPLE_TEXTS[0], font, draw), 200)
+        calls['wrap_text 100 words'] = per_call_us(lambda: app.wrap_text(paragraph, font, 600, draw), 20)
+    calls.update({
+        'measure_text cached': per_call_us(lambda: app.measure_text(SAMPLE_TEXTS[0], font, draw), 2000),
+        'split_text_and_emojis': per_call_us(lambda: app.split_text_and_emojis(EMOJI_TEXTS[2]), 2000),
+        'draw_rounded_rectangle': per_call_us(
+            lambda: app.draw_rounded_rectangle(canvas, (20, 20, 780, 120), (0, 0, 0, 255), 12), 200),
+        'render row cold': per_call_us(render_cold, 20),
+        'render row warm': per_call_us(lambda: app.render_text_image(base, SAMPLE_TEXTS[1], style), 20),
+    })
+    return {label: {'us_per_call': us} for label, us in calls.items()}
+
+@benchmark('batch')
+def bench_batch(rows=(100, 1000), sizes=((800, 600), (1920, 1080), (3000, 2000)), workers=1):
+    """
+    Whole batches through render_batch, as PNG and without the render cache, so
+    every row is laid out, drawn, encoded and written. Large sizes take minutes.
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for size, count in itertools.product(sizes, rows):
+            upload = os.path.join(tmp, 'base.png')
+            photo_like(size).convert('RGB').save(upload)
+            out_dir = os.path.join(tmp, f'out-{size[0]}x{size[1]}-{count}')
+            os.makedirs(out_dir)
+            texts = [f"{SAMPLE_TEXTS[i % len(SAMPLE_TEXTS)]} #{i}" for i in range(count)]
+            _, stats = app.render_batch(upload, texts, bench_style(), 'bench', workers=workers,
+                                        output_dir=out_dir, use_cache=False)
+            results[f'{size[0]}x{size[1]} x{count}'] = {
+                'seconds': stats['seconds'],
+                'images_per_second': stats['images_per_second'],
+                'encode_ms_per_image': stats['encode_ms_per_image'],
+            }
+    return results
+
+@benchmark('pipeline')
+def bench_pipeline(rows=200, size=(1920, 1080)):
+    """
+    One batch with every pipeline stage reduced to one thread and no read-ahead,
+    against the default PIPELINE, which overlaps encoding and writing with drawing.
+    """
+    serial = {stage: 1 for stage in app.PIPELINE}
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        upload = os.path.join(tmp, 'base.png')
+        photo_like(size).convert('RGB').save(upload)
+        texts = [f"{SAMPLE_TEXTS[i % len(SAMPLE_TEXTS)]} #{i}" for i in range(rows)]
+        for label, pipeline in (('one stage at a time', serial), ('default', None)):
+            out_dir = os.path.join(tmp, label.replace(' ', '-'))
+            os.makedirs(out_dir)
+            _, stats = app.render_batch(upload, texts, bench_style(), 'bench', output_dir=out_dir,
+                                        use_cache=False, pipeline=pipeline)
+            results[label] = {
+                'seconds': stats['seconds'],
+                'images_per_second': stats['images_per_second'],
+                'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            }
+    return results
+
+# Metrics where a larger number is an improvement; everything else is a cost
+HIGHER_IS_BETTER = ('per_second', 'per_us')
+
+def compare_results(baseline, current):
+    """
+    Return (benchmark, label, metric, old, new, change) for every metric in both
+    runs, where change is relative and positive when the metric got worse.
+    """
+    rows = []
+    for name, results in current.items():
+        for label, values in results.items():
+            old_values = baseline.get(name, {}).get(label, {})
+            for metric, new in values.items():
+                old = old_values.get(metric)
+                if not old:
+                    continue
+                change = (new - old) / old
+                if metric.endswith(HIGHER_IS_BETTER):
+                    change = -change
+                rows.append((name, label, metric, old, new, change))
+    return rows
+
+def run_metadata():
+    return {
+        'date': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'pillow': Image.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
+
+def parse_size(value):
+    width, _, height = value.partition('x')
+    return int(width), int(height)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('names', nargs='*', help=f"benchmarks to run (default: all of {', '.join(BENCHMARKS)})")
+    parser.add_argument('--save', metavar='FILE', help="write the results to a JSON file")
+    parser.add_argument('--load', metavar='FILE', help="read results from a JSON file instead of running")
+    parser.add_argument('--compare', metavar='FILE', help="compare against results saved with --save")
+    parser.add_argument('--threshold', type=float, default=0.15,
+                        help="relative slowdown reported as a regression (default 0.15)")
+    parser.add_argument('--rows', type=int, nargs='+', help="row counts for the batch benchmark")
+    parser.add_argument('--sizes', type=parse_size, nargs='+', help="image sizes for the batch benchmark, as WxH")
+    parser.add_argument('--workers', type=int, help="render processes for the batch benchmark")
+    args = parser.parse_args(argv)
+    logging.getLogger().setLevel(logging.WARNING)
+
+    batch_options = {key: value for key, value in (('rows', args.rows), ('sizes', args.sizes),
+                                                   ('workers', args.workers)) if value}
+    if args.load:
+        with open(args.load) as f:
+            results = json.load(f)['results']
+    else:
+        results = {}
+        for name in args.names or BENCHMARKS:
+            results[name] = BENCHMARKS[name](**(batch_options if name == 'batch' else {}))
+
+    for name, result in results.items():
+        print(f"== {name}")
+        for label, values in result.items():
+            print(f"  {label:>20}: " + ", ".join(f"{key}={value:.2f}" for key, value in values.items()))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'meta': run_metadata(), 'results': results}, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = 0
+        print(f"== compared with {args.compare} (positive changes are worse)")
+        for name, label, metric, old, new, change in compare_results(baseline, results):
+            flag = ''
+            if change > args.threshold:
+                flag = '  REGRESSION'
+                regressions += 1
+            print(f"  {name} {label} {metric}: {old:.2f} -> {new:.2f} ({change:+.0%}){flag}")
+        if regressions:
+            print(f"{regressions} regression(s) above {args.threshold:.0%}")
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,5 @@
+import os
+
+# Styles in the tests name the bundled font, which lives next to them. Set before
+# app is imported, so render workers in other processes find it too.
+os.environ.setdefault('FONTS_DIR', os.path.dirname(os.path.abspath(__file__)))
@@ -0,0 +1,178 @@
+"""
+Render a batch from the command line, without the web server.
+
+Uses the same rendering, text sources and render cache as app.py. Outputs are
+numbered by row (<name>_HD-NN.png, or <name>_<sheet>_HD-NN.png for several
+sheets), so an interrupted run can be resumed with --resume, which keeps the
+files already written and renders the rest.
+
+The style file is JSON with the fields of the web form, for example:
+
+    {"font_name": "ProximaNova-Bold.ttf", "font_size": 48, "font_color": "#ffffff",
+     "alignment": "center", "text_background": true, "text_x": 100, "text_y": 800,
+     "text_width": 1800, "output_format": "jpeg", "output_quality": 85}
+
+Several images render every text onto each of them, named after each image
+(bg_purple_HD-NN.png, ...). The style file may give each image its own text box
+with "text_boxes": [{"text_x": 40, "text_width": 1600}, null, ...].
+
+Usage:
+    python render_cli.py photo.jpg --style style.json --out renders/ --source csv:texts.csv
+    python render_cli.py bg_purple.png bg_teal.png --style style.json --out renders/ --source csv:texts.csv
+    python render_cli.py photo.jpg --style style.json --out renders/ --sheet Promo --sheet Sale
+    python render_cli.py photo.jpg --style style.json --out renders/ --all-sheets --workers 4 --resume
+
+A JSON summary of the run is printed to stdout (and written to --summary if given).
+Exits with 1 if any row or the whole run failed and 130 if interrupted.
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+import time
+import uuid
+
+import app
+
+# Files a batch writes before committing a row; left behind when a run is killed
+TMP_FILE_RE = re.compile(r'\.[0-9a-f]{32}-\d+(\.preview)?\.\w+')
+PROGRESS_EVERY = 100  # Rows between progress lines on stderr
+
+def load_style(path, images=1):
+    """
+    Read a style file and return (styles, output) as parsed from the equivalent form,
+    with a style for each of the batch's images.
+    """
+    with open(path, encoding='utf-8') as f:
+        fields = json.load(f)
+    # Checkboxes are 'on' in a form; true and false are friendlier in a file
+    form = {key: ('on' if value is True else '' if value is False else
+                  json.dumps(value) if isinstance(value, (list, dict)) else str(value)) for key, value in fields.items()}
+    return app.template_styles(form, app.parse_style(form), images), app.parse_output_format(form)
+
+def remove_stale_files(output_dir):
+    """Remove the uncommitted rows of runs that were interrupted."""
+    for name in os.listdir(output_dir):
+        if TMP_FILE_RE.fullmatch(name):
+            os.remove(os.path.join(output_dir, name))
+
+class Progress:
+    """Collects failures and reports progress on stderr as rows are committed."""
+    def __init__(self):
+        self.last = {}
+        self.failures = []
+
+    def __call__(self, event):
+        self.last = event
+        if event['status'] == 'failed':
+            self.failures.append({key: event.get(key) for key in ('row', 'sheet', 'text', 'error')})
+        if event['row'] % PROGRESS_EVERY == 0:
+            print(f"{event['row']} rows, {event['rendered']} rendered, {event['failed']} failed, "
+                  f"{event['images_per_second']:.1f} images/s", file=sys.stderr)
+
+def summarize(status, stats, progress, output_dir, seconds):
+    summary = {
+        'status': status,
+        'output_dir': os.path.abspath(output_dir),
+        'rows': stats.get('rows', progress.last.get('row', 0)),
+        'rendered': stats.get('rendered', progress.last.get('rendered', 0)),
+        'resumed': stats.get('resumed'),
+        'failed': stats.get('failed', progress.last.get('failed', 0)),
+        'seconds': seconds,
+    }
+    summary['images_per_second'] = (summary['rendered'] - (summary['resumed'] or 0)) / seconds if seconds else 0.0
+    for key in ('batch_id', 'workers', 'format', 'encode_ms_per_image', 'bytes', 'bytes_per_image',
+                'cache_hits', 'cache_hit_rate', 'stages', 'sheets', 'templates'):
+        if key in stats:
+            summary[key] = stats[key]
+    summary['failures'] = progress.failures
+    return summary
+
+def parse_pipeline(value):
+    """Parse pipeline settings such as 'encode=4,depth=16'."""
+    pipeline = {}
+    for item in value.split(','):
+        stage, _, count = item.partition('=')
+        if stage.strip() not in app.PIPELINE or not count.strip().isdigit():
+            raise argparse.ArgumentTypeError(f"expected STAGE=N with a stage of {', '.join(app.PIPELINE)}, got '{item}'")
+        pipeline[stage.strip()] = int(count)
+    return pipeline
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('images', nargs='+', metavar='image', help="base images to render the texts onto")
+    parser.add_argument('--style', required=True, help="JSON file with the style and output format fields")
+    parser.add_argument('--out', required=True, help="directory to write the images to")
+    parser.add_argument('--source', help="text source: 'gsheets', or a file or directory such as csv:texts.csv "
+                                         "(default: TEXT_SOURCE)")
+    parser.add_argument('--sheet', action='append', dest='sheets', metavar='NAME',
+                        help="sheet to render; repeat for several (default: the source's first sheet)")
+    parser.add_argument('--all-sheets', action='store_true', help="render every sheet of the source")
+    parser.add_argument('--name', help="filename prefix for a single image (default: the image's name)")
+    parser.add_argument('--workers', type=int, default=app.RENDER_WORKERS, help="render processes")
+    parser.add_argument('--pipeline', type=parse_pipeline, metavar='STAGE=N,...',
+                        help="threads and queue depths of the render pipeline, e.g. encode=4,depth=16")
+    parser.add_argument('--resume', action='store_true', help="keep images an earlier run already wrote")
+    parser.add_argument('--no-cache', action='store_true', help="do not use the render cache")
+    parser.add_argument('--summary', metavar='FILE', help="also write the JSON summary to this file")
+    parser.add_argument('-v', '--verbose', action='store_true', help="log every row")
+    args = parser.parse_args(argv)
+
+    # Logs go to stderr so stdout only carries the summary
+    root = logging.getLogger()
+    for handler in root.handlers:
+        if getattr(handler, 'stream', None) is sys.stdout:
+            handler.setStream(sys.stderr)
+    root.setLevel(logging.INFO if args.verbose else logging.WARNING)
+
+    if args.name and len(args.images) > 1:
+        parser.error("--name only applies to a single image; several are named after their files")
+    try:
+        styles, output = load_style(args.style, len(args.images))
+    except (OSError, ValueError) as e:
+        parser.error(f"cannot read style file {args.style}: {e}")
+    os.makedirs(args.out, exist_ok=True)
+    if args.resume:
+        remove_stale_files(args.out)
+    templates = [(args.name or os.path.splitext(os.path.basename(image))[0], image, style)
+                 for image, style in zip(args.images, styles)]
+    progress = Progress()
+    # Previews and manifests only serve the web results page
+    options = dict(workers=args.workers, output_dir=args.out, batch_id=uuid.uuid4().hex, progress=progress,
+                   output=output, use_cache=not args.no_cache, numbering='row', skip_existing=args.resume,
+                   pipeline=args.pipeline, results_page=False)
+    start = time.perf_counter()
+    stats = {}
+    status = 'done'
+    error = None
+    try:
+        source = app.get_text_source(args.source, trusted=True)
+        sheet_names = source.list_sheets() if args.all_sheets else args.sheets
+        if sheet_names and (args.all_sheets or len(sheet_names) > 1):
+            groups = source.iter_sheets(sheet_names)
+        else:
+            groups = [(None, source.iter_texts(sheet_names[0] if sheet_names else None))]
+        _, stats = app.render_templates(templates, groups, **options)
+    except KeyboardInterrupt:
+        status = 'interrupted'
+    except Exception as e:
+        logging.error("Batch failed: %s", e)
+        status = 'failed'
+        error = str(e)
+
+    summary = summarize(status, stats, progress, args.out, time.perf_counter() - start)
+    if error:
+        summary['error'] = error
+    text = json.dumps(summary, indent=2, ensure_ascii=False)
+    print(text)
+    if args.summary:
+        with open(args.summary, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    if status == 'interrupted':
+        return 130
+    return 1 if status == 'failed' or summary['failed'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
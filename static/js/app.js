@@ -5,6 +5,7 @@ import { state } from './state.js';
 import { FileUploader } from './components/fileUploader.js';
 import { ImagePreview } from './components/imagePreview.js';
 import { StyleSettings } from './components/styleSettings.js';
+import { RenderedPreview } from './components/renderedPreview.js';
 import { initErrorHandling, showErrorToast, showSuccessToast } from './utils/errorHandler.js';
 import { validateImageFile } from './utils/fileUtils.js';
 
@@ -79,6 +80,12 @@ function initUI(sampleText) {
   if (form) {
     form.addEventListener('submit', handleFormSubmit);
   }
+  
+  // Initialize the server-rendered preview
+  const renderedPreviewContainer = document.getElementById('rendered-preview');
+  if (renderedPreviewContainer && form) {
+    new RenderedPreview(renderedPreviewContainer, form, sampleText);
+  }
 }
 
 /**
@@ -120,8 +127,10 @@ function initSheetSelector() {
       const selectedSheet = this.value;
       state.set('settings.sheetName', selectedSheet);
       
-      // Fetch new sample text
-      fetch(`/sample_text/${selectedSheet}`)
+      // Fetch new sample text from the same text source as the sheet list
+      const source = document.getElementById('text_source');
+      const query = source && source.value ? `?source=${encodeURIComponent(source.value)}` : '';
+      fetch(`/sample_text/${encodeURIComponent(selectedSheet)}${query}`)
         .then(response => {
           if (!response.ok) {
             throw new Error(`HTTP error ${response.status}`);
@@ -129,6 +138,8 @@ function initSheetSelector() {
           return response.json();
         })
         .then(data => {
+          state.set('sampleText', data.sample_text);
+          
           // Update sample text in preview
           const dummyText = document.getElementById('dummy-text');
           if (dummyText) {
@@ -198,5 +209,87 @@ function handleFormSubmit(e) {
   }
   
   // We could add more validation here, but this covers the critical cases
-  return true;
+  
+  // Render in the background and follow progress; browsers without
+  // EventSource fall back to the normal blocking form submission
+  if (!window.EventSource) {
+    return true;
+  }
+  e.preventDefault();
+  submitBatchJob(e.target);
+  return false;
+}
+
+/**
+ * Submit the form as a background batch job
+ * @param {HTMLFormElement} form - The image form
+ */
+function submitBatchJob(form) {
+  const submitButton = form.querySelector('button[type="submit"]');
+  if (submitButton) {
+    submitButton.disabled = true;
+  }
+  
+  fetch('/jobs', { method: 'POST', body: new FormData(form) })
+    .then(response => {
+      if (!response.ok) {
+        throw new Error(`HTTP error ${response.status}`);
+      }
+      return response.json();
+    })
+    .then(job => followBatchJob(job, submitButton))
+    .catch(error => {
+      console.error('Error starting batch:', error);
+      showErrorToast(`Failed to start batch: ${error.message}`);
+      if (submitButton) {
+        submitButton.disabled = false;
+      }
+    });
+}
+
+/**
+ * Follow a batch job's event stream and open its results when it finishes
+ * @param {Object} job - Job description returned by /jobs
+ * @param {HTMLElement} submitButton - Button to re-enable if the batch fails
+ */
+function followBatchJob(job, submitButton) {
+  const progress = document.getElementById('job-progress');
+  const showProgress = (message) => {
+    if (progress) {
+      progress.style.display = 'block';
+      progress.textContent = message;
+    }
+  };
+  
+  let total = null;
+  const events = new EventSource(job.events_url);
+  showProgress('Starting batch...');
+  
+  events.addEventListener('start', (e) => {
+    total = JSON.parse(e.data).total;
+    showProgress(`Rendering 0 of ${total ?? '?'} images...`);
+  });
+  
+  events.addEventListener('row', (e) => {
+    const row = JSON.parse(e.data);
+    const failed = row.failed ? `, ${row.failed} failed` : '';
+    showProgress(`Rendered ${row.rendered} of ${total ?? '?'} images${failed} (${row.images_per_second.toFixed(1)} images/s)`);
+  });
+  
+  events.addEventListener('done', (e) => {
+    events.close();
+    const data = JSON.parse(e.data);
+    showSuccessToast(`Generated ${data.rendered} images`);
+    window.location.href = data.results_url;
+  });
+  
+  events.addEventListener('failed', (e) => {
+    events.close();
+    const data = JSON.parse(e.data);
+    showErrorToast(`Batch failed: ${data.error}`);
+    showProgress('');
+    if (submitButton) {
+      submitButton.disabled = false;
+    }
+  });
 } 
\ No newline at end of file
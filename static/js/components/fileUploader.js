@@ -36,16 +36,20 @@ export class FileUploader {
    * @param {Event} e - The change event
    */
   handleFileChange(e) {
-    const file = e.target.files[0];
+    // Several images render every text onto each of them; the first one is previewed
+    const files = Array.from(e.target.files);
+    const file = files[0];
     if (!file) return;
     
-    // Validate the file
-    const validation = validateImageFile(file);
-    if (!validation.valid) {
-      alert(validation.message);
-      // Clear the file input
-      this.fileInput.value = '';
-      return;
+    // Validate the files
+    for (const candidate of files) {
+      const validation = validateImageFile(candidate);
+      if (!validation.valid) {
+        alert(validation.message);
+        // Clear the file input
+        this.fileInput.value = '';
+        return;
+      }
     }
     
     // Update the label with the filename
@@ -53,7 +57,7 @@ export class FileUploader {
       <svg width="24" height="24" viewBox="0 0 24 24" fill="none">
         <path d="M12 5v14m-7-7l7-7 7 7" stroke="currentColor" stroke-width="2" stroke-linecap="round"/>
       </svg>
-      <span>${file.name}</span>
+      <span>${file.name}${files.length > 1 ? ` and ${files.length - 1} more` : ''}</span>
     `;
     
     // Create a preview and store the file
@@ -90,21 +94,22 @@ export class FileUploader {
       preventDefaults(e);
       unhighlight();
       
-      const dt = e.dataTransfer;
-      const file = dt.files[0];
+      const files = Array.from(e.dataTransfer.files);
       
-      if (!file) return;
+      if (!files.length) return;
       
-      // Validate the file
-      const validation = validateImageFile(file);
-      if (!validation.valid) {
-        alert(validation.message);
-        return;
+      // Validate the files
+      for (const file of files) {
+        const validation = validateImageFile(file);
+        if (!validation.valid) {
+          alert(validation.message);
+          return;
+        }
       }
       
-      // Set the file in the input element
+      // Set the files in the input element
       const dataTransfer = new DataTransfer();
-      dataTransfer.items.add(file);
+      files.forEach(file => dataTransfer.items.add(file));
       this.fileInput.files = dataTransfer.files;
       
       // Trigger the change event
@@ -177,6 +177,9 @@ export class ImagePreview {
     }
     
     this.updatePreview();
+    
+    // Let subscribers know the selection is final
+    state.set('selection', state.selection);
   }
   
   /**
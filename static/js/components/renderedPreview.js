@@ -0,0 +1,128 @@
+/**
+ * Rendered Preview Component
+ * Shows the sample text as the server renders it, updated as the style changes
+ */
+import { state } from '../state.js';
+
+// Wait for this long after the last change before asking for a new preview
+const DEBOUNCE_MS = 150;
+
+export class RenderedPreview {
+  /**
+   * Create a new RenderedPreview instance
+   * @param {HTMLElement} container - Container for the rendered preview
+   * @param {HTMLFormElement} form - The batch form, whose fields are the style
+   * @param {string} sampleText - Text to render
+   */
+  constructor(container, form, sampleText) {
+    this.container = container;
+    this.image = container.querySelector('img');
+    this.form = form;
+    this.sampleText = sampleText;
+
+    this.uploadId = null;
+    this.timer = null;
+    this.controller = null;
+    this.objectUrl = null;
+    // Lets the server skip requests that a newer one has overtaken
+    this.session = window.crypto && crypto.randomUUID ? crypto.randomUUID() : String(Math.random()).slice(2);
+    this.seq = 0;
+
+    this.init();
+  }
+
+  /**
+   * Initialize the preview
+   */
+  init() {
+    // Upload the image once; previews refer to it by ID
+    state.subscribe('image', (image) => {
+      if (image && image.file) {
+        this.upload(image.file);
+      }
+    });
+
+    // The sample text follows the selected sheet
+    state.subscribe('sampleText', (text) => {
+      this.sampleText = text;
+      this.schedule();
+    });
+    state.subscribe('settings', () => this.schedule());
+    state.subscribe('selection', () => this.schedule());
+    this.form.addEventListener('input', () => this.schedule());
+    this.form.addEventListener('change', (e) => {
+      if (e.target.type !== 'file') this.schedule();
+    });
+  }
+
+  /**
+   * Upload an image for previews
+   * @param {File} file - The selected image
+   */
+  async upload(file) {
+    this.uploadId = null;
+    const body = new FormData();
+    body.append('image_file', file);
+
+    try {
+      const response = await fetch('/uploads', { method: 'POST', body });
+      const data = await response.json();
+      if (!response.ok) {
+        throw new Error(data.error || `Upload failed with status ${response.status}`);
+      }
+      this.uploadId = data.upload_id;
+      this.schedule();
+    } catch (error) {
+      console.error('Error uploading image for previews:', error);
+    }
+  }
+
+  /**
+   * Ask for a new preview once the changes have settled
+   */
+  schedule() {
+    if (!this.uploadId) return;
+    clearTimeout(this.timer);
+    this.timer = setTimeout(() => this.refresh(), DEBOUNCE_MS);
+  }
+
+  /**
+   * Fetch and show a preview of the current style
+   */
+  async refresh() {
+    // Only the newest preview matters, so the one still in flight is aborted
+    if (this.controller) {
+      this.controller.abort();
+    }
+    this.controller = new AbortController();
+
+    const params = new URLSearchParams();
+    for (const [key, value] of new FormData(this.form)) {
+      if (typeof value === 'string') params.append(key, value);
+    }
+    params.set('upload_id', this.uploadId);
+    params.set('text', this.sampleText);
+    params.set('session', this.session);
+    params.set('seq', ++this.seq);
+
+    try {
+      const response = await fetch(`/preview?${params}`, { signal: this.controller.signal });
+      // Overtaken by a newer request
+      if (response.status === 204) return;
+      if (!response.ok) {
+        throw new Error(`Preview failed with status ${response.status}`);
+      }
+      const url = URL.createObjectURL(await response.blob());
+      if (this.objectUrl) {
+        URL.revokeObjectURL(this.objectUrl);
+      }
+      this.objectUrl = url;
+      this.image.src = url;
+      this.container.style.display = 'block';
+    } catch (error) {
+      if (error.name !== 'AbortError') {
+        console.error('Error rendering preview:', error);
+      }
+    }
+  }
+}
@@ -1,9 +1,13 @@
 import os
 import pytest
 from PIL import Image, ImageDraw, ImageFont
-from app import app, measure_text, wrap_text, split_text_and_emojis, draw_rounded_rectangle, get_system_fonts, has_emoji
+import app as app_module
+from app import app, measure_text, wrap_text, split_text_and_emojis, draw_rounded_rectangle, get_system_fonts, has_emoji, parse_style, render_text_image
 import unittest
+import unittest.mock
 import io
+import shutil
+import tempfile
 
 @pytest.fixture
 def test_image():
@@ -147,11 +151,91 @@ def test_multiple_emojis_measurement(emoji_font, test_image):
     assert text_width > width  # Should be wider than just emojis
     assert text_height > 0
 
+def test_measure_text_is_memoized(test_image):
+    font = ImageFont.truetype('ProximaNova-Bold.ttf', 24)
+    draw = ImageDraw.Draw(test_image)
+    bbox = draw.textbbox((0, 0), "Cached text", font=font)
+    app_module._measure_cache.clear()
+    assert measure_text("Cached text", font, draw) == (bbox[2] - bbox[0], bbox[3] - bbox[1])
+    assert measure_text("Cached text", font, draw) == (bbox[2] - bbox[0], bbox[3] - bbox[1])
+    assert app_module.measure_cache_stats()['hits'] == 1
+    # Same string with a different font size is a separate entry
+    larger = ImageFont.truetype('ProximaNova-Bold.ttf', 48)
+    assert measure_text("Cached text", larger, draw)[0] > bbox[2] - bbox[0]
+
+def greedy_wrap(text, font, max_width, draw):
+    # Reference implementation: measure the whole growing line for every word
+    words = text.split()
+    if not words:
+        return []
+    lines = []
+    current_line = words[0]
+    for word in words[1:]:
+        test_line = current_line + " " + word
+        if measure_text(test_line, font, draw)[0] <= max_width:
+            current_line = test_line
+        else:
+            lines.append(current_line)
+            current_line = word
+    lines.append(current_line)
+    return lines
+
+@pytest.mark.parametrize("max_width", [0, 60, 150, 200, 333, 600, 5000])
+def test_wrap_text_matches_greedy_wrap(test_image, max_width):
+    font = ImageFont.truetype('ProximaNova-Bold.ttf', 24)
+    draw = ImageDraw.Draw(test_image)
+    texts = [
+        "This is a long text that should be wrapped across multiple lines",
+        "AVAVAV To Ty WA. kerning-heavy pairs: AV, To, Ty, Wa, Yo, LT",
+        "Supercalifragilisticexpialidocious is wider than most boxes",
+        "  leading   and trailing    spaces  ",
+        "single",
+        "",
+    ]
+    for text in texts:
+        assert wrap_text(text, font, max_width, draw) == greedy_wrap(text, font, max_width, draw)
+
+def test_wrap_text_measures_linearly(test_image):
+    font = ImageFont.truetype('ProximaNova-Bold.ttf', 24)
+    draw = ImageDraw.Draw(test_image)
+    measured = []
+    def counting_measure(text, draw):
+        measured.append(text)
+        return measure_text(text, font, draw)
+    text = " ".join(["word"] * 300)
+    lines = wrap_text(text, font, 300, draw, measure_func=counting_measure)
+    assert lines == greedy_wrap(text, font, 300, draw)
+    # Words, the space advance and a couple of exact checks per line, not one per word
+    assert len(measured) < 300 + 2 + 3 * len(lines)
+    assert sum(len(t) for t in measured) < 10 * len(text)
+
+def test_render_text_image(test_image):
+    style = parse_style({
+        'font_name': 'ProximaNova-Bold.ttf',
+        'font_size': '32',
+        'text_x': '100',
+        'text_y': '100',
+        'text_width': '400',
+        'text_height': '200',
+        'text_background': 'on',
+    })
+    result = render_text_image(test_image, "Hello world, this wraps onto several lines", style)
+    assert result.size == test_image.size
+    assert result is not test_image
+    assert result.tobytes() != test_image.tobytes()
+    # The base image is left untouched
+    assert test_image.getpixel((300, 120)) == (128, 0, 128, 255)
+
 class TestImageTextGenerator(unittest.TestCase):
     def setUp(self):
         app.config['TESTING'] = True
         self.client = app.test_client()
         
+        # Keep uploads out of the working tree
+        self.uploads_dir = tempfile.mkdtemp()
+        self.uploads_patch = unittest.mock.patch.object(app_module, 'UPLOADS_DIR', self.uploads_dir)
+        self.uploads_patch.start()
+        
         # Create test image
         self.test_image = Image.new('RGB', (800, 600), color='white')
         draw = ImageDraw.Draw(self.test_image)
@@ -166,6 +250,9 @@ class TestImageTextGenerator(unittest.TestCase):
             os.makedirs('outputs')
 
     def tearDown(self):
+        self.uploads_patch.stop()
+        shutil.rmtree(self.uploads_dir, ignore_errors=True)
+        
         # Clean up test files
         if os.path.exists(self.test_image_path):
             os.remove(self.test_image_path)
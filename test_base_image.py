@@ -0,0 +1,30 @@
+import pytest
+from PIL import Image
+import app as app_module
+from app import base_image, file_digest
+
+@pytest.fixture
+def upload(tmp_path):
+    path = tmp_path / 'upload.jpg'
+    Image.new('RGB', (64, 48), (200, 10, 10)).save(path)
+    return str(path)
+
+def test_base_image_is_decoded_to_rgba(upload):
+    with base_image(upload) as base:
+        assert base.mode == 'RGBA'
+        assert base.size == (64, 48)
+
+def test_base_image_is_shared_and_released(upload):
+    digest = file_digest(upload)
+    with base_image(upload) as first:
+        with base_image(upload) as second:
+            assert first is second
+            assert app_module._base_images[digest][1] == 2
+        assert digest in app_module._base_images
+    assert digest not in app_module._base_images
+
+def test_base_image_released_on_error(upload):
+    with pytest.raises(RuntimeError):
+        with base_image(upload):
+            raise RuntimeError("row failed")
+    assert file_digest(upload) not in app_module._base_images
@@ -0,0 +1,63 @@
+import io
+import os
+import zipfile
+import pytest
+from PIL import Image
+import app as app_module
+from app import app, iter_zip, parse_style, render_batch, render_sheets, ZIP_CHUNK_SIZE
+
+@pytest.fixture
+def outputs(tmp_path, monkeypatch):
+    out_dir = tmp_path / 'outputs'
+    out_dir.mkdir()
+    monkeypatch.setattr(app_module, 'OUTPUTS_DIR', str(out_dir))
+    return out_dir
+
+@pytest.fixture
+def client():
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        yield client
+
+def test_batch_zip_contains_every_output(outputs, tmp_path, client):
+    upload = tmp_path / 'photo.png'
+    Image.new('RGB', (120, 80), 'navy').save(upload)
+    style = parse_style({'font_name': 'ProximaNova-Bold.ttf', 'text_width': '100'})
+    results, stats = render_batch(str(upload), ["one", "two", "three"], style, 'photo')
+
+    response = client.get(f"/download/batch/{stats['batch_id']}.zip")
+    assert response.status_code == 200
+    assert response.mimetype == 'application/zip'
+    archive = zipfile.ZipFile(io.BytesIO(response.data))
+    assert archive.namelist() == [r['filename'] for r in results]
+    for info in archive.infolist():
+        # PNGs are already compressed and are stored as-is
+        assert info.compress_type == zipfile.ZIP_STORED
+        assert archive.read(info) == (outputs / info.filename).read_bytes()
+
+def test_sheet_batches_have_a_folder_per_sheet(outputs, tmp_path, client):
+    upload = tmp_path / 'photo.png'
+    Image.new('RGB', (120, 80), 'navy').save(upload)
+    style = parse_style({'font_name': 'ProximaNova-Bold.ttf', 'text_width': '100'})
+    _, stats = render_sheets(str(upload), [('Sheet1', ["one", "two"]), ('Promo', ["sale"])], style, 'photo')
+
+    response = client.get(f"/download/batch/{stats['batch_id']}.zip")
+    archive = zipfile.ZipFile(io.BytesIO(response.data))
+    assert archive.namelist() == ['Sheet1/photo_Sheet1_HD-01.png', 'Sheet1/photo_Sheet1_HD-02.png',
+                                  'Promo/photo_Promo_HD-01.png']
+
+def test_unknown_batch(outputs, client):
+    assert client.get('/download/batch/' + '0' * 32 + '.zip').status_code == 404
+    assert client.get('/download/batch/..%2F..%2Fsecrets.zip').status_code == 404
+
+def test_iter_zip_streams_in_small_chunks(tmp_path):
+    big = tmp_path / 'big.png'
+    big.write_bytes(os.urandom(ZIP_CHUNK_SIZE * 20))
+    notes = tmp_path / 'notes.txt'
+    notes.write_text('hello ' * 1000)
+    chunks = list(iter_zip([('big.png', str(big)), ('notes.txt', str(notes))]))
+    assert max(len(chunk) for chunk in chunks) <= ZIP_CHUNK_SIZE + 1024
+    archive = zipfile.ZipFile(io.BytesIO(b''.join(chunks)))
+    assert archive.read('big.png') == big.read_bytes()
+    assert archive.getinfo('notes.txt').compress_type == zipfile.ZIP_DEFLATED
+    assert archive.testzip() is None
@@ -0,0 +1,123 @@
+import os
+import pytest
+from PIL import Image
+import app as app_module
+from app import app, parse_style, parse_output_format, render_batch, render_sheets
+
+@pytest.fixture
+def upload(tmp_path):
+    path = tmp_path / 'photo.png'
+    Image.new('RGB', (320, 240), (30, 60, 90)).save(path)
+    return str(path)
+
+@pytest.fixture
+def style():
+    return parse_style({
+        'font_name': 'ProximaNova-Bold.ttf',
+        'font_size': '20',
+        'text_x': '10',
+        'text_y': '10',
+        'text_width': '300',
+        'text_height': '200',
+        'text_background': 'on',
+    })
+
+TEXTS = ["First row", None, "Third row wraps across a couple of lines", "Fourth", "Fifth row"]
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_render_batch_numbers_outputs_in_order(upload, style, tmp_path, workers):
+    out_dir = tmp_path / f'outputs-{workers}'
+    out_dir.mkdir()
+    results, stats = render_batch(upload, TEXTS, style, 'photo', workers=workers, output_dir=str(out_dir))
+    # The broken row (None) is skipped without using up a number
+    assert [r['filename'] for r in results] == [f'photo_HD-0{i}.png' for i in range(1, 5)]
+    assert sorted(f for f in os.listdir(out_dir) if not f.startswith('.')) == [r['filename'] for r in results]
+    assert stats['rows'] == 5
+    assert stats['rendered'] == 4
+    assert stats['failed'] == 1
+    assert stats['images_per_second'] > 0
+    assert all(r['preview'] for r in results)
+
+def test_parallel_output_matches_serial(upload, style, tmp_path):
+    outputs = {}
+    for workers in (1, 2):
+        out_dir = tmp_path / f'out-{workers}'
+        out_dir.mkdir()
+        results, _ = render_batch(upload, TEXTS, style, 'photo', workers=workers, output_dir=str(out_dir))
+        outputs[workers] = [Image.open(out_dir / r['filename']).tobytes() for r in results]
+    assert outputs[1] == outputs[2]
+
+def test_invalid_upload_fails_the_batch(tmp_path, style):
+    path = tmp_path / 'broken.png'
+    path.write_bytes(b'not an image')
+    for workers in (1, 2):
+        with pytest.raises(Exception):
+            render_batch(str(path), TEXTS, style, 'broken', workers=workers, output_dir=str(tmp_path))
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_render_sheets_numbers_each_sheet(upload, style, tmp_path, workers):
+    sheets = [('Spring sale', ["One", None, "Two"]), ('Empty', []), ('Spring/sale', iter(["Three"]))]
+    results, stats = render_sheets(upload, sheets, style, 'photo', workers=workers, output_dir=str(tmp_path))
+    assert [(r['sheet'], r['filename']) for r in results] == [
+        ('Spring sale', 'photo_Spring_sale_HD-01.png'),
+        ('Spring sale', 'photo_Spring_sale_HD-02.png'),
+        # Different sheet, same filename-safe name
+        ('Spring/sale', 'photo_Spring_sale-2_HD-01.png'),
+    ]
+    assert stats['sheets'] == {
+        'Spring sale': {'rows': 3, 'rendered': 2, 'failed': 1},
+        'Spring/sale': {'rows': 1, 'rendered': 1, 'failed': 0},
+    }
+    assert stats['rows'] == 4
+    assert 'sheets' not in render_batch(upload, ["Solo"], style, 'solo', output_dir=str(tmp_path))[1]
+
+@pytest.mark.parametrize("form, extension, image_format, mode", [
+    ({'output_format': 'png', 'png_compress_level': '1'}, '.png', 'PNG', 'RGBA'),
+    ({'output_format': 'png8'}, '.png', 'PNG', 'P'),
+    # libwebp leaves out the alpha channel of opaque images
+    ({'output_format': 'webp', 'output_quality': '80'}, '.webp', 'WEBP', 'RGB'),
+    ({'output_format': 'webp', 'webp_lossless': 'on'}, '.webp', 'WEBP', 'RGB'),
+    ({'output_format': 'jpeg', 'output_quality': '85'}, '.jpg', 'JPEG', 'RGB'),
+])
+@pytest.mark.parametrize("workers", [1, 2])
+def test_output_formats(upload, style, tmp_path, form, extension, image_format, mode, workers):
+    output = parse_output_format(form)
+    results, stats = render_batch(upload, ["One", "Two"], style, 'photo', workers=workers,
+                                  output_dir=str(tmp_path), output=output)
+    assert [r['filename'] for r in results] == [f'photo_HD-01{extension}', f'photo_HD-02{extension}']
+    for result in results:
+        path = tmp_path / result['filename']
+        assert result['bytes'] == path.stat().st_size
+        with Image.open(path) as image:
+            assert image.format == image_format
+            assert image.mode == mode
+    assert stats['format'] == output['format']
+    assert stats['bytes'] == sum(r['bytes'] for r in results)
+    assert stats['encode_ms_per_image'] > 0
+    # No temporary files left behind
+    assert not [f for f in os.listdir(tmp_path) if f.startswith('.') and f not in ('.batches', '.previews', '.render-cache')]
+
+def test_invalid_output_options():
+    assert parse_output_format({}) == {'format': 'png', 'compress_level': 6, 'quality': 90, 'lossless': False}
+    for form in ({'output_format': 'gif'}, {'png_compress_level': '12'}, {'output_quality': '0'}):
+        with pytest.raises(ValueError):
+            parse_output_format(form)
+
+def test_previews_are_small_and_cacheable(style, tmp_path, monkeypatch):
+    monkeypatch.setattr(app_module, 'OUTPUTS_DIR', str(tmp_path))
+    upload = tmp_path / 'large.png'
+    Image.new('RGB', (2400, 1200), (30, 60, 90)).save(upload)
+    results, _ = render_batch(str(upload), [f"Row {i}" for i in range(7)], style, 'large')
+    previews = [r['preview'] for r in results]
+    assert all(previews[:5]) and previews[5:] == [None, None]
+    with Image.open(tmp_path / '.previews' / previews[0]) as preview:
+        assert preview.size == (640, 320)
+
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        response = client.get(f'/previews/{previews[0]}')
+        assert response.status_code == 200
+        assert response.mimetype in ('image/webp', 'image/jpeg')
+        assert response.cache_control.max_age == app_module.PREVIEW_MAX_AGE
+        assert response.cache_control.immutable
+        assert client.get('/previews/../large.png').status_code == 404
@@ -0,0 +1,9 @@
+import pytest
+from bench import compare_results
+
+def test_changes_are_positive_when_worse():
+    baseline = {'batch': {'800x600 x100': {'seconds': 10.0, 'images_per_second': 10.0}}}
+    current = {'batch': {'800x600 x100': {'seconds': 12.0, 'images_per_second': 8.0, 'new_metric': 1.0}},
+               'hotpaths': {'render row warm': {'us_per_call': 100.0}}}
+    rows = {metric: change for _, _, metric, _, _, change in compare_results(baseline, current)}
+    assert rows == {'seconds': pytest.approx(0.2), 'images_per_second': pytest.approx(0.2)}
@@ -0,0 +1,56 @@
+import os
+import pytest
+from PIL import Image
+import app as app_module
+from app import LRUCache, emoji_bitmap, emoji_cache_stats, parse_style, render_text_image
+
+# Stand-in for a colour emoji font: any font works as long as it only loads at its strike
+STRIKE_FONT = '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+STRIKE_SIZE = 100
+
+@pytest.fixture(autouse=True)
+def strike_font(monkeypatch):
+    if not os.path.exists(STRIKE_FONT):
+        pytest.skip("DejaVu Sans is not installed")
+    monkeypatch.setattr(app_module, '_resolve_emoji_font', lambda: (STRIKE_FONT, STRIKE_SIZE))
+    monkeypatch.setattr(app_module, '_emoji_cache', LRUCache(app_module.EMOJI_CACHE_SIZE, app_module.EMOJI_CACHE_BYTES,
+                                                             app_module._emoji_cache.weigh))
+    app_module._layout_cache.clear()
+    yield
+    app_module._layout_cache.clear()
+
+def test_bitmaps_are_scaled_from_the_strike():
+    full, (left, top) = emoji_bitmap("★", STRIKE_SIZE)
+    half, (half_left, half_top) = emoji_bitmap("★", STRIKE_SIZE // 2)
+    assert full.mode == half.mode == 'RGBA'
+    assert abs(half.width - full.width / 2) <= 1
+    assert abs(half.height - full.height / 2) <= 1
+    assert abs(half_top - top / 2) <= 1
+    assert full.getbbox() is not None
+
+def test_bitmaps_are_rasterized_once():
+    first = emoji_bitmap("★", 24)
+    assert emoji_bitmap("★", 24) is first
+    assert emoji_bitmap("★", 32) is not first
+    assert emoji_cache_stats()['hits'] == 1
+    assert emoji_cache_stats()['misses'] == 2
+
+def test_rows_share_emoji_bitmaps():
+    style = parse_style({'font_name': 'ProximaNova-Bold.ttf', 'font_size': '30',
+                         'text_width': '400', 'text_x': '10', 'text_y': '10'})
+    base = Image.new('RGBA', (420, 200), (0, 0, 0, 255))
+    for text in ("First 🎉 row", "Second 🎉 row 🎉"):
+        render_text_image(base, text, style)
+    assert emoji_cache_stats()['misses'] == 1
+
+def test_cache_memory_is_bounded():
+    cache = LRUCache(100, maxweight=1000, weigh=len)
+    for i in range(5):
+        cache.put(i, b'x' * 300)
+    assert cache.stats()['weight'] == 900
+    assert cache.get(0) is None
+    assert cache.get(4) == b'x' * 300
+    cache.put(4, b'x' * 100)
+    assert cache.weight == 700
+    cache.pop(3)
+    assert cache.weight == 400
@@ -0,0 +1,31 @@
+import pytest
+from app import emoji_spans, has_emoji, split_text_and_emojis
+
+@pytest.mark.parametrize("text, segments", [
+    ("Hello 👋 World 🌍", [("Hello ", False), ("👋", True), (" World ", False), ("🌍", True)]),
+    # BMP emoji with a presentation selector, and text-default symbols without one
+    ("I ❤️ it", [("I ", False), ("❤️", True), (" it", False)]),
+    ("© 2024 ☀ sun", [("© 2024 ☀ sun", False)]),
+    ("⛅ cloud", [("⛅", True), (" cloud", False)]),
+    # Clusters stay whole and adjacent ones form one run
+    ("Family 👨‍👩‍👧‍👦!", [("Family ", False), ("👨‍👩‍👧‍👦", True), ("!", False)]),
+    ("👍🏽👍🏿 ok", [("👍🏽👍🏿", True), (" ok", False)]),
+    ("🇫🇷🇯🇵", [("🇫🇷🇯🇵", True)]),
+    ("Press 1️⃣ or #️⃣, not 12#", [("Press ", False), ("1️⃣", True), (" or ", False), ("#️⃣", True),
+                                  (", not 12#", False)]),
+    ("🏴\U000E0067\U000E0062\U000E0073\U000E0063\U000E0074\U000E007F!",
+     [("🏴\U000E0067\U000E0062\U000E0073\U000E0063\U000E0074\U000E007F", True), ("!", False)]),
+    # Astral code points that are not emoji stay with the text
+    ("𝐀𝐁 math", [("𝐀𝐁 math", False)]),
+    ("", []),
+])
+def test_segments(text, segments):
+    assert split_text_and_emojis(text) == segments
+    assert has_emoji(text) == any(is_emoji for _, is_emoji in segments)
+
+def test_spans_cover_the_text():
+    text = "Weather: ☀️ 🌤️ ⛅ then 🌧️ 👩🏽‍💻 and ✅ done"
+    spans = list(emoji_spans(text))
+    assert spans[0][0] == 0 and spans[-1][1] == len(text)
+    assert all(previous[1] == span[0] for previous, span in zip(spans, spans[1:]))
+    assert all(previous[2] != span[2] for previous, span in zip(spans, spans[1:]))
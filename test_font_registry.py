@@ -0,0 +1,79 @@
+import os
+import pytest
+from PIL import Image, ImageFont
+import app as app_module
+from app import LRUCache, get_font, load_regular_font, font_cache_stats
+
+FONT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ProximaNova-Bold.ttf')
+
+@pytest.fixture(autouse=True)
+def clear_font_cache():
+    app_module._font_cache.clear()
+    yield
+    app_module._font_cache.clear()
+
+def test_same_font_is_reused():
+    first = get_font(FONT_PATH, 24)
+    second = get_font(FONT_PATH, 24)
+    assert first is second
+    stats = font_cache_stats()
+    assert stats['hits'] == 1
+    assert stats['misses'] == 1
+
+def test_sizes_and_layout_engines_are_separate_entries():
+    small = get_font(FONT_PATH, 12)
+    large = get_font(FONT_PATH, 48)
+    basic = get_font(FONT_PATH, 12, ImageFont.Layout.BASIC)
+    assert small is not large
+    assert small is not basic
+    assert small.size == 12 and large.size == 48
+
+def test_font_file_is_read_once():
+    get_font(FONT_PATH, 10)
+    get_font(FONT_PATH, 20)
+    buffer = app_module._font_buffers.get(FONT_PATH)
+    assert buffer is not None
+    get_font(FONT_PATH, 30)
+    assert app_module._font_buffers.get(FONT_PATH) is buffer
+
+def test_failed_loads_do_not_keep_the_file(tmp_path):
+    path = tmp_path / 'image.png'
+    Image.new('RGB', (64, 64)).save(path)
+    with pytest.raises(OSError):
+        get_font(str(path), 24)
+    assert app_module._font_buffers.get(str(path)) is None
+    with pytest.raises(OSError):
+        get_font('/dev/zero', 24)
+    assert app_module._font_buffers.get('/dev/zero') is None
+
+def test_regular_fonts_are_only_loaded_from_fonts_dir(monkeypatch):
+    loaded = []
+    monkeypatch.setattr(app_module, 'get_font', lambda path, size: loaded.append(path) or ImageFont.load_default())
+    load_regular_font(FONT_PATH, 24)
+    load_regular_font('../ProximaNova-Bold.ttf', 24)
+    load_regular_font('ProximaNova-Bold.ttf', 24)
+    assert loaded[0] == app_module.FALLBACK_FONT_PATH
+    assert loaded[1] == app_module.FALLBACK_FONT_PATH
+    assert loaded[2] == os.path.join(app_module.FONTS_DIR, 'ProximaNova-Bold.ttf')
+
+def test_missing_font_raises_and_is_remembered():
+    with pytest.raises(OSError):
+        get_font('/nonexistent/font.ttf', 24)
+    with pytest.raises(OSError):
+        get_font('/nonexistent/font.ttf', 24)
+    assert font_cache_stats()['hits'] == 1
+
+def test_regular_font_falls_back_to_default():
+    font = load_regular_font('does-not-exist.ttf', 24)
+    assert font is not None
+
+def test_lru_eviction():
+    cache = LRUCache(2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1  # 'a' is now most recently used
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert len(cache) == 2
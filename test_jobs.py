@@ -0,0 +1,197 @@
+import io
+import json
+import os
+import time
+import zipfile
+import pytest
+from PIL import Image
+import app as app_module
+from app import app
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    (tmp_path / 'outputs').mkdir()
+    monkeypatch.setattr(app_module, 'OUTPUTS_DIR', str(tmp_path / 'outputs'))
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'uploads').mkdir()
+    monkeypatch.setattr(app_module, 'get_texts_from_sheet', lambda sheet_name=None: ["First", None, "Third"])
+    monkeypatch.setattr(app_module, 'iter_texts_from_sheet', lambda sheet_name=None: iter(["First", None, "Third"]))
+    monkeypatch.setattr(app_module, 'get_all_sheets', lambda: ['Sheet1'])
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        yield client
+
+def upload_form():
+    image = io.BytesIO()
+    Image.new('RGB', (200, 100), 'lightblue').save(image, 'PNG')
+    image.seek(0)
+    return {
+        'image_file': (image, 'photo.png'),
+        'sheet_name': 'Sheet1',
+        'text_x': '10',
+        'text_y': '10',
+        'text_width': '180',
+        'text_height': '80',
+    }
+
+def wait_for(client, job_id):
+    for _ in range(200):
+        status = client.get(f'/jobs/{job_id}').get_json()
+        if status['status'] in ('done', 'failed'):
+            return status
+        time.sleep(0.05)
+    raise AssertionError("job did not finish")
+
+def parse_events(body):
+    events = []
+    for block in body.strip().split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in block.split('\n') if not line.startswith(':'))
+        if fields:
+            events.append((fields['event'], json.loads(fields['data'])))
+    return events
+
+def test_submit_returns_job_id_at_once(client):
+    response = client.post('/jobs', data=upload_form(), content_type='multipart/form-data')
+    assert response.status_code == 202
+    job = response.get_json()
+    assert job['job_id']
+    assert job['events_url'] == f"/jobs/{job['job_id']}/events"
+    status = wait_for(client, job['job_id'])
+    assert status['status'] == 'done'
+    assert status['rendered'] == 2
+    assert status['failed'] == 1
+
+def test_event_stream_reports_every_row(client):
+    job = client.post('/jobs', data=upload_form(), content_type='multipart/form-data').get_json()
+    response = client.get(job['events_url'])
+    assert response.mimetype == 'text/event-stream'
+    events = parse_events(response.get_data(as_text=True))
+    assert [name for name, _ in events] == ['start', 'row', 'row', 'row', 'done']
+    assert events[0][1]['total'] is None  # Streamed rows are counted as they arrive
+    assert events[-1][1]['total'] == 3
+    assert [data['status'] for name, data in events if name == 'row'] == ['rendered', 'failed', 'rendered']
+    assert events[-1][1]['results_url'] == f"/jobs/{job['job_id']}/results"
+
+def test_event_stream_resumes_after_last_event_id(client, monkeypatch):
+    monkeypatch.setattr(app_module, 'JOB_EVENTS_KEPT', 3)
+    job = app_module.BatchJob('job', 'Sheet1', None)
+    job.follow()
+    job.start(None)
+    for row in range(1, 6):
+        job.row_done({'row': row, 'rendered': row, 'failed': 0})
+    # Events 0 to 2 are gone, so a client that saw event 1 resumes from 3
+    assert job.wait_for_events(2, 0) == (3, [('row', {'row': 3, 'rendered': 3, 'failed': 0}),
+                                             ('row', {'row': 4, 'rendered': 4, 'failed': 0}),
+                                             ('row', {'row': 5, 'rendered': 5, 'failed': 0})])
+    assert job.wait_for_events(5, 0)[0] == 5
+    job.finish([], {'rows': 5})
+    assert job.event_count == 7
+    assert [name for name, _ in job.wait_for_events(5, 0)[1]] == ['row', 'done']
+    # Once nobody follows the finished job only its final event is left
+    job.unfollow()
+    assert job.wait_for_events(4, 0) == (6, [('done', job.to_dict())])
+
+def test_event_stream_of_a_finished_job(client):
+    job = client.post('/jobs', data=upload_form(), content_type='multipart/form-data').get_json()
+    wait_for(client, job['job_id'])
+    response = client.get(job['events_url'], headers={'Last-Event-ID': '2'})
+    events = parse_events(response.get_data(as_text=True))
+    assert [name for name, _ in events] == ['done']
+    assert events[0][1]['rendered'] == 2
+
+def test_results_page_after_job_finishes(client):
+    job = client.post('/jobs', data=upload_form(), content_type='multipart/form-data').get_json()
+    wait_for(client, job['job_id'])
+    response = client.get(job['results_url'])
+    assert response.status_code == 200
+    assert b'photo_HD-01.png' in response.data
+    assert b'/previews/' in response.data
+    assert b'base64' not in response.data
+    assert b'Time by stage' in response.data
+
+def test_all_sheets_job(client, monkeypatch):
+    monkeypatch.setattr(app_module, 'get_all_sheets', lambda: ['Sheet1', 'Promo'])
+    monkeypatch.setattr(app_module, 'get_texts_from_sheets',
+                        lambda sheet_names=None: {name: [f"{name} text"] for name in sheet_names})
+    form = dict(upload_form(), all_sheets='on')
+    job = client.post('/jobs', data=form, content_type='multipart/form-data').get_json()
+    assert job['sheet_names'] == ['Sheet1', 'Promo']
+    status = wait_for(client, job['job_id'])
+    assert status['rendered'] == 2
+    response = client.get(job['results_url'])
+    assert b'photo_Sheet1_HD-01.png' in response.data
+    assert b'Promo: 1 of 1 rows' in response.data
+
+def test_jobs_with_the_same_image_name_keep_their_outputs(client):
+    jobs = {}
+    for colour in ((255, 0, 0), (0, 0, 255)):
+        image = io.BytesIO()
+        Image.new('RGB', (200, 100), colour).save(image, 'PNG')
+        image.seek(0)
+        form = dict(upload_form(), image_file=(image, 'photo.png'))
+        jobs[colour] = client.post('/jobs', data=form, content_type='multipart/form-data').get_json()['job_id']
+    for colour, job_id in jobs.items():
+        assert wait_for(client, job_id)['rendered'] == 2
+        response = client.get(f"/download/{job_id}/photo_HD-01.png")
+        assert response.status_code == 200
+        with Image.open(io.BytesIO(response.data)) as im:
+            assert im.getpixel((199, 99))[:3] == colour
+        archive = zipfile.ZipFile(io.BytesIO(client.get(f"/download/batch/{job_id}.zip").data))
+        assert archive.namelist() == ['photo_HD-01.png', 'photo_HD-02.png']
+    assert client.get('/download/../app.py').status_code == 404
+
+def test_unknown_job(client):
+    assert client.get('/jobs/nope').status_code == 404
+    assert client.get('/jobs/nope/events').status_code == 404
+
+def test_job_with_several_images(client):
+    form = upload_form()
+    second = io.BytesIO()
+    Image.new('RGB', (300, 100), 'salmon').save(second, 'PNG')
+    second.seek(0)
+    form['image_file'] = [form['image_file'], (second, 'wide.png')]
+    form['text_boxes'] = json.dumps([None, {'text_width': 280}])
+    job = client.post('/jobs', data=form, content_type='multipart/form-data').get_json()
+    assert job['templates'] == ['photo', 'wide']
+    status = wait_for(client, job['job_id'])
+    assert (status['rendered'], status['failed']) == (4, 2)
+    page = client.get(status['results_url'])
+    assert b'wide: 2 of 3 images' in page.data
+
+def test_malformed_text_boxes(client):
+    form = dict(upload_form(), text_boxes='[{"text_width": "wide"}]')
+    response = client.post('/jobs', data=form, content_type='multipart/form-data')
+    assert response.status_code == 400
+
+@pytest.mark.parametrize("field, value", [('font_size', 'abc'), ('workers', 'many'), ('workers', '0'),
+                                          ('workers', '100000')])
+def test_invalid_form_values(client, field, value):
+    response = client.post('/jobs', data=dict(upload_form(), **{field: value}), content_type='multipart/form-data')
+    assert response.status_code == 400
+    assert response.get_json()['error']
+
+def test_uploads_are_stored_by_content(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(app_module, 'MAX_UPLOAD_PIXELS', 100 * 50)
+    for name in ('photo.png', '../../elsewhere.png'):
+        form = upload_form()
+        form['image_file'] = (form['image_file'][0], name)
+        job = client.post('/jobs', data=form, content_type='multipart/form-data').get_json()
+        wait_for(client, job['job_id'])
+    # Both uploads were the same 200x100 image, stored once at half size
+    stored = [name for name in os.listdir(tmp_path / 'uploads') if name.endswith('.png')]
+    assert len(stored) == 1
+    with Image.open(tmp_path / 'uploads' / stored[0]) as im:
+        assert im.size == (100, 50)
+    with Image.open(tmp_path / 'outputs' / job['job_id'] / 'elsewhere_HD-01.png') as im:
+        assert im.size == (100, 50)
+
+def test_upload_that_is_not_an_image(client):
+    form = dict(upload_form(), image_file=(io.BytesIO(b'not an image'), 'photo.png'))
+    response = client.post('/jobs', data=form, content_type='multipart/form-data')
+    assert response.status_code == 400
+
+def test_upload_too_large_to_decode(client, monkeypatch):
+    monkeypatch.setattr(Image, 'MAX_IMAGE_PIXELS', 1000)
+    response = client.post('/jobs', data=upload_form(), content_type='multipart/form-data')
+    assert response.status_code == 413
+    assert 'too large' in response.get_json()['error']
@@ -0,0 +1,96 @@
+import json
+import os
+import pickle
+import pytest
+from PIL import Image, ImageDraw
+import app as app_module
+from app import (parse_style, layout_text, rasterize_plan, render_text_image, layout_cache_stats,
+                 draw_rounded_rectangle, emoji_bitmap, load_regular_font)
+
+TEXT = "Layout once, draw many times 👋 with wrapped lines"
+
+@pytest.fixture(autouse=True)
+def clear_layout_cache():
+    app_module._layout_cache.clear()
+    yield
+    app_module._layout_cache.clear()
+
+@pytest.fixture
+def style():
+    return parse_style({
+        'font_name': 'ProximaNova-Bold.ttf',
+        'font_size': '24',
+        'text_x': '20',
+        'text_y': '30',
+        'text_width': '240',
+        'text_height': '200',
+        'text_background': 'on',
+    })
+
+def test_plan_is_box_relative(style):
+    plan = layout_text(TEXT, style)
+    assert plan['font'] == (style['font_name'], 24)
+    assert len(plan['lines']) > 1
+    assert plan['lines'][0][1] == 0
+    left, top, right, bottom = plan['bbox']
+    for background in plan['backgrounds']:
+        assert left <= background[0] and top <= background[1]
+        assert background[2] <= right and background[3] <= bottom
+
+def test_colours_and_position_reuse_the_plan(style):
+    plan = layout_text(TEXT, style)
+    recoloured = dict(style, font_color='#ff0000', text_background_color='#00ff00',
+                      text_x=5, text_y=90, text_background=False)
+    assert layout_text(TEXT, recoloured) is plan
+    assert layout_cache_stats()['hits'] == 1
+    assert layout_text(TEXT, dict(style, font_size=30)) is not plan
+    assert layout_text(TEXT, dict(style, text_width=400)) is not plan
+
+def test_plans_survive_serialization(style):
+    base = Image.new('RGBA', (300, 260), (10, 80, 160, 255))
+    plan = layout_text(TEXT, style)
+    expected = render_text_image(base, TEXT, style).tobytes()
+    assert rasterize_plan(base, json.loads(json.dumps(plan)), style).tobytes() == expected
+    assert rasterize_plan(base, pickle.loads(pickle.dumps(plan)), style).tobytes() == expected
+
+def test_empty_text_has_no_lines(style):
+    plan = layout_text("", style)
+    assert plan['lines'] == ()
+    assert plan['bbox'] is None
+
+def full_frame_rasterize(base, plan, style):
+    # Reference: draw on a transparent layer the size of the image and composite all of it
+    regular_font = load_regular_font(*plan['font'])
+    txt_layer = Image.new("RGBA", base.size, (255, 255, 255, 0))
+    draw = ImageDraw.Draw(txt_layer)
+    for (_, y, _, _, segments), background in zip(plan['lines'], plan['backgrounds']):
+        if style['text_background']:
+            left, top, right, bottom = background
+            draw_rounded_rectangle(draw, (style['text_x'] + left, style['text_y'] + top,
+                                          style['text_x'] + right, style['text_y'] + bottom),
+                                   (51, 102, 204, 255), style['bg_corner_radius'])  # '#3366cc'
+        for segment, is_emoji, x in segments:
+            xy = (style['text_x'] + x, style['text_y'] + y)
+            if is_emoji:
+                bitmap, (left, top) = emoji_bitmap(segment, plan['font'][1])
+                app_module._blit(txt_layer, bitmap, xy[0] + left, xy[1] + top)
+            else:
+                draw.text(xy, segment, font=regular_font, fill=style['font_color'])
+    return Image.alpha_composite(base, txt_layer)
+
+@pytest.mark.parametrize('alignment', ['left', 'center', 'right'])
+@pytest.mark.parametrize('background', [True, False])
+@pytest.mark.parametrize('position', [(20, 30), (-60, -20), (150, 170)])
+def test_region_compositing_matches_full_frame(style, alignment, background, position):
+    # Random colours and alpha, so any pixel touched outside the text region would show
+    base = Image.frombytes('RGBA', (300, 220), os.urandom(300 * 220 * 4))
+    style = dict(style, alignment=alignment, text_background=background, text_background_color='#3366cc',
+                 text_x=position[0], text_y=position[1], bg_corner_radius=12)
+    plan = layout_text("Glyphs with descenders gjpqy 👋 and ÅÉÎ accents", style)
+    assert rasterize_plan(base, plan, style).tobytes() == full_frame_rasterize(base, plan, style).tobytes()
+
+def test_text_off_the_image_leaves_it_unchanged(style):
+    base = Image.new('RGBA', (100, 80), (1, 2, 3, 128))
+    result = render_text_image(base, TEXT, dict(style, text_x=500, text_y=500))
+    assert result is not base
+    assert result.tobytes() == base.tobytes()
@@ -0,0 +1,92 @@
+import os
+import re
+import time
+import pytest
+from PIL import Image
+import app as app_module
+from app import Histogram, app, collect_stages, parse_style, render_batch, timed
+
+@pytest.fixture(autouse=True)
+def clear_layout_cache():
+    app_module._layout_cache.clear()
+    yield
+    app_module._layout_cache.clear()
+
+@pytest.fixture
+def upload(tmp_path):
+    path = tmp_path / 'photo.png'
+    Image.new('RGB', (240, 160), (90, 30, 60)).save(path)
+    return str(path)
+
+@pytest.fixture
+def style():
+    return parse_style({
+        'font_name': 'ProximaNova-Bold.ttf',
+        'font_size': '20',
+        'text_width': '220',
+        'text_background': 'on',
+    })
+
+def sample(text, name):
+    match = re.search(r'^%s (\S+)$' % re.escape(name), text, re.MULTILINE)
+    return float(match.group(1)) if match else 0.0
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_batches_report_time_by_stage(upload, style, tmp_path, workers):
+    _, stats = render_batch(upload, ["One", "Two 👋", "Three"], style, 'photo', workers=workers,
+                            output_dir=str(tmp_path), use_cache=False)
+    stages = stats['stages']
+    for stage in ('decode', 'wrap', 'layout', 'draw', 'composite', 'encode', 'write', 'preview'):
+        assert stages[stage] > 0, stage
+    # Pipeline order
+    assert list(stages) == [stage for stage in app_module.STAGES if stage in stages]
+
+def test_metrics_endpoint(upload, style, tmp_path):
+    client = app.test_client()
+    before = client.get('/metrics').get_data(as_text=True)
+    render_batch(upload, ["One", "Two"], style, 'photo', output_dir=str(tmp_path))
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain; version=0.0.4')
+    text = response.get_data(as_text=True)
+    assert '# TYPE imgtool_stage_seconds histogram' in text
+    assert sample(text, 'imgtool_rows_total{status="rendered"}') - sample(before, 'imgtool_rows_total{status="rendered"}') == 2
+    assert sample(text, 'imgtool_stage_seconds_count{stage="encode"}') >= 2
+    assert sample(text, 'imgtool_batches_total') == sample(before, 'imgtool_batches_total') + 1
+    assert 'imgtool_render_cache_lookups_total{result="miss"}' in text
+    assert 'imgtool_cache_hits_total{cache="layout"}' in text
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram('test_seconds', "Test.", ('stage',), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5.0):
+        histogram.observe(value, stage='draw')
+    samples = {(name, labels[-1][1] if name.endswith('_bucket') else None): value
+               for name, labels, value in histogram.samples()}
+    assert samples[('test_seconds_bucket', '0.1')] == 1
+    assert samples[('test_seconds_bucket', '1.0')] == 2
+    assert samples[('test_seconds_bucket', '+Inf')] == 3
+    assert samples[('test_seconds_count', None)] == 3
+    assert samples[('test_seconds_sum', None)] == pytest.approx(5.55)
+
+def test_collections_nest():
+    with collect_stages() as outer:
+        with timed('decode'):
+            pass
+        with collect_stages() as inner:
+            with timed('draw'):
+                pass
+    assert set(outer) == {'decode'}
+    assert set(inner) == {'draw'}
+
+def test_nested_stages_are_counted_once():
+    start = time.perf_counter()
+    with collect_stages() as timings:
+        with timed('layout'):
+            time.sleep(0.02)
+            with timed('font_load'):
+                time.sleep(0.05)
+    elapsed = time.perf_counter() - start
+    assert timings['font_load'] >= 0.05
+    assert timings['layout'] >= 0.02
+    # Had layout kept the font load, the two stages would add up to more than the whole block took
+    assert timings['layout'] + timings['font_load'] <= elapsed
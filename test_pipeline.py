@@ -0,0 +1,122 @@
+import os
+import threading
+import pytest
+from PIL import Image
+import app as app_module
+from app import _prefetch, parse_style, render_batch
+
+TEXTS = [f"Row {i} of the sheet" for i in range(12)]
+TEXTS[5] = None
+SERIAL = {'fetch_ahead': 1, 'draw': 1, 'encode': 1, 'write': 1, 'depth': 1}
+WIDE = {'fetch_ahead': 4, 'draw': 3, 'encode': 3, 'write': 2, 'depth': 6}
+
+@pytest.fixture
+def upload(tmp_path):
+    path = tmp_path / 'photo.png'
+    Image.new('RGB', (240, 160), (20, 80, 40)).save(path)
+    return str(path)
+
+@pytest.fixture
+def style():
+    return parse_style({'font_name': 'ProximaNova-Bold.ttf', 'font_size': '18',
+                        'text_width': '220', 'text_background': 'on'})
+
+def test_stages_in_parallel_match_one_at_a_time(upload, style, tmp_path):
+    outputs = {}
+    for label, pipeline in (('serial', SERIAL), ('wide', WIDE)):
+        out_dir = tmp_path / label
+        out_dir.mkdir()
+        results, stats = render_batch(upload, TEXTS + TEXTS[:2], style, 'photo', output_dir=str(out_dir),
+                                      pipeline=pipeline)
+        assert (stats['rendered'], stats['failed']) == (13, 1)
+        # Repeated texts are read ahead of their first row's commit, and still rendered once
+        assert (stats['cache_misses'], stats['cache_hits']) == (11, 2)
+        outputs[label] = [(r['filename'], (out_dir / r['filename']).read_bytes()) for r in results]
+        assert sorted(f for f in os.listdir(out_dir) if not f.startswith('.')) == [f for f, _ in outputs[label]]
+    assert outputs['serial'] == outputs['wide']
+
+def test_repeated_texts_are_not_linked_from_replaced_outputs(upload, style, tmp_path):
+    first = []
+
+    def progress(event):
+        if event['row'] == 1:
+            # Another batch with the same image name replaces the first output
+            path = tmp_path / event['filename']
+            first.append(path.read_bytes())
+            other = tmp_path / 'other.png'
+            Image.new('RGB', (240, 160), 'red').save(other)
+            os.replace(other, path)
+
+    results, stats = render_batch(upload, ["Mine", "Other", "Mine"], style, 'photo', output_dir=str(tmp_path),
+                                  progress=progress)
+    assert stats['cache_hits'] == 1
+    assert (tmp_path / results[2]['filename']).read_bytes() == first[0]
+    assert not [f for f in os.listdir(tmp_path) if f.startswith('.') and f.endswith('.png')]
+
+def test_rows_in_flight_are_bounded(upload, style, tmp_path, monkeypatch):
+    taken = []
+    committed = []
+    ahead = []
+
+    def texts():
+        for i in range(40):
+            taken.append(i)
+            yield f"Text {i}"
+
+    def progress(event):
+        committed.append(event['row'])
+        ahead.append(len(taken) - len(committed))
+
+    render_batch(upload, texts(), style, 'photo', output_dir=str(tmp_path), use_cache=False, progress=progress,
+                 pipeline={'fetch_ahead': 2, 'depth': 3, 'encode': 2})
+    assert len(committed) == 40
+    # Rows in the pipeline, in the fetch queue and the one the reader holds
+    assert max(ahead) <= 3 + 2 + 1
+
+def test_failed_stage_fails_its_row(upload, style, tmp_path, monkeypatch):
+    encode = app_module.encode_output
+
+    def flaky(image, output=None):
+        if threading.current_thread().name.startswith('batch-encode') and flaky.calls.pop(0):
+            raise OSError("disk full")
+        return encode(image, output)
+    flaky.calls = [False, True, False]
+    monkeypatch.setattr(app_module, 'encode_output', flaky)
+    results, stats = render_batch(upload, ["One", "Two", "Three"], style, 'photo', output_dir=str(tmp_path),
+                                  use_cache=False)
+    assert stats['failed'] == 1
+    assert [r['filename'] for r in results] == ['photo_HD-01.png', 'photo_HD-02.png']
+
+def test_invalid_pipeline(upload, style, tmp_path):
+    with pytest.raises(ValueError):
+        render_batch(upload, TEXTS, style, 'photo', output_dir=str(tmp_path), pipeline={'draw': 0})
+    with pytest.raises(ValueError):
+        render_batch(upload, TEXTS, style, 'photo', output_dir=str(tmp_path), pipeline={'paint': 2})
+
+def test_prefetch_reads_ahead_in_a_thread():
+    read = []
+
+    def items():
+        try:
+            for i in range(100):
+                read.append(threading.current_thread().name)
+                yield i
+        finally:
+            read.append('closed')
+
+    prefetched = _prefetch(items(), 5)
+    assert [next(prefetched) for _ in range(3)] == [0, 1, 2]
+    prefetched.close()
+    assert read[0] == 'batch-fetch'
+    assert read[-1] == 'closed'
+    assert len(read) <= 3 + 5 + 2
+
+def test_prefetch_raises_reader_errors():
+    def items():
+        yield 1
+        raise KeyError('sheet')
+
+    prefetched = _prefetch(items(), 5)
+    assert next(prefetched) == 1
+    with pytest.raises(KeyError):
+        next(prefetched)
@@ -0,0 +1,86 @@
+import io
+import os
+import pytest
+from PIL import Image
+import app as app_module
+from app import app, claim_preview, preview_superseded
+
+FONT = 'ProximaNova-Bold.ttf'
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(app_module, 'UPLOADS_DIR', str(tmp_path / 'uploads'))
+    monkeypatch.setattr(app_module, '_preview_bases', app_module.LRUCache(app_module.PREVIEW_BASES_SIZE))
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        yield client
+
+def upload(client, size=(2400, 1600), fmt='JPEG'):
+    image = io.BytesIO()
+    Image.new('RGB', size, (20, 40, 160)).save(image, fmt)
+    image.seek(0)
+    response = client.post('/uploads', data={'image_file': (image, 'photo.jpg')}, content_type='multipart/form-data')
+    assert response.status_code == 201
+    return response.get_json()
+
+def preview_params(upload_id, **overrides):
+    return dict({'upload_id': upload_id, 'text': 'Hello preview', 'font_name': FONT, 'font_size': '120',
+                 'text_x': '200', 'text_y': '200', 'text_width': '2000', 'text_background': 'on',
+                 'text_background_color': '#ff0000'}, **overrides)
+
+def test_preview_is_small_and_drawn_in_place(client):
+    info = upload(client)
+    assert info['original_size'] == [2400, 1600]
+    response = client.get('/preview', query_string=preview_params(info['upload_id']))
+    assert response.status_code == 200
+    assert response.mimetype == 'image/jpeg'
+    assert 'encode;dur=' in response.headers['Server-Timing']
+    image = Image.open(io.BytesIO(response.data))
+    assert image.size == (1024, 683)
+    # The text box was given in the uploaded image's pixels and is scaled with it
+    red, _, blue = image.getpixel((511, 72))  # In the background above the centred text
+    assert red > 200 and blue < 60
+    red, _, blue = image.getpixel((40, 40))
+    assert blue > 120
+
+def test_decoded_once_per_upload(client, monkeypatch):
+    opened = []
+    real_open = Image.open
+    monkeypatch.setattr(app_module.Image, 'open', lambda path, *args: opened.append(path) or real_open(path, *args))
+    info = upload(client)
+    for size in ('60', '80', '100'):
+        client.get('/preview', query_string=preview_params(info['upload_id'], font_size=size))
+    # Once when it arrived, to read its header, and once at preview size
+    assert len(opened) == 2
+
+def test_webp_and_smaller_sizes(client):
+    info = upload(client, size=(300, 200), fmt='PNG')
+    response = client.post('/preview', data=preview_params(info['upload_id'], format='webp', max_side='150'))
+    assert response.mimetype == 'image/webp'
+    assert Image.open(io.BytesIO(response.data)).size == (150, 100)
+
+def test_overtaken_requests_are_not_rendered(client):
+    info = upload(client, size=(300, 200))
+    params = preview_params(info['upload_id'], session='editor-1')
+    assert client.get('/preview', query_string=dict(params, seq='5')).status_code == 200
+    assert client.get('/preview', query_string=dict(params, seq='4')).status_code == 204
+    assert client.get('/preview', query_string=dict(params, seq='6')).status_code == 200
+    # Other sessions are independent
+    assert client.get('/preview', query_string=dict(params, session='editor-2', seq='1')).status_code == 200
+
+def test_overtaken_while_rendering():
+    assert claim_preview('s', 1)
+    assert not preview_superseded('s', 1)
+    assert claim_preview('s', 2)
+    assert preview_superseded('s', 1)
+    assert not claim_preview('s', 1)
+    assert claim_preview(None, 0) and not preview_superseded(None, 0)
+
+def test_bad_requests(client):
+    assert client.get('/preview', query_string={'upload_id': '0' * 64}).status_code == 404
+    info = upload(client, size=(300, 200))
+    assert client.get('/preview', query_string=preview_params(info['upload_id'], format='gif')).status_code == 400
+    assert client.get('/preview', query_string=preview_params(info['upload_id'], font_size='big')).status_code == 400
+    response = client.post('/uploads', data={'image_file': (io.BytesIO(b'nope'), 'x.png')},
+                           content_type='multipart/form-data')
+    assert response.status_code == 400
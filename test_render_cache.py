@@ -0,0 +1,101 @@
+import errno
+import os
+import pytest
+from PIL import Image
+import app as app_module
+from app import parse_style, render_batch, RenderCache, file_digest, render_key
+
+TEXTS = ["Same text", "Other text", "Same text"]
+
+@pytest.fixture
+def upload(tmp_path):
+    path = tmp_path / 'photo.png'
+    Image.new('RGB', (240, 160), (90, 30, 60)).save(path)
+    return str(path)
+
+@pytest.fixture
+def style():
+    return parse_style({
+        'font_name': 'ProximaNova-Bold.ttf',
+        'font_size': '20',
+        'text_width': '220',
+        'text_background': 'on',
+    })
+
+@pytest.fixture
+def out_dir(tmp_path):
+    path = tmp_path / 'outputs'
+    path.mkdir()
+    return path
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_rerun_is_served_from_cache(upload, style, out_dir, workers):
+    first, stats = render_batch(upload, TEXTS, style, 'photo', workers=workers, output_dir=str(out_dir))
+    contents = [(out_dir / r['filename']).read_bytes() for r in first]
+    assert stats['cache_misses'] + stats['cache_hits'] == 3
+
+    second, stats = render_batch(upload, TEXTS, style, 'photo', workers=workers, output_dir=str(out_dir))
+    assert stats['cache_hits'] == 3
+    assert stats['cache_hit_rate'] == 1.0
+    assert [(out_dir / r['filename']).read_bytes() for r in second] == contents
+    assert all(r['preview'] for r in second)
+
+def test_duplicate_texts_render_once(upload, style, out_dir):
+    _, stats = render_batch(upload, TEXTS, style, 'photo', output_dir=str(out_dir))
+    assert (stats['cache_misses'], stats['cache_hits']) == (2, 1)
+    first, third = out_dir / 'photo_HD-01.png', out_dir / 'photo_HD-03.png'
+    assert first.read_bytes() == third.read_bytes()
+    assert os.path.samefile(first, third)
+
+def test_key_covers_style_and_normalizes_colours(upload, style):
+    digest = file_digest(upload)
+    key = render_key(digest, "Text", style)
+    assert render_key(digest, "Text", dict(style, font_color='#FFFFFF')) == key
+    assert render_key(digest, "Text", dict(style, font_color='#fffffe')) != key
+    assert render_key(digest, "Text", dict(style, bg_corner_radius=6)) != key
+    assert render_key(digest, "Text", style, app_module.parse_output_format({'output_format': 'jpeg'})) != key
+    assert render_key("other image", "Text", style) != key
+
+def test_copies_when_hardlinks_fail(upload, style, out_dir, monkeypatch):
+    def no_links(src, dest):
+        raise OSError(errno.EXDEV, "Invalid cross-device link")
+    monkeypatch.setattr(app_module.os, 'link', no_links)
+    render_batch(upload, TEXTS, style, 'photo', output_dir=str(out_dir))
+    _, stats = render_batch(upload, TEXTS, style, 'photo', output_dir=str(out_dir))
+    assert stats['cache_hits'] == 3
+    assert not os.path.samefile(out_dir / 'photo_HD-01.png', out_dir / 'photo_HD-03.png')
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = RenderCache(str(tmp_path / 'cache'), max_bytes=250)
+    for i, key in enumerate(['aa01', 'bb02']):
+        src = tmp_path / f'{key}.png'
+        src.write_bytes(b'x' * 100)
+        cache.store(key, '.png', str(src))
+        os.utime(cache._path(key, '.png'), (1000 + i, 1000 + i))
+    # Using the older entry makes it the most recent
+    assert cache.fetch('aa01', '.png', str(tmp_path / 'hit.png')) == 100
+    src = tmp_path / 'cc03.png'
+    src.write_bytes(b'x' * 100)
+    cache.store('cc03', '.png', str(src))
+    assert cache.fetch('bb02', '.png', str(tmp_path / 'miss.png')) is None
+    assert cache.fetch('aa01', '.png', str(tmp_path / 'hit2.png')) == 100
+    assert cache.stats()['bytes'] == 200
+
+def test_eviction_leaves_stores_in_flight_alone(tmp_path):
+    cache = RenderCache(str(tmp_path / 'cache'), max_bytes=150)
+    in_flight = tmp_path / 'cache' / 'dd' / 'dd04.png.0123.tmp'
+    in_flight.parent.mkdir(parents=True)
+    in_flight.write_bytes(b'x' * 100)
+    os.utime(in_flight, (1000, 1000))
+    for key in ['aa01', 'bb02']:
+        src = tmp_path / f'{key}.png'
+        src.write_bytes(b'x' * 100)
+        cache.store(key, '.png', str(src))
+    assert in_flight.exists()
+    assert cache.fetch('aa01', '.png', str(tmp_path / 'miss.png')) is None
+    assert cache.stats()['bytes'] == 100
+
+def test_cache_can_be_skipped(upload, style, out_dir):
+    _, stats = render_batch(upload, TEXTS, style, 'photo', output_dir=str(out_dir), use_cache=False)
+    assert stats['cache_hits'] == stats['cache_misses'] == 0
+    assert not (out_dir / '.render-cache').exists()
@@ -0,0 +1,98 @@
+import json
+import os
+import pytest
+from PIL import Image
+import render_cli
+
+@pytest.fixture
+def setup(tmp_path):
+    Image.new('RGB', (240, 160), (90, 30, 60)).save(tmp_path / 'photo.png')
+    (tmp_path / 'style.json').write_text(json.dumps({
+        'font_name': 'ProximaNova-Bold.ttf',
+        'font_size': 20,
+        'text_width': 220,
+        'text_background': True,
+        'output_format': 'jpeg',
+    }))
+    (tmp_path / 'texts.csv').write_text("text\nFirst\nSecond\nThird\n")
+    return tmp_path
+
+def run(tmp_path, capsys, *args):
+    code = render_cli.main([str(tmp_path / 'photo.png'), '--style', str(tmp_path / 'style.json'),
+                            '--out', str(tmp_path / 'out'), *args])
+    return code, json.loads(capsys.readouterr().out)
+
+def test_renders_a_local_source(setup, capsys):
+    code, summary = run(setup, capsys, '--source', f"csv:{setup / 'texts.csv'}", '--summary', str(setup / 's.json'))
+    assert code == 0
+    assert (summary['status'], summary['rows'], summary['rendered'], summary['failed']) == ('done', 3, 3, 0)
+    assert summary['format'] == 'jpeg'
+    assert 'encode' in summary['stages']
+    assert json.loads((setup / 's.json').read_text()) == summary
+    assert sorted(name for name in os.listdir(setup / 'out') if not name.startswith('.')) == [
+        'photo_HD-01.jpg', 'photo_HD-02.jpg', 'photo_HD-03.jpg']
+    # Thumbnails and manifests are only for the web results page
+    assert not os.path.exists(setup / 'out' / '.previews')
+    assert not os.path.exists(setup / 'out' / '.batches')
+
+def test_resume_keeps_finished_rows(setup, capsys):
+    source = f"csv:{setup / 'texts.csv'}"
+    run(setup, capsys, '--source', source, '--no-cache')
+    os.remove(setup / 'out' / 'photo_HD-02.jpg')
+    (setup / 'out' / ('.' + 'a' * 32 + '-1.jpg')).write_bytes(b'partial')
+    kept = os.stat(setup / 'out' / 'photo_HD-01.jpg').st_mtime_ns
+    code, summary = run(setup, capsys, '--source', source, '--no-cache', '--resume')
+    assert code == 0
+    assert (summary['rendered'], summary['resumed']) == (3, 2)
+    assert os.path.exists(setup / 'out' / 'photo_HD-02.jpg')
+    assert os.stat(setup / 'out' / 'photo_HD-01.jpg').st_mtime_ns == kept
+    assert not any(name.startswith('.a') for name in os.listdir(setup / 'out'))
+
+def test_failures_are_reported_and_keep_their_row_number(setup, capsys):
+    (setup / 'texts.jsonl').write_text('"First"\n{"text": null}\n"Third"\n')
+    code, summary = run(setup, capsys, '--source', f"jsonl:{setup / 'texts.jsonl'}")
+    assert code == 1
+    assert summary['failed'] == 1
+    assert summary['failures'][0]['row'] == 2
+    assert os.path.exists(setup / 'out' / 'photo_HD-03.jpg')
+    assert not os.path.exists(setup / 'out' / 'photo_HD-02.jpg')
+
+def test_several_sheets(setup, capsys):
+    (setup / 'sheets').mkdir()
+    (setup / 'sheets' / 'Promo.csv').write_text("One\nTwo\n")
+    (setup / 'sheets' / 'Sale.csv').write_text("Three\n")
+    code, summary = run(setup, capsys, '--source', f"csv:{setup / 'sheets'}", '--all-sheets', '--workers', '2')
+    assert code == 0
+    assert summary['sheets']['Promo']['rendered'] == 2
+    assert os.path.exists(setup / 'out' / 'photo_Sale_HD-01.jpg')
+
+def test_pipeline_option(setup, capsys):
+    code, summary = run(setup, capsys, '--source', f"csv:{setup / 'texts.csv'}", '--pipeline', 'encode=3,depth=2')
+    assert (code, summary['rendered']) == (0, 3)
+    with pytest.raises(SystemExit):
+        run(setup, capsys, '--pipeline', 'paint=2')
+
+def test_several_images(setup, capsys):
+    Image.new('RGB', (300, 160), (30, 90, 60)).save(setup / 'wide.png')
+    style = json.loads((setup / 'style.json').read_text())
+    (setup / 'style.json').write_text(json.dumps(dict(style, text_boxes=[None, {'text_width': 280}])))
+    code = render_cli.main([str(setup / 'photo.png'), str(setup / 'wide.png'), '--style', str(setup / 'style.json'),
+                            '--out', str(setup / 'out'), '--source', f"csv:{setup / 'texts.csv'}"])
+    summary = json.loads(capsys.readouterr().out)
+    assert (code, summary['rendered']) == (0, 6)
+    assert summary['templates']['wide']['rendered'] == 3
+    assert (setup / 'out' / 'wide_HD-03.jpg').exists()
+
+@pytest.mark.parametrize("source", ['nosuch:texts.csv', 'csv:missing.csv'])
+def test_failed_runs_still_print_a_summary(setup, capsys, source):
+    code, summary = run(setup, capsys, '--source', source)
+    assert code == 1
+    assert summary['status'] == 'failed'
+    assert summary['error']
+
+def test_missing_image(setup, capsys):
+    code = render_cli.main([str(setup / 'missing.png'), '--style', str(setup / 'style.json'),
+                            '--out', str(setup / 'out'), '--source', f"csv:{setup / 'texts.csv'}"])
+    summary = json.loads(capsys.readouterr().out)
+    assert code == 1
+    assert (summary['status'], summary['rendered']) == ('failed', 0)
@@ -0,0 +1,183 @@
+import threading
+import time
+import pytest
+import gspread
+import app as app_module
+from app import (TTLCache, get_all_sheets, get_texts_from_sheet, get_texts_from_sheets, iter_texts_from_sheet,
+                 get_sample_text_from_sheet, invalidate_sheets_cache, app, collect_stages)
+
+class FakeWorksheet:
+    def __init__(self, title, values, calls):
+        self.title = title
+        self.values = values
+        self.calls = calls
+
+    def col_values(self, col):
+        self.calls['col_values'] += 1
+        time.sleep(0.05)
+        return list(self.values)
+
+class PagedWorksheet:
+    """Answers A-column range reads the way the Sheets API does."""
+    def __init__(self, values, row_count=None):
+        self.title = 'Long'
+        self.values = values
+        self.row_count = row_count or len(values)
+        self.ranges = []
+
+    def get(self, range_name):
+        self.ranges.append(range_name)
+        first, last = (int(cell[1:]) for cell in range_name.split(':'))
+        rows = [[value] if value else [] for value in self.values[first - 1:last]]
+        # Trailing empty rows are left out
+        while rows and not rows[-1]:
+            rows.pop()
+        return rows
+
+    def col_values(self, col):
+        values = list(self.values)
+        while values and not values[-1]:
+            values.pop()
+        return values
+
+class FakeSpreadsheet:
+    def __init__(self, calls):
+        self.calls = calls
+        self.sheets = [
+            FakeWorksheet('Sheet1', ['text', 'Hello', 'World'], calls),
+            FakeWorksheet('Promo', ['Sale!'], calls),
+        ]
+
+    def worksheets(self):
+        self.calls['worksheets'] += 1
+        time.sleep(0.05)
+        return self.sheets
+
+    def values_batch_get(self, ranges, params=None):
+        self.calls['values_batch_get'] += 1
+        assert params == {'majorDimension': 'COLUMNS'}
+        by_range = {f"'{sheet.title}'!A:A": sheet.values for sheet in self.sheets}
+        return {'valueRanges': [{'range': r, 'values': [by_range[r]]} for r in ranges]}
+
+class FakeClient:
+    def __init__(self, calls):
+        self.calls = calls
+
+    def open_by_key(self, key):
+        self.calls['open_by_key'] += 1
+        return FakeSpreadsheet(self.calls)
+
+@pytest.fixture
+def calls(monkeypatch):
+    calls = {'authorize': 0, 'open_by_key': 0, 'worksheets': 0, 'col_values': 0, 'values_batch_get': 0}
+
+    def authorize(credentials):
+        calls['authorize'] += 1
+        return FakeClient(calls)
+
+    monkeypatch.setattr(app_module.ServiceAccountCredentials, 'from_json_keyfile_name', lambda *args: object())
+    monkeypatch.setattr(app_module.gspread, 'authorize', authorize)
+    monkeypatch.setattr(app_module, '_sheets_client', None)
+    monkeypatch.setattr(app_module, '_sheets_cache', TTLCache(60))
+    return calls
+
+def test_client_is_authorized_once(calls):
+    assert get_all_sheets() == ['Sheet1', 'Promo']
+    assert get_texts_from_sheet('Sheet1') == ['Hello', 'World']
+    assert get_texts_from_sheet('Promo') == ['Sale!']
+    assert get_all_sheets() == ['Sheet1', 'Promo']
+    assert calls == {'authorize': 1, 'open_by_key': 1, 'worksheets': 1, 'col_values': 2, 'values_batch_get': 0}
+
+def test_concurrent_requests_are_coalesced(calls):
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(get_texts_from_sheet('Sheet1'))) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [['Hello', 'World']] * 20
+    assert calls['worksheets'] == 1
+    assert calls['col_values'] == 1
+
+def test_returned_texts_are_copies(calls):
+    texts = get_texts_from_sheet('Sheet1')
+    texts.append('mutated')
+    assert get_texts_from_sheet('Sheet1') == ['Hello', 'World']
+
+def test_invalidate_refetches(calls):
+    get_texts_from_sheet('Sheet1')
+    invalidate_sheets_cache()
+    get_texts_from_sheet('Sheet1')
+    assert calls['col_values'] == 2
+    assert calls['authorize'] == 1
+
+def test_refresh_route(calls):
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        get_all_sheets()
+        response = client.post('/sheets/refresh')
+        assert response.get_json() == ['Sheet1', 'Promo']
+    assert calls['worksheets'] == 2
+
+def test_sheets_are_fetched_in_one_request(calls):
+    assert get_texts_from_sheets() == {'Sheet1': ['Hello', 'World'], 'Promo': ['Sale!']}
+    assert get_texts_from_sheets(['Promo']) == {'Promo': ['Sale!']}
+    assert calls['values_batch_get'] == 2
+    assert calls['col_values'] == 0
+    assert calls['open_by_key'] == 1
+    with pytest.raises(gspread.WorksheetNotFound):
+        get_texts_from_sheets(['Promo', 'Missing'])
+
+def test_requests_are_timed_once(calls):
+    with collect_stages() as timings:
+        start = time.perf_counter()
+        get_texts_from_sheet('Sheet1')
+        elapsed = time.perf_counter() - start
+    # Each request is timed, not the loaders that wait for other requests
+    assert 0.1 <= timings['sheets_fetch'] <= elapsed
+
+def test_unknown_worksheet(calls):
+    with pytest.raises(gspread.WorksheetNotFound):
+        get_texts_from_sheet('Missing')
+
+def test_ttl_expiry_and_errors_are_not_cached():
+    cache = TTLCache(0.05)
+    loads = []
+    assert cache.get_or_load('k', lambda: loads.append(1) or 'v') == 'v'
+    assert cache.get_or_load('k', lambda: loads.append(1) or 'v') == 'v'
+    time.sleep(0.06)
+    cache.get_or_load('k', lambda: loads.append(1) or 'v')
+    assert len(loads) == 2
+
+    def failing():
+        raise RuntimeError('quota')
+    with pytest.raises(RuntimeError):
+        cache.get_or_load('bad', failing)
+    assert cache.get_or_load('bad', lambda: 'ok') == 'ok'
+
+@pytest.mark.parametrize('page_size', [1, 2, 3, 1000])
+def test_paged_reads_match_col_values(monkeypatch, page_size):
+    values = ['text', 'One', '', '', 'Two', 'Three', '', 'Four', '', '']
+    worksheet = PagedWorksheet(values, row_count=12)
+    monkeypatch.setattr(app_module, '_get_worksheet', lambda sheet_name: worksheet)
+    monkeypatch.setattr(app_module, '_sheets_cache', TTLCache(60))
+    assert list(iter_texts_from_sheet('Long', page_size=page_size)) == get_texts_from_sheet('Long')
+
+def test_paged_reads_stream(monkeypatch):
+    worksheet = PagedWorksheet([f'Row {i}' for i in range(100000)])
+    monkeypatch.setattr(app_module, '_get_worksheet', lambda sheet_name: worksheet)
+    texts = iter_texts_from_sheet('Long', page_size=500)
+    assert next(texts) == 'Row 0'
+    # The first page plus at most the one being prefetched
+    assert len(worksheet.ranges) <= 2
+    assert worksheet.ranges[0] == 'A1:A500'
+    assert sum(1 for _ in texts) == 99999
+    assert worksheet.ranges[-1] == 'A99501:A100000'
+
+def test_sample_text_reads_two_cells(monkeypatch):
+    worksheet = PagedWorksheet(['text', 'Hello', 'World'])
+    monkeypatch.setattr(app_module, '_get_worksheet', lambda sheet_name: worksheet)
+    monkeypatch.setattr(app_module, '_sheets_cache', TTLCache(60))
+    assert get_sample_text_from_sheet('Long') == 'Hello'
+    assert get_sample_text_from_sheet('Long') == 'Hello'
+    assert worksheet.ranges == ['A1:A2']
@@ -0,0 +1,84 @@
+import io
+import os
+import zipfile
+import pytest
+from PIL import Image
+import app as app_module
+from app import app, layout_cache_stats, parse_style, render_templates, template_styles
+
+TEXTS = ["Summer sale", "Everything must go", None]
+
+@pytest.fixture
+def outputs(tmp_path, monkeypatch):
+    out_dir = tmp_path / 'outputs'
+    out_dir.mkdir()
+    monkeypatch.setattr(app_module, 'OUTPUTS_DIR', str(out_dir))
+    app_module._layout_cache.clear()
+    return out_dir
+
+@pytest.fixture
+def style():
+    return parse_style({'font_name': 'ProximaNova-Bold.ttf', 'font_size': '18',
+                        'text_width': '200', 'text_background': 'on'})
+
+def make_templates(tmp_path, style, colours=('purple', 'teal')):
+    templates = []
+    for i, colour in enumerate(colours):
+        path = tmp_path / f'bg_{colour}.png'
+        Image.new('RGB', (240, 160), colour).save(path)
+        # Same box width and font in another place: the layouts are shared
+        templates.append((f'bg_{colour}', str(path), dict(style, text_x=10 * i, text_y=20 * i)))
+    return templates
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_every_text_on_every_template(outputs, tmp_path, style, workers):
+    texts_read = []
+
+    def texts():
+        for text in TEXTS:
+            texts_read.append(text)
+            yield text
+
+    results, stats = render_templates(make_templates(tmp_path, style), [(None, texts())], workers=workers)
+    assert texts_read == TEXTS
+    assert [(r['template'], r['filename']) for r in results] == [
+        ('bg_purple', 'bg_purple_HD-01.png'), ('bg_teal', 'bg_teal_HD-01.png'),
+        ('bg_purple', 'bg_purple_HD-02.png'), ('bg_teal', 'bg_teal_HD-02.png')]
+    assert (stats['rows'], stats['rendered'], stats['failed']) == (6, 4, 2)
+    assert stats['templates'] == {'bg_purple': {'rows': 3, 'rendered': 2, 'failed': 1},
+                                  'bg_teal': {'rows': 3, 'rendered': 2, 'failed': 1}}
+    purple = Image.open(outputs / 'bg_purple_HD-01.png')
+    teal = Image.open(outputs / 'bg_teal_HD-01.png')
+    assert purple.getpixel((239, 159)) != teal.getpixel((239, 159))
+
+def test_templates_with_the_same_box_share_layouts(outputs, tmp_path, style):
+    templates = make_templates(tmp_path, style)
+    templates.append(('narrow', templates[0][1], dict(style, text_width=120)))
+    before = layout_cache_stats()
+    render_templates(templates, [(None, TEXTS[:2])], use_cache=False)
+    after = layout_cache_stats()
+    # One layout per text for the two 200px boxes and one per text for the narrow one
+    assert after['misses'] - before['misses'] == 4
+    assert after['hits'] - before['hits'] == 2
+
+def test_archive_has_a_folder_per_template_and_sheet(outputs, tmp_path, style):
+    templates = make_templates(tmp_path, style)
+    templates.append(('bg_purple', templates[0][1], style))  # Same name again
+    _, stats = render_templates(templates, [('Sheet1', ["one"]), ('Promo', ["sale"])])
+    with app.test_client() as client:
+        response = client.get(f"/download/batch/{stats['batch_id']}.zip")
+    assert zipfile.ZipFile(io.BytesIO(response.data)).namelist() == [
+        'bg_purple/Sheet1/bg_purple_Sheet1_HD-01.png', 'bg_teal/Sheet1/bg_teal_Sheet1_HD-01.png',
+        'bg_purple-2/Sheet1/bg_purple-2_Sheet1_HD-01.png', 'bg_purple/Promo/bg_purple_Promo_HD-01.png',
+        'bg_teal/Promo/bg_teal_Promo_HD-01.png', 'bg_purple-2/Promo/bg_purple-2_Promo_HD-01.png']
+    assert stats['sheets'] == {'Sheet1': {'rows': 3, 'rendered': 3, 'failed': 0},
+                               'Promo': {'rows': 3, 'rendered': 3, 'failed': 0}}
+
+def test_template_styles(style):
+    styles = template_styles({'text_boxes': '[{"text_x": 5, "text_width": "90"}, null]'}, style, 3)
+    assert (styles[0]['text_x'], styles[0]['text_width'], styles[0]['text_y']) == (5, 90, style['text_y'])
+    assert styles[1] == styles[2] == style
+    assert template_styles({}, style, 2) == [style, style]
+    for boxes in ('{"text_x": 5}', '[null, null]', '[{"font_size": 90}]', '[{"text_x": "left"}]', '[{'):
+        with pytest.raises(ValueError):
+            template_styles({'text_boxes': boxes}, style, 1)
@@ -0,0 +1,90 @@
+import sqlite3
+import pytest
+import app as app_module
+from app import app, get_text_source, CSVSource, JSONLSource, SQLiteSource, GoogleSheetsSource
+
+@pytest.fixture
+def sources_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(app_module, 'TEXT_SOURCES_DIR', str(tmp_path))
+    (tmp_path / 'campaign.csv').write_text('text,notes\nHello 👋,a\n"Comma, inside",b\n\nLast,c\n', encoding='utf-8')
+    (tmp_path / 'rows.jsonl').write_text('"plain string"\n{"text": "from object"}\n\n{"other": 1}\n', encoding='utf-8')
+    sheets = tmp_path / 'sheets'
+    sheets.mkdir()
+    (sheets / 'Promo.csv').write_text('Sale!\n', encoding='utf-8')
+    (sheets / 'Winter.csv').write_text('Snow\nIce\n', encoding='utf-8')
+    with sqlite3.connect(tmp_path / 'texts.db') as conn:
+        conn.execute('CREATE TABLE spring (text TEXT, id INTEGER)')
+        conn.executemany('INSERT INTO spring VALUES (?, ?)', [('Bloom', 1), (None, 2), ('Rain', 3)])
+        conn.execute('CREATE TABLE summer (caption TEXT)')
+        conn.execute("INSERT INTO summer VALUES ('Sun')")
+    return tmp_path
+
+def test_csv_source(sources_dir):
+    source = get_text_source('csv:campaign.csv')
+    assert isinstance(source, CSVSource)
+    assert source.list_sheets() == ['campaign']
+    assert source.get_texts() == ['Hello 👋', 'Comma, inside', '', 'Last']
+    assert source.get_sample_text('campaign') == 'Hello 👋'
+
+def test_csv_directory_has_one_sheet_per_file(sources_dir):
+    source = get_text_source('csv:sheets')
+    assert source.list_sheets() == ['Promo', 'Winter']
+    assert source.get_texts('Winter') == ['Snow', 'Ice']
+    with pytest.raises(LookupError):
+        source.get_texts('Summer')
+
+def test_jsonl_source(sources_dir):
+    source = get_text_source('rows.jsonl')
+    assert isinstance(source, JSONLSource)
+    assert source.get_texts() == ['plain string', 'from object', '']
+
+def test_sqlite_source(sources_dir):
+    source = get_text_source('sqlite:texts.db')
+    assert isinstance(source, SQLiteSource)
+    assert source.list_sheets() == ['spring', 'summer']
+    assert source.get_texts('spring') == ['Bloom', '', 'Rain']
+    assert source.get_texts('summer') == ['Sun']
+    with pytest.raises(LookupError):
+        source.get_texts('spring; DROP TABLE spring')
+
+def test_default_source_is_google_sheets():
+    assert isinstance(get_text_source(), GoogleSheetsSource)
+    assert isinstance(get_text_source('gsheets'), GoogleSheetsSource)
+
+def test_request_sources_stay_inside_sources_dir(sources_dir, tmp_path):
+    with pytest.raises(ValueError):
+        get_text_source('csv:../campaign.csv')
+    with pytest.raises(ValueError):
+        get_text_source(f'csv:{sources_dir / "campaign.csv"}')
+    with pytest.raises(ValueError):
+        get_text_source('csv:missing.csv')
+    with pytest.raises(ValueError):
+        get_text_source('notes.txt')
+    # Configured sources are trusted and may use any path
+    assert get_text_source(f'csv:{sources_dir / "campaign.csv"}', trusted=True).get_texts()[0] == 'Hello 👋'
+
+def test_routes_use_requested_source(sources_dir):
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        assert client.get('/sheets?source=csv:sheets').get_json() == ['Promo', 'Winter']
+        response = client.get('/sample_text/Winter?source=csv:sheets')
+        assert response.get_json() == {'sample_text': 'Snow'}
+        response = client.get('/?source=sqlite:texts.db&sheet=summer')
+        assert response.status_code == 200
+        assert b'value="sqlite:texts.db"' in response.data
+        assert b'Sun' in response.data
+
+def test_sources_stream_texts(sources_dir):
+    texts = get_text_source('csv:campaign.csv').iter_texts()
+    assert next(texts) == 'Hello 👋'
+    texts.close()
+    texts = get_text_source('sqlite:texts.db').iter_texts('spring')
+    assert list(texts) == ['Bloom', '', 'Rain']
+    # Unknown sheets fail when asked for, not on first read
+    with pytest.raises(LookupError):
+        get_text_source('rows.jsonl').iter_texts('missing')
+
+def test_iter_sheets(sources_dir):
+    source = get_text_source('csv:sheets')
+    assert [(name, list(texts)) for name, texts in source.iter_sheets()] == [('Promo', ['Sale!']), ('Winter', ['Snow', 'Ice'])]
+    assert [name for name, _ in source.iter_sheets(['Winter'])] == ['Winter']
@@ -0,0 +1,72 @@
+import io
+import os
+import pytest
+from PIL import Image, JpegImagePlugin
+import app as app_module
+from app import get_upload, ingest_upload, parse_style, scale_style
+
+def image_bytes(size, fmt='PNG', colour=(120, 40, 200)):
+    data = io.BytesIO()
+    Image.new('RGB', size, colour).save(data, fmt)
+    return data.getvalue()
+
+def stored_files(uploads_dir):
+    return sorted(os.listdir(uploads_dir))
+
+def test_same_bytes_are_stored_once(tmp_path):
+    data = image_bytes((64, 48))
+    first = ingest_upload(io.BytesIO(data), str(tmp_path))
+    second = ingest_upload(io.BytesIO(data), str(tmp_path))
+    assert first == second
+    assert first['id'] == app_module.hashlib.sha256(data).hexdigest()
+    assert open(first['path'], 'rb').read() == data
+    assert (first['size'], first['scale']) == ((64, 48), 1.0)
+    assert stored_files(tmp_path) == [first['id'] + '.json', first['id'] + '.png']
+    assert get_upload(first['id'], str(tmp_path)) == first
+
+def test_oversized_images_are_downscaled_on_arrival(tmp_path, monkeypatch):
+    monkeypatch.setattr(app_module, 'MAX_UPLOAD_PIXELS', 100 * 75)
+    drafts = []
+    draft = JpegImagePlugin.JpegImageFile.draft
+    monkeypatch.setattr(JpegImagePlugin.JpegImageFile, 'draft',
+                        lambda self, mode, size: drafts.append(size) or draft(self, mode, size))
+    upload = ingest_upload(io.BytesIO(image_bytes((800, 600), 'JPEG')), str(tmp_path))
+    # Decoded at a reduced scale rather than in full
+    assert drafts
+    assert upload['original_size'] == (800, 600)
+    assert upload['size'] == (100, 75)
+    assert upload['scale'] == 0.125
+    with Image.open(upload['path']) as im:
+        assert (im.format, im.size) == ('JPEG', (100, 75))
+
+def test_downscaled_png(tmp_path, monkeypatch):
+    monkeypatch.setattr(app_module, 'MAX_UPLOAD_PIXELS', 2500)
+    upload = ingest_upload(io.BytesIO(image_bytes((300, 100))), str(tmp_path))
+    width, height = upload['size']
+    assert width * height <= 2500
+    assert abs(width / height - 3) < 0.1
+    assert upload['scale'] == width / 300
+    assert upload['path'].endswith('.png')
+
+def test_not_an_image(tmp_path):
+    with pytest.raises(ValueError):
+        ingest_upload(io.BytesIO(b'not an image'), str(tmp_path))
+    assert stored_files(tmp_path) == []
+
+def test_images_too_large_to_decode(tmp_path, monkeypatch):
+    monkeypatch.setattr(Image, 'MAX_IMAGE_PIXELS', 1000)
+    with pytest.raises(app_module.ImageTooLarge):
+        ingest_upload(io.BytesIO(image_bytes((100, 50))), str(tmp_path))
+    assert stored_files(tmp_path) == []
+
+def test_unknown_upload(tmp_path):
+    assert get_upload('0' * 64, str(tmp_path)) is None
+    assert get_upload('../secrets', str(tmp_path)) is None
+
+def test_styles_follow_the_downscaled_image():
+    style = parse_style({'font_size': '48', 'text_x': '400', 'text_y': '-20', 'text_width': '1600',
+                         'bg_corner_radius': '5'})
+    scaled = scale_style(style, 0.25)
+    assert (scaled['font_size'], scaled['text_x'], scaled['text_y'], scaled['text_width']) == (12, 100, -5, 400)
+    assert scaled['font_color'] == style['font_color']
+    assert scale_style(style, 1) is style